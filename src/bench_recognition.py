@@ -0,0 +1,469 @@
+"""
+识别流水线基准测试
+
+用PyMuPDF生成可复现的合成PDF（文本代码、图片中的代码、夹杂代码的普通文字、与大段文字同页且同为比例字体的代码），
+分别测量各阶段（版面提取、checkcode、extract_code_blocks_improved、postprocess_code_blocks、
+format_code、图片OCR）和端到端parse_pdf的吞吐与延迟，比较按等宽字体筛选代码行前后文本识别的耗时，
+统计页面初筛在各阈值下跳过的页数和召回损失，以及不同OCR预处理组合的耗时和字符准确率，
+结果以JSON输出，便于跟踪性能回退
+
+示例：python bench_recognition.py --pages 20 --output bench.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import fitz
+from text_to_code import checkcode, extract_code_blocks_improved, postprocess_code_blocks, format_code
+from pdf_test import (PageLayout, ImageOCRFilter, parse_pdf, get_reader, image_to_text, parse_preprocess_steps,
+                      recognize_page, document_uses_monospace, DEFAULT_OCR_PREPROCESS, DEFAULT_TRIAGE_THRESHOLD)
+from page_triage import triage_scores
+
+# 合成页面使用A4尺寸，代码使用等宽字体，正文使用比例字体
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+MARGIN = 56
+FONT_SIZE = 10
+LINE_HEIGHT = FONT_SIZE * 1.3
+# 把代码渲染为图片时的分辨率
+IMAGE_DPI = 150
+# 默认比较的OCR预处理组合：不预处理、默认步骤、默认步骤加二值化
+PREPROCESS_VARIANTS = "none;" + ",".join(DEFAULT_OCR_PREPROCESS) + ";" + ",".join(DEFAULT_OCR_PREPROCESS + ("binarize",))
+
+PAGE_KINDS = ("text", "image", "mixed", "slide", "prose")
+# 页面文本中含代码的页面类型，作为页面初筛召回率的标注
+CODE_PAGE_KINDS = ("text", "mixed", "slide")
+# 默认比较的页面初筛阈值
+TRIAGE_THRESHOLDS = (0.05, DEFAULT_TRIAGE_THRESHOLD, 0.25, 0.5)
+# 纯文字页的段落数
+PROSE_PARAGRAPHS = 4
+# slide页代码前的文字行数
+SLIDE_PROSE_LINES = 5
+
+NAMES = ["count", "total", "value", "index", "result", "buffer", "item", "node", "score", "limit"]
+PROSE = [
+    "This lecture introduces the basic control structures used in most programs.",
+    "Each example below is followed by a short discussion of its output.",
+    "Remember to compile with warnings enabled and read every message carefully.",
+    "The exercise at the end of the section asks you to extend the program.",
+    "Loops repeat a block of statements until the condition becomes false.",
+    "Functions let us name a computation and reuse it in several places.",
+]
+
+def _snippet_c(rng):
+    a, b = rng.sample(NAMES, 2)
+    n = rng.randint(3, 20)
+    return [
+        "#include <stdio.h>",
+        "int main() {",
+        f"    int {a} = 0;",
+        f"    for (int i = 0; i < {n}; i++) {{",
+        f"        {a} += i;",
+        "    }",
+        f"    printf(\"%d\\n\", {a});",
+        "    return 0;",
+        "}",
+    ]
+
+def _snippet_cpp(rng):
+    a = rng.choice(NAMES)
+    return [
+        "#include <iostream>",
+        "#include <vector>",
+        "using namespace std;",
+        "int main() {",
+        f"    vector<int> {a} = {{{', '.join(str(rng.randint(0, 99)) for _ in range(4))}}};",
+        f"    for (int x : {a}) {{",
+        "        cout << x << endl;",
+        "    }",
+        "    return 0;",
+        "}",
+    ]
+
+def _snippet_java(rng):
+    a = rng.choice(NAMES)
+    return [
+        "public class Main {",
+        "    public static void main(String[] args) {",
+        f"        int {a} = {rng.randint(1, 9)};",
+        f"        System.out.println(\"{a} = \" + {a});",
+        "    }",
+        "}",
+    ]
+
+def _snippet_python(rng):
+    a, b = rng.sample(NAMES, 2)
+    return [
+        "import math",
+        f"def compute_{a}({b}):",
+        f"    if {b} > {rng.randint(1, 9)}:",
+        f"        return math.sqrt({b})",
+        f"    return {b} * 2",
+        f"print(compute_{a}({rng.randint(1, 99)}))",
+    ]
+
+SNIPPETS = [_snippet_c, _snippet_cpp, _snippet_java, _snippet_python]
+
+def _insert_lines(page, lines, top, fontname="cour"):
+    """从top开始逐行写入文本，返回写完后的纵坐标"""
+    y = top
+    for line in lines:
+        page.insert_text((MARGIN, y), line, fontsize=FONT_SIZE, fontname=fontname)
+        y += LINE_HEIGHT
+    return y
+
+def _code_pixmap(lines):
+    """把代码渲染成一张图片（模拟幻灯片中的代码截图）"""
+    height = int(len(lines) * LINE_HEIGHT + 2 * FONT_SIZE)
+    scratch = fitz.open()
+    page = scratch.new_page(width=PAGE_WIDTH - 2 * MARGIN, height=height)
+    y = FONT_SIZE * 1.5
+    for line in lines:
+        page.insert_text((FONT_SIZE, y), line, fontsize=FONT_SIZE, fontname="cour")
+        y += LINE_HEIGHT
+    pixmap = page.get_pixmap(dpi=IMAGE_DPI)
+    scratch.close()
+    return pixmap
+
+def build_corpus(path, pages, kinds=PAGE_KINDS, seed=0):
+    """
+    生成合成PDF，每种页面类型各pages页，按类型轮流排列
+    :return: (每页的类型列表, 图片页的页号（从0开始） -> 图片中的代码原文)
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    layout = []
+    truths = {}
+    for _ in range(pages):
+        for kind in kinds:
+            page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+            code = rng.choice(SNIPPETS)(rng)
+            if kind == "text":
+                _insert_lines(page, code, MARGIN)
+            elif kind == "image":
+                y = _insert_lines(page, rng.sample(PROSE, 1), MARGIN, "helv")
+                pixmap = _code_pixmap(code)
+                width = PAGE_WIDTH - 2 * MARGIN
+                height = width * pixmap.height / pixmap.width
+                page.insert_image(fitz.Rect(MARGIN, y, MARGIN + width, y + height), pixmap=pixmap)
+                truths[len(layout)] = "\n".join(code)
+            elif kind == "mixed":
+                y = _insert_lines(page, rng.sample(PROSE, 3), MARGIN, "helv")
+                y = _insert_lines(page, code, y + LINE_HEIGHT)
+                _insert_lines(page, rng.sample(PROSE, 2), y + LINE_HEIGHT, "helv")
+            elif kind == "slide":
+                # 代码与文字用同一种比例字体，按等宽字体筛选不出代码行，只能从整页文本中识别
+                y = _insert_lines(page, rng.sample(PROSE, SLIDE_PROSE_LINES), MARGIN, "helv")
+                _insert_lines(page, code, y + LINE_HEIGHT, "helv")
+            else:
+                y = MARGIN
+                for _ in range(PROSE_PARAGRAPHS):
+                    y = _insert_lines(page, rng.sample(PROSE, len(PROSE)), y, "helv") + LINE_HEIGHT
+            layout.append(kind)
+    doc.save(path)
+    doc.close()
+    return layout, truths
+
+def peak_rss():
+    """进程峰值常驻内存（MB），无法获取时返回None"""
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS为字节
+        return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+def percentile(values, q):
+    """最近秩法求百分位数，values为空时返回None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+def summarize(name, latencies, pages=0, blocks=0, elapsed=None):
+    """汇总一个阶段的结果，latencies为每次调用的耗时（秒）"""
+    elapsed = sum(latencies) if elapsed is None else elapsed
+    return {
+        "stage": name,
+        "calls": len(latencies),
+        "elapsed": elapsed,
+        "pages_per_sec": pages / elapsed if pages and elapsed else None,
+        "blocks_per_sec": blocks / elapsed if blocks and elapsed else None,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+        "peak_rss_mb": peak_rss(),
+    }
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def bench_stages(pdf_file, repeat=1, ocr=True):
+    """在同一份文档上逐阶段单独计时，每个阶段的输入由前一阶段预先算好"""
+    doc = fitz.open(pdf_file)
+    results = []
+
+    layouts, latencies = [], []
+    for _ in range(repeat):
+        layouts = []
+        for page in doc:
+            layout, seconds = _timed(PageLayout, page)
+            layouts.append(layout)
+            latencies.append(seconds)
+    results.append(summarize("layout", latencies, pages=len(layouts) * repeat))
+    texts = [layout.text for layout in layouts]
+
+    checked, latencies = [], []
+    for _ in range(repeat):
+        checked = []
+        for text in texts:
+            result, seconds = _timed(checkcode, text)
+            checked.append(result)
+            latencies.append(seconds)
+    blocks = sum(len(result[2] or ()) for result in checked)
+    results.append(summarize("checkcode", latencies, pages=len(texts) * repeat, blocks=blocks * repeat))
+
+    # 以下阶段只在检测到语言的页面上运行，与parse_pdf一致
+    coded = [(text, result[3]) for text, result in zip(texts, checked) if result[0]]
+    extracted, latencies = [], []
+    for _ in range(repeat):
+        extracted = []
+        for text, lang in coded:
+            (origin, _fixed), seconds = _timed(extract_code_blocks_improved, text, lang)
+            extracted.append((origin, lang))
+            latencies.append(seconds)
+    blocks = sum(len(origin) for origin, _ in extracted)
+    results.append(summarize("extract_code_blocks_improved", latencies, pages=len(coded) * repeat,
+                             blocks=blocks * repeat))
+
+    latencies = []
+    for _ in range(repeat):
+        for origin, lang in extracted:
+            latencies.append(_timed(postprocess_code_blocks, origin, lang)[1])
+    results.append(summarize("postprocess_code_blocks", latencies, pages=len(extracted) * repeat,
+                             blocks=blocks * repeat))
+
+    latencies = []
+    for _ in range(repeat):
+        for origin, lang in extracted:
+            for block in origin:
+                latencies.append(_timed(format_code, block, lang)[1])
+    results.append(summarize("format_code", latencies, blocks=len(latencies)))
+
+    if ocr:
+        # OCR阶段只跑一遍：图片按内容去重，重复计时只会命中缓存
+        images = ImageOCRFilter(doc)
+        latencies = [_timed(images.image_text, xref)[1] for layout in layouts for xref in layout.xrefs]
+        stage = summarize("ocr", latencies)
+        stage["images"] = dict(images.stats)
+        results.append(stage)
+    doc.close()
+    return results
+
+def bench_font_filter(pdf_file, repeat=1):
+    """
+    比较文本代码识别在整页文本和只取等宽字体行两种方式下的耗时和代码块数（不做OCR）
+    文档没有等宽字体时parse_pdf不会启用筛选，结果中monospace为False
+    """
+    doc = fitz.open(pdf_file)
+    monospace = document_uses_monospace(doc)
+    layouts = [PageLayout(page) for page in doc]
+    for layout in layouts:
+        layout.xrefs = []
+    doc.close()
+    results = {"monospace": monospace}
+    for name, font_filter in (("full_text", False), ("font_filter", True)):
+        latencies, blocks = [], 0
+        for _ in range(repeat):
+            for layout in layouts:
+                records, seconds = _timed(recognize_page, layout, None, font_filter)
+                latencies.append(seconds)
+                blocks += len(records)
+        results[name] = summarize("recognize_text", latencies, pages=len(layouts) * repeat, blocks=blocks)
+        results[name]["blocks"] = blocks // repeat
+    full, filtered = results["full_text"]["elapsed"], results["font_filter"]["elapsed"]
+    results["speedup"] = full / filtered if filtered else None
+    return results
+
+def bench_triage(pdf_file, page_kinds, thresholds=TRIAGE_THRESHOLDS, repeat=1):
+    """
+    页面初筛：以合成语料的页面类型为标注（CODE_PAGE_KINDS为含文本代码的页面），
+    统计各阈值下跳过的页数、被跳过的代码页和因此少识别的代码块，以及初筛加文本识别相对全部识别的耗时
+    """
+    doc = fitz.open(pdf_file)
+    layouts = [PageLayout(page) for page in doc]
+    for layout in layouts:
+        layout.xrefs = []
+    doc.close()
+    texts = [layout.text for layout in layouts]
+    scores, triage_seconds = None, []
+    for _ in range(repeat):
+        scores, seconds = _timed(triage_scores, texts)
+        triage_seconds.append(seconds)
+    # 每页单独识别一次，按阈值选出需要识别的页面后累加耗时
+    page_seconds, page_blocks = [], []
+    for layout in layouts:
+        records, seconds = _timed(recognize_page, layout, None)
+        page_seconds.append(seconds)
+        page_blocks.append(len(records))
+    full = sum(page_seconds)
+    triage = min(triage_seconds)
+    code_pages = [i for i, kind in enumerate(page_kinds) if kind in CODE_PAGE_KINDS]
+    results = []
+    for threshold in thresholds:
+        skipped = [i for i, score in enumerate(scores) if score < threshold]
+        code_skipped = [i for i in skipped if page_kinds[i] in CODE_PAGE_KINDS]
+        seconds = triage + sum(page_seconds[i] for i in range(len(layouts)) if scores[i] >= threshold)
+        results.append({
+            "threshold": threshold,
+            "pages": len(layouts),
+            "skipped": len(skipped),
+            "code_pages": len(code_pages),
+            "code_pages_skipped": code_skipped,
+            "recall": 1 - len(code_skipped) / len(code_pages) if code_pages else None,
+            "blocks_lost": sum(page_blocks[i] for i in skipped),
+            "seconds": seconds,
+            "speedup": full / seconds if seconds else None,
+        })
+    return {"triage_ms": triage * 1000, "full_text_seconds": full, "thresholds": results}
+
+def char_accuracy(truth, text):
+    """忽略空白后的字符级相似度（SequenceMatcher的比值，1为完全一致）"""
+    from difflib import SequenceMatcher
+    expected, actual = "".join(truth.split()), "".join(text.split())
+    if not expected and not actual:
+        return 1.0
+    return SequenceMatcher(None, expected, actual, autojunk=False).ratio()
+
+def bench_preprocess(pdf_file, truths, variants):
+    """对图片页中的每张图片，分别用各组预处理步骤做OCR，比较耗时、送入OCR的像素数和字符准确率"""
+    from PIL import Image
+    from ocr_preprocess import preprocess
+    doc = fitz.open(pdf_file)
+    samples = []
+    for page_index, truth in sorted(truths.items()):
+        for xref in PageLayout(doc[page_index]).xrefs:
+            image = Image.open(io.BytesIO(doc.extract_image(xref)["image"]))
+            image.load()
+            samples.append((image, truth))
+    doc.close()
+    # 模型加载不计入耗时
+    get_reader()
+    results = []
+    for steps in variants:
+        latencies, accuracies, pixels = [], [], 0
+        for image, truth in samples:
+            pixels += sum(strip.size for strip in preprocess(image, steps))
+            text, seconds = _timed(image_to_text, image, steps)
+            latencies.append(seconds)
+            accuracies.append(char_accuracy(truth, text))
+        stage = summarize("ocr_preprocess", latencies)
+        stage.update(steps=list(steps), images=len(samples), pixels=pixels,
+                     accuracy=sum(accuracies) / len(accuracies) if accuracies else None)
+        results.append(stage)
+    return results
+
+def bench_end_to_end(pdf_file, output_dir, workers=1, ocr_batch=1):
+    """完整运行parse_pdf（不使用缓存），由进度事件的时间间隔得到每页延迟"""
+    pdf_path, file_name = os.path.split(pdf_file)
+    marks = [time.perf_counter()]
+    summary = {}
+
+    def on_event(event):
+        if event["event"] == "progress":
+            marks.append(time.perf_counter())
+        elif event["event"] == "summary":
+            summary.update(event)
+
+    start = time.perf_counter()
+    _, blocks = parse_pdf(pdf_path, file_name, output_dir, workers=workers, ocr_batch=ocr_batch, on_event=on_event)
+    elapsed = time.perf_counter() - start
+    latencies = [b - a for a, b in zip(marks, marks[1:])]
+    result = summarize("parse_pdf", latencies, pages=len(latencies), blocks=len(blocks), elapsed=elapsed)
+    result.update(workers=workers, ocr_batch=ocr_batch, images=summary.get("images"))
+    return result
+
+def run(pages=10, kinds=PAGE_KINDS, seed=0, repeat=1, ocr=True, workers=1, ocr_batch=1, keep=None,
+        variants=(), thresholds=TRIAGE_THRESHOLDS):
+    work_dir = keep or tempfile.mkdtemp(prefix="bench_recognition_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        pdf_file = os.path.join(work_dir, f"bench_{seed}.pdf")
+        page_kinds, truths = build_corpus(pdf_file, pages, kinds, seed)
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir, exist_ok=True)
+        stages = bench_stages(pdf_file, repeat, ocr)
+        font_filter = bench_font_filter(pdf_file, repeat)
+        triage = bench_triage(pdf_file, page_kinds, thresholds, repeat) if thresholds else None
+        end_to_end = bench_end_to_end(pdf_file, output_dir, workers, ocr_batch) if ocr else None
+        preprocessing = bench_preprocess(pdf_file, truths, variants) if ocr and variants and truths else None
+        return {
+            "corpus": {"pages": len(page_kinds), "kinds": list(kinds), "pages_per_kind": pages, "seed": seed},
+            "python": sys.version.split()[0],
+            "platform": sys.platform,
+            "repeat": repeat,
+            "stages": stages,
+            "font_filter": font_filter,
+            "triage": triage,
+            "end_to_end": end_to_end,
+            "preprocess": preprocessing,
+        }
+    finally:
+        if keep is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="识别流水线基准测试，结果以JSON输出")
+    parser.add_argument("--pages", type=int, default=10, help="每种页面类型生成的页数，默认10")
+    parser.add_argument("--kinds", default=",".join(PAGE_KINDS),
+                        help=f"生成的页面类型，逗号分隔，可选{'/'.join(PAGE_KINDS)}")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子，相同种子生成相同的PDF")
+    parser.add_argument("--repeat", type=int, default=1, help="文本阶段重复测量的次数，默认1")
+    parser.add_argument("--no-ocr", action="store_true", help="跳过OCR阶段、端到端测试和预处理比较（无需加载EasyOCR模型）")
+    parser.add_argument("--workers", type=int, default=1, help="端到端测试中parse_pdf的进程数")
+    parser.add_argument("--ocr-batch", type=int, default=1, help="端到端测试中parse_pdf的批量OCR大小")
+    parser.add_argument("--preprocess-variants", default=PREPROCESS_VARIANTS, metavar="VARIANTS",
+                        help="比较的OCR预处理组合，组合之间用分号分隔，组内步骤用逗号分隔，none表示不预处理，"
+                             "空字符串表示不比较")
+    parser.add_argument("--triage-thresholds", default=",".join(str(value) for value in TRIAGE_THRESHOLDS),
+                        metavar="VALUES", help="比较的页面初筛阈值，逗号分隔，空字符串表示不比较")
+    parser.add_argument("--keep", metavar="DIR", help="保留生成的PDF和输出到DIR，默认使用临时目录并在结束后删除")
+    parser.add_argument("--output", metavar="PATH", help="结果写入PATH，默认输出到stdout")
+    args = parser.parse_args()
+
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    unknown = [kind for kind in kinds if kind not in PAGE_KINDS]
+    if unknown:
+        parser.error(f"未知的页面类型: {', '.join(unknown)}")
+    variants = [parse_preprocess_steps(variant) for variant in args.preprocess_variants.split(";") if variant.strip()]
+    if any(steps is None for steps in variants):
+        parser.error(f"未知的预处理步骤: {args.preprocess_variants}")
+    try:
+        thresholds = [float(value) for value in args.triage_thresholds.split(",") if value.strip()]
+    except ValueError:
+        parser.error(f"无效的初筛阈值: {args.triage_thresholds}")
+    # 识别过程中的print输出转到stderr，stdout只保留结果
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args.pages, kinds, args.seed, args.repeat, not args.no_ocr, args.workers, args.ocr_batch,
+                     args.keep, variants, thresholds)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=4))
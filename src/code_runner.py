@@ -0,0 +1,406 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# 编译结果缓存的格式版本，缓存目录的布局改变时加一
+CACHE_FORMAT = 1
+# 默认的编译结果缓存目录和大小上限
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "code_runner_cache")
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+# 运行超时（秒），编译另有更宽的超时
+DEFAULT_TIMEOUT = 10
+COMPILE_TIMEOUT = 60
+# stdout和stderr各自最多保留的字节数，超出时结束进程
+DEFAULT_OUTPUT_LIMIT = 64 * 1024
+
+EXE_SUFFIX = ".exe" if os.name == "nt" else ""
+
+# 各语言检测工具链的命令，每个会话只检测一次
+PROBE_COMMANDS = {
+    "C": ["gcc", "--version"],
+    "C++": ["g++", "--version"],
+    "Java": ["javac", "-version"],
+}
+COMPILERS = {"C": "gcc", "C++": "g++"}
+SOURCE_SUFFIX = {"Python": ".py", "C": ".c", "C++": ".cpp"}
+JAVA_CLASS = re.compile(r"public\s+class\s+([A-Za-z_][A-Za-z0-9_]*)")
+
+def java_class_name(code):
+    """Java源文件必须以public类命名，没有public类时为Main"""
+    match = JAVA_CLASS.search(code)
+    return match.group(1) if match else "Main"
+
+def conda_python(env):
+    """在指定conda环境中运行Python的命令"""
+    return ["conda", "run", "--no-capture-output", "-n", env, "python"]
+
+def _kill(proc):
+    # 进程在独立的进程组中运行，连同它启动的子进程一起结束
+    try:
+        if os.name == "nt":
+            proc.kill()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def run_process(command, cwd, stdin_text="", timeout=DEFAULT_TIMEOUT, output_limit=DEFAULT_OUTPUT_LIMIT):
+    """
+    运行一个进程，超时或任一输出超过output_limit字节时结束进程（及其子进程）
+    :return: {"exit_code", "stdout", "stderr", "timed_out", "truncated", "elapsed"}，exit_code在进程无法启动时为None
+    """
+    start = time.time()
+    kwargs = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == "nt" else {"start_new_session": True}
+    try:
+        # 标准输入放在匿名临时文件中，不出现在工作目录（也就不会进入编译缓存或被运行的程序看到）
+        with tempfile.TemporaryFile() as stdin:
+            stdin.write((stdin_text or "").encode("utf-8"))
+            stdin.seek(0)
+            proc = subprocess.Popen(command, cwd=cwd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    **kwargs)
+    except OSError as e:
+        return {"exit_code": None, "stdout": "", "stderr": str(e), "timed_out": False, "truncated": False,
+                "elapsed": time.time() - start}
+
+    outputs = {"stdout": bytearray(), "stderr": bytearray()}
+    truncated = threading.Event()
+
+    def read(name, pipe):
+        # 超出上限后继续读取并丢弃，直到进程被结束、管道关闭
+        buffer = outputs[name]
+        for chunk in iter(lambda: pipe.read1(8192), b""):
+            room = output_limit - len(buffer)
+            if len(chunk) > room:
+                buffer.extend(chunk[:max(room, 0)])
+                if not truncated.is_set():
+                    truncated.set()
+                    _kill(proc)
+            else:
+                buffer.extend(chunk)
+        pipe.close()
+
+    readers = [threading.Thread(target=read, args=(name, getattr(proc, name)), daemon=True) for name in outputs]
+    for reader in readers:
+        reader.start()
+    timed_out = False
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        _kill(proc)
+        proc.wait()
+    for reader in readers:
+        reader.join()
+    return {
+        "exit_code": proc.returncode,
+        "stdout": outputs["stdout"].decode("utf-8", errors="replace"),
+        "stderr": outputs["stderr"].decode("utf-8", errors="replace"),
+        "timed_out": timed_out,
+        "truncated": truncated.is_set(),
+        "elapsed": time.time() - start,
+    }
+
+class CompileCache:
+    """
+    编译结果缓存：每个条目是缓存目录下以键命名的子目录（可执行文件或Java的class文件）
+    使用时刷新子目录的修改时间，总大小超过上限时按最近使用时间（LRU）淘汰
+    条目先在临时目录中生成再改名，多个进程共用一个缓存目录时不会读到不完整的条目
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """命中时刷新使用时间并返回条目目录，未命中返回None"""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return path
+
+    def build_dir(self):
+        """生成新条目用的临时目录，完成后交给put()"""
+        return tempfile.mkdtemp(prefix=".build_", dir=self.directory)
+
+    def put(self, key, build_dir):
+        """把生成好的临时目录改名为条目，返回条目目录；其他进程已写入同一条目时使用已有的"""
+        path = self.path(key)
+        try:
+            os.rename(build_dir, path)
+        except OSError:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        self._evict(keep=key)
+        return path
+
+    @staticmethod
+    def _size(path):
+        return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+    def _evict(self, keep):
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self.path(name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            with contextlib.suppress(OSError):
+                entries.append((os.path.getmtime(path), name, self._size(path)))
+        total = sum(size for _, _, size in entries)
+        # 从最久未使用的条目开始删除，刚写入的条目保留
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name != keep:
+                shutil.rmtree(self.path(name), ignore_errors=True)
+                total -= size
+
+class CodeRunner:
+    """
+    运行识别出的代码块：C/C++/Java的编译结果按(语言, 编译器版本, 编译选项, 代码)的哈希缓存，
+    同一段代码再次运行时跳过编译；工具链在第一次用到时检测并在整个会话中复用结果
+    每次运行在独立的临时目录中进行，并发运行互不影响
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, cache_size=DEFAULT_CACHE_SIZE, timeout=DEFAULT_TIMEOUT,
+                 output_limit=DEFAULT_OUTPUT_LIMIT):
+        self.cache = CompileCache(cache_dir, cache_size)
+        self.timeout = timeout
+        self.output_limit = output_limit
+        # (语言, conda环境) -> 工具链版本（第一行输出），不可用时为None
+        self.toolchains = {}
+        # 编译失败的结果只在本会话内记住，环境修好后重启即可重新编译
+        self.compile_errors = {}
+
+    def probe(self, language, env=None):
+        """检测语言所需的工具链，返回版本信息，不可用时返回None"""
+        probe_key = (language, env)
+        if probe_key not in self.toolchains:
+            if language == "Python":
+                command = (conda_python(env) if env else [sys.executable]) + ["--version"]
+            else:
+                command = PROBE_COMMANDS.get(language)
+            version = None
+            if command is not None and shutil.which(command[0]):
+                try:
+                    # javac -version在旧版本中输出到stderr
+                    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                            timeout=COMPILE_TIMEOUT)
+                    output = result.stdout.decode("utf-8", errors="replace").strip()
+                    if result.returncode == 0:
+                        version = output.splitlines()[0] if output else command[0]
+                except (OSError, subprocess.TimeoutExpired):
+                    pass
+            self.toolchains[probe_key] = version
+        return self.toolchains[probe_key]
+
+    def cache_key(self, language, code, flags):
+        data = json.dumps([CACHE_FORMAT, language, self.toolchains.get((language, None)), list(flags), code],
+                          ensure_ascii=False)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()[:32]
+
+    def compile(self, language, code, flags):
+        """
+        编译代码，命中缓存时直接返回
+        :return: (条目目录, 是否命中缓存, 编译错误信息)，编译失败时条目目录为None
+        """
+        key = self.cache_key(language, code, flags)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry, True, None
+        if key in self.compile_errors:
+            return None, True, self.compile_errors[key]
+        build = self.cache.build_dir()
+        try:
+            if language == "Java":
+                source = os.path.join(build, "src", java_class_name(code) + ".java")
+                os.makedirs(os.path.dirname(source))
+                command = ["javac", "-encoding", "UTF-8", "-d", ".", os.path.relpath(source, build)]
+            else:
+                source = os.path.join(build, "src", "main" + SOURCE_SUFFIX[language])
+                os.makedirs(os.path.dirname(source))
+                # 在临时目录中用相对路径编译，错误信息中不出现临时目录
+                command = [COMPILERS[language], os.path.relpath(source, build), "-o", "main" + EXE_SUFFIX] + list(flags)
+            with open(source, "w", encoding="utf-8") as f:
+                f.write(code)
+            result = run_process(command, build, timeout=COMPILE_TIMEOUT, output_limit=self.output_limit)
+            if result["exit_code"] != 0:
+                message = result["stderr"] or result["stdout"] or ("编译超时" if result["timed_out"] else "编译失败")
+                self.compile_errors[key] = message
+                shutil.rmtree(build, ignore_errors=True)
+                return None, False, message
+            # 只缓存编译产物，源码不再需要
+            shutil.rmtree(os.path.dirname(source), ignore_errors=True)
+            return self.cache.put(key, build), False, None
+        except BaseException:
+            shutil.rmtree(build, ignore_errors=True)
+            raise
+
+    def run(self, code, language, flags=(), stdin="", timeout=None, env=None):
+        """
+        运行一段代码
+        :param language: Python、C、C++或Java
+        :param flags: 附加的编译选项（C/C++）
+        :param stdin: 作为标准输入的文本
+        :param env: 运行Python代码的conda环境，None为当前解释器
+        :return: {"language", "status", "exit_code", "stdout", "stderr", "truncated", "cached",
+                  "compile_time", "run_time"}，status为ok、unavailable、compile_error、runtime_error或timeout
+        """
+        result = {"language": language, "status": "ok", "exit_code": None, "stdout": "", "stderr": "",
+                  "truncated": False, "cached": False, "compile_time": 0.0, "run_time": 0.0}
+        if self.probe(language, env) is None:
+            result.update(status="unavailable", stderr=f"未检测到{language}所需的编译器/解释器，请安装相应的开发环境。")
+            return result
+
+        with tempfile.TemporaryDirectory(prefix="run_") as workdir:
+            if language == "Python":
+                source = os.path.join(workdir, "main.py")
+                with open(source, "w", encoding="utf-8") as f:
+                    f.write(code)
+                command = (conda_python(env) if env else [sys.executable]) + [source]
+            else:
+                start = time.time()
+                entry, cached, error = self.compile(language, code, flags)
+                result.update(cached=cached, compile_time=time.time() - start)
+                if entry is None:
+                    result.update(status="compile_error", stderr=error)
+                    return result
+                if language == "Java":
+                    command = ["java", "-cp", entry, java_class_name(code)]
+                else:
+                    command = [os.path.join(entry, "main" + EXE_SUFFIX)]
+            outcome = run_process(command, workdir, stdin, timeout or self.timeout, self.output_limit)
+
+        if outcome["timed_out"]:
+            status = "timeout"
+        elif outcome["exit_code"] != 0 and not outcome["truncated"]:
+            status = "runtime_error"
+        else:
+            status = "ok"
+        result.update(status=status, exit_code=outcome["exit_code"], stdout=outcome["stdout"],
+                      stderr=outcome["stderr"], truncated=outcome["truncated"], run_time=outcome["elapsed"])
+        return result
+
+class RunnerServer:
+    """
+    常驻运行服务，协议与pdf_test.py --serve相同：通过stdin/stdout按行收发JSON请求
+    请求: {"id": 1, "method": "run_code", "params": {"code": "...", "language": "C"}}
+    响应: {"id": 1, "result": {...}} 或 {"id": 1, "error": {"message": "..."}}
+    支持的方法: health, run_code, shutdown
+    """
+
+    def __init__(self, runner, stdin=None, stdout=None):
+        self.runner = runner
+        self.stdin = stdin or sys.stdin
+        self.stdout = stdout or sys.stdout
+        self.started_at = time.time()
+        self.served = 0
+        self.stopping = False
+
+    def send(self, message):
+        self.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+        self.stdout.flush()
+
+    def health(self, params):
+        return {
+            "status": "ready",
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started_at,
+            "served": self.served,
+            "toolchains": {language: version for (language, env), version in self.runner.toolchains.items()
+                           if env is None},
+            "cache_hits": self.runner.cache.hits,
+            "cache_misses": self.runner.cache.misses,
+        }
+
+    def run_code(self, params):
+        return self.runner.run(params["code"], params["language"], flags=params.get("flags", ()),
+                               stdin=params.get("stdin", ""), timeout=params.get("timeout"), env=params.get("env"))
+
+    def shutdown(self, params):
+        self.stopping = True
+        return {"status": "stopping"}
+
+    def handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            self.send({"id": None, "error": {"message": f"无效的JSON请求: {e}"}})
+            return
+        request_id = request.get("id")
+        handler = {"health": self.health, "run_code": self.run_code, "shutdown": self.shutdown}.get(
+            request.get("method"))
+        if handler is None:
+            self.send({"id": request_id, "error": {"message": f"未知方法: {request.get('method')}"}})
+            return
+        try:
+            result = handler(request.get("params") or {})
+            self.served += 1
+            self.send({"id": request_id, "result": result})
+        except Exception as e:
+            self.send({"id": request_id, "error": {"message": str(e), "type": type(e).__name__}})
+
+    def serve_forever(self):
+        # 启动时检测一遍编译器，之后的请求不再检测
+        for language in PROBE_COMMANDS:
+            self.runner.probe(language)
+        self.send({"event": "ready", "pid": os.getpid()})
+        try:
+            for line in iter(self.stdin.readline, ""):
+                if line.strip():
+                    self.handle(line)
+                if self.stopping:
+                    break
+        except KeyboardInterrupt:
+            pass
+        self.send({"event": "stopped", "served": self.served})
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="运行识别出的代码块，缓存编译结果",
+                                     epilog="示例：python code_runner.py --language C ./main.c")
+    parser.add_argument("source", nargs="?", help="代码文件路径，为-时从stdin读取")
+    parser.add_argument("--language", help="代码语言：Python、C、C++或Java")
+    parser.add_argument("--serve", action="store_true", help="以常驻服务模式运行，通过stdin/stdout收发JSON请求")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"编译结果缓存目录，默认为{DEFAULT_CACHE_DIR}")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help=f"编译结果缓存大小上限（MB），默认为{DEFAULT_CACHE_SIZE // (1024 * 1024)}")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help=f"运行超时（秒），默认为{DEFAULT_TIMEOUT}")
+    parser.add_argument("--output-limit", type=int, default=DEFAULT_OUTPUT_LIMIT // 1024,
+                        help=f"stdout和stderr各自保留的大小上限（KB），默认为{DEFAULT_OUTPUT_LIMIT // 1024}")
+    parser.add_argument("--flag", action="append", default=[], dest="flags", metavar="FLAG",
+                        help="附加的编译选项，可重复，例如--flag=-O2")
+    parser.add_argument("--env", help="运行Python代码的conda环境")
+    args = parser.parse_args()
+
+    runner = CodeRunner(args.cache_dir, args.cache_size * 1024 * 1024, args.timeout, args.output_limit * 1024)
+    if args.serve:
+        RunnerServer(runner).serve_forever()
+        sys.exit(0)
+    if not args.source or not args.language:
+        parser.error("请提供代码文件路径和--language")
+    if args.source == "-":
+        code = sys.stdin.read()
+    else:
+        with open(args.source, encoding="utf-8") as f:
+            code = f.read()
+    print(json.dumps(runner.run(code, args.language, args.flags, env=args.env), ensure_ascii=False))
@@ -17,7 +17,9 @@ import { generateAISummary, generateAIQuiz } from './AIsummarizer';
 import { getProjects } from './projectService';
 import { addComment, deleteCommentById, getAllComments } from './commentService';
 let panel: vscode.WebviewPanel | undefined;
-import { CondaEnv } from './python_env';
+import { CodeRunnerDaemon, CondaEnv, DaemonUnavailableError, RecognitionDaemon, RunCodeResult } from './python_env';
+let recognitionDaemon: RecognitionDaemon | undefined;
+let codeRunnerDaemon: CodeRunnerDaemon | undefined;
 
 export let currentUserId: number | null = null;
 // This method is called when your extension is activated
@@ -634,9 +636,37 @@ export function activate(context: vscode.ExtensionContext) {
 							fs.mkdirSync(outPath, { recursive: true });
 						}
 						console.log(`开始识别文件: ${absolutePath}, 输出目录: ${outPath}`);
-						// 运行 Python 脚本
-						const command = [absolutePath, outPath];
-						const stdout = dailyworkEnv.runScript(scriptPath, command);
+						// 优先交给常驻识别服务处理，避免每次重新加载 OCR 模型
+						try {
+							if (!recognitionDaemon) {
+								recognitionDaemon = new RecognitionDaemon(scriptPath, 'conda', dailyworkEnv.getEnvName());
+							}
+							// 边识别边把已得到的代码块发给前端，不必等整个文件处理完
+							const streamedBlocks: any[] = [];
+							let postedCount = 0;
+							const result = await recognitionDaemon.parsePdf(absolutePath, outPath, (event) => {
+								if (event.event === 'block') {
+									const { event: _event, id: _id, ...block } = event;
+									streamedBlocks.push(block);
+								} else if (event.event === 'progress' && streamedBlocks.length > postedCount) {
+									postedCount = streamedBlocks.length;
+									panel?.webview.postMessage({
+										command: 'pdfCodeBlocks',
+										data: JSON.stringify(streamedBlocks)
+									});
+								}
+							});
+							console.log(`识别服务完成: ${result.blocks} 个代码块, 用时 ${result.elapsed.toFixed(2)}s`);
+						} catch (daemonError) {
+							// 服务返回的错误（例如文件无法解析）重新运行脚本也会失败，直接报告
+							if (!(daemonError instanceof DaemonUnavailableError)) {
+								throw daemonError;
+							}
+							// 服务不可用（无法启动、退出或超时）时退回到单次运行 Python 脚本
+							console.warn('识别服务不可用，改为单次运行脚本:', daemonError);
+							const command = [absolutePath, outPath];
+							dailyworkEnv.runScript(scriptPath, command);
+						}
 						
 						// 等待 JSON 文件生成
 						const jsonFilePath = path.join(outPath, path.parse(filename).name + "_code_block.json");
@@ -758,103 +788,47 @@ export function activate(context: vscode.ExtensionContext) {
 				case 'runCodeBlock':
 					try {
 						const { code, language, compiler } = message;
-						let command = '';
-						let tmpPath = '';
-						
-						// 首先检查编译器是否存在
-						const checkCompiler = () => {
-							return new Promise<boolean>((resolve) => {
-								let checkCmd = '';
-								
-								switch (language) {
-									case 'Python':
-										if (compiler && compiler !== '默认环境') {
-											checkCmd = `conda env list | findstr "${compiler}"`;
-										} else {
-											checkCmd = 'python --version';
-										}
-										break;
-									case 'C':
-										checkCmd = 'gcc --version';
-										break;
-									case 'C++':
-										checkCmd = 'g++ --version';
-										break;
-									case 'Java':
-										checkCmd = 'javac -version';
-										break;
-									default:
-										resolve(false);
-										return;
-								}
-								
-								exec(checkCmd, (error) => {
-									resolve(!error);
-								});
-							});
-						};
-						
-						const compilerExists = await checkCompiler();
-						
-						if (!compilerExists) {
-							console.log('发送 runCodeResult:', { result: `错误: 未检测到${language}所需的编译器/解释器，请安装相应的开发环境。`, blockIdx: message.blockIdx });
-							panel?.webview.postMessage({ 
-								command: 'runCodeResult', 
-								result: `错误: 未检测到${language}所需的编译器/解释器，请安装相应的开发环境。`,
+						const postResult = (result: string) => {
+							console.log('发送 runCodeResult:', { result, blockIdx: message.blockIdx });
+							panel?.webview.postMessage({
+								command: 'runCodeResult',
+								result,
 								blockIdx: message.blockIdx
 							});
-							vscode.window.showErrorMessage(`未检测到${language}所需的编译器/解释器，请安装相应的开发环境。`);
-							return;
+						};
+
+						// 交给常驻运行服务：编译器只检测一次，编译结果按代码内容缓存，每次运行使用独立的临时目录
+						if (!codeRunnerDaemon) {
+							codeRunnerDaemon = new CodeRunnerDaemon(
+								path.join(context.extensionPath, 'src', 'code_runner.py'),
+								path.join(context.extensionPath, 'cr_out', 'run_cache')
+							);
 						}
-						
-						// 编译器存在，继续执行代码
-						// 保持原有的运行逻辑...
-						if (language === 'Python') {
-							tmpPath = path.join(context.extensionPath, 'cr_out', 'tmp_run.py');
-							fs.writeFileSync(tmpPath, code, 'utf-8');
-							
-							// 如果有指定环境，使用 conda 运行
-							if (compiler && compiler !== '默认环境') {
-								command = `conda run -n ${compiler} python "${tmpPath}"`;
-							} else {
-								command = `python "${tmpPath}"`;
+						// 指定了 conda 环境时在该环境中运行 Python 代码
+						const env = language === 'Python' && compiler && compiler !== '默认环境' ? compiler : undefined;
+						let result: RunCodeResult;
+						try {
+							result = await codeRunnerDaemon.runCode(code, language, env);
+						} catch (daemonError) {
+							if (!(daemonError instanceof DaemonUnavailableError)) {
+								throw daemonError;
 							}
-						} else if (language === 'C') {
-							tmpPath = path.join(context.extensionPath, 'cr_out', 'tmp_run.c');
-							fs.writeFileSync(tmpPath, code, 'utf-8');
-							command = `gcc "${tmpPath}" -o "${tmpPath}.exe" && "${tmpPath}.exe"`;
-						} else if (language === 'C++') {
-							tmpPath = path.join(context.extensionPath, 'cr_out', 'tmp_run.cpp');
-							fs.writeFileSync(tmpPath, code, 'utf-8');
-							command = `g++ "${tmpPath}" -o "${tmpPath}.exe" && "${tmpPath}.exe"`;
-						} else if (language === 'Java') {
-							// 提取类名
-							const match = code.match(/public\s+class\s+([A-Za-z_][A-Za-z0-9_]*)/);
-							const className = match && match[1] ? match[1] : 'Main';
-							
-							tmpPath = path.join(context.extensionPath, 'cr_out', `${className}.java`);
-							fs.writeFileSync(tmpPath, code, 'utf-8');
-							command = `javac "${tmpPath}" && java -cp "${path.dirname(tmpPath)}" ${className}`;
+							// 运行服务不可用（例如 PATH 中没有 python）时退回到直接调用编译器/解释器
+							console.warn('代码运行服务不可用，改为直接运行:', daemonError);
+							postResult(await runCodeWithExec(path.join(context.extensionPath, 'cr_out'), code, language, compiler));
+							break;
+						}
+
+						if (result.status === 'unavailable') {
+							postResult(`错误: ${result.stderr}`);
+							vscode.window.showErrorMessage(result.stderr);
+						} else if (result.status === 'ok') {
+							postResult(result.truncated ? `${result.stdout}\n[输出过长，已截断]` : result.stdout);
+						} else if (result.status === 'timeout') {
+							postResult(`${result.stdout}${result.stderr}\n[运行超时，已终止]`);
+						} else {
+							postResult(result.stderr || result.stdout || `进程退出码: ${result.exit_code}`);
 						}
-						
-						// 运行命令
-						exec(command, (error, stdout, stderr) => {
-							if (error) {
-								console.log('发送 runCodeResult:', { result: stderr || error.message, blockIdx: message.blockIdx });
-								panel?.webview.postMessage({ 
-									command: 'runCodeResult', 
-									result: stderr || error.message,
-									blockIdx: message.blockIdx
-								});
-							} else {
-								console.log('发送 runCodeResult:', { result: stdout, blockIdx: message.blockIdx });
-								panel?.webview.postMessage({ 
-									command: 'runCodeResult', 
-									result: stdout,
-									blockIdx: message.blockIdx
-								});
-							}
-						});
 					} catch (error: any) {
 						console.log('发送 runCodeResult:', { result: `错误: ${error.message}`, blockIdx: message.blockIdx });
 						panel?.webview.postMessage({ 
@@ -1795,6 +1769,61 @@ export function activate(context: vscode.ExtensionContext) {
 	});
 }
 
+/**
+ * 不经过代码运行服务，直接调用编译器/解释器运行代码（运行服务不可用时使用）
+ * 代码写入 outDir 下的临时文件，每次都重新编译
+ * @returns 发给前端的运行结果（stdout，出错时为 stderr 或错误信息）
+ */
+function runCodeWithExec(outDir: string, code: string, language: string, compiler?: string): Promise<string> {
+	let checkCmd = '';
+	let command = '';
+	fs.mkdirSync(outDir, { recursive: true });
+	if (language === 'Python') {
+		const tmpPath = path.join(outDir, 'tmp_run.py');
+		fs.writeFileSync(tmpPath, code, 'utf-8');
+		// 如果有指定环境，使用 conda 运行
+		if (compiler && compiler !== '默认环境') {
+			checkCmd = `conda env list | findstr "${compiler}"`;
+			command = `conda run -n ${compiler} python "${tmpPath}"`;
+		} else {
+			checkCmd = 'python --version';
+			command = `python "${tmpPath}"`;
+		}
+	} else if (language === 'C' || language === 'C++') {
+		const tmpPath = path.join(outDir, language === 'C' ? 'tmp_run.c' : 'tmp_run.cpp');
+		const compilerCmd = language === 'C' ? 'gcc' : 'g++';
+		fs.writeFileSync(tmpPath, code, 'utf-8');
+		checkCmd = `${compilerCmd} --version`;
+		command = `${compilerCmd} "${tmpPath}" -o "${tmpPath}.exe" && "${tmpPath}.exe"`;
+	} else if (language === 'Java') {
+		// 提取类名
+		const match = code.match(/public\s+class\s+([A-Za-z_][A-Za-z0-9_]*)/);
+		const className = match && match[1] ? match[1] : 'Main';
+		const tmpPath = path.join(outDir, `${className}.java`);
+		fs.writeFileSync(tmpPath, code, 'utf-8');
+		checkCmd = 'javac -version';
+		command = `javac "${tmpPath}" && java -cp "${outDir}" ${className}`;
+	}
+
+	return new Promise((resolve) => {
+		const missing = `错误: 未检测到${language}所需的编译器/解释器，请安装相应的开发环境。`;
+		if (!checkCmd) {
+			resolve(missing);
+			return;
+		}
+		exec(checkCmd, (checkError) => {
+			if (checkError) {
+				vscode.window.showErrorMessage(missing.replace('错误: ', ''));
+				resolve(missing);
+				return;
+			}
+			exec(command, (error, stdout, stderr) => {
+				resolve(error ? (stderr || error.message) : stdout);
+			});
+		});
+	});
+}
+
 function getCatWebviewContent() {
     return `
 		  <!DOCTYPE html>
@@ -1813,4 +1842,8 @@ function getCatWebviewContent() {
 
 // This method is called when your extension is deactivated
 export function deactivate() {
+	recognitionDaemon?.stop();
+	recognitionDaemon = undefined;
+	codeRunnerDaemon?.stop();
+	codeRunnerDaemon = undefined;
 }
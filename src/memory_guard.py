@@ -0,0 +1,70 @@
+import contextlib
+import gc
+import os
+import sys
+
+def current_rss():
+    """当前进程的常驻内存（字节），无法获取时返回None"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        # Linux：第二列为常驻页数
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def release_memory():
+    """回收循环引用的对象，并清空MuPDF的资源缓存（字体、解码后的图片等）"""
+    gc.collect()
+    fitz = sys.modules.get("fitz")
+    if fitz is not None:
+        fitz.TOOLS.store_shrink(100)
+
+class MemoryGuard:
+    """
+    常驻内存上限：has_room()在超出上限时先释放缓存再重新测量，仍超出则返回False，
+    由调用方暂停批量OCR等占用内存较多的操作
+    limit为None或无法测量内存时不做限制
+    lock为多个工作进程共用的锁（multiprocessing.Lock），超出上限的进程通过它串行OCR
+    """
+
+    def __init__(self, limit=None, lock=None):
+        self.limit = limit
+        self.lock = lock
+        self.releases = 0
+        self.peak = 0
+
+    def rss(self):
+        rss = current_rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+        return rss
+
+    def has_room(self):
+        if self.limit is None:
+            return True
+        rss = self.rss()
+        if rss is None or rss <= self.limit:
+            return True
+        self.releases += 1
+        release_memory()
+        rss = self.rss()
+        return rss is None or rss <= self.limit
+
+    @contextlib.contextmanager
+    def ocr_slot(self):
+        """
+        包住一次OCR：未超出上限时直接执行，返回False；
+        超出上限（释放缓存后仍超出）时返回True，持有共用锁执行，使超限的工作进程同一时间只有一个在识别，
+        识别完立即再释放一次缓存
+        """
+        if self.has_room():
+            yield False
+            return
+        with self.lock if self.lock is not None else contextlib.nullcontext():
+            yield True
+        release_memory()
@@ -0,0 +1,128 @@
+import numpy as np
+
+# 缩小后文字行的目标高度（像素），EasyOCR识别模型的输入高度为64，20~32像素的文字识别效果较好
+TARGET_TEXT_HEIGHT = 28
+# 文字行高超过目标的这个倍数才缩小，避免为很小的收益重采样
+DOWNSCALE_SLACK = 1.5
+# 最多缩小到原来的这个比例
+MIN_SCALE = 0.25
+# 超过该高度的图片在空白行处切成多条分别识别，避免检测模型把长图整体缩小
+MAX_STRIP_HEIGHT = 640
+# 与背景灰度相差超过该值的像素视为笔画
+INK_TOLERANCE = 24
+# 裁剪后四周保留的空白（像素）
+CROP_MARGIN = 6
+# 自动对比度时两端各舍弃的像素比例（百分比）
+CONTRAST_CUTOFF = 1
+
+def to_gray(image):
+    """PIL图像转为uint8灰度数组"""
+    return np.asarray(image.convert('L'), dtype=np.uint8)
+
+def background_level(gray):
+    """以四条边框像素的中位数作为背景灰度"""
+    border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    return int(np.median(border))
+
+def ink_mask(gray, tolerance=INK_TOLERANCE):
+    """笔画像素的布尔矩阵"""
+    return np.abs(gray.astype(np.int16) - background_level(gray)) > tolerance
+
+def auto_contrast(gray, cutoff=CONTRAST_CUTOFF):
+    """
+    拉伸灰度范围到0~255，深色背景（深色主题的代码截图）反相为白底黑字
+    """
+    lo, hi = np.percentile(gray, [cutoff, 100 - cutoff])
+    if hi - lo >= 1:
+        gray = np.clip((gray.astype(np.float32) - lo) * (255.0 / (hi - lo)), 0, 255).astype(np.uint8)
+    if background_level(gray) < 128:
+        gray = 255 - gray
+    return gray
+
+def binarize(gray):
+    """Otsu阈值二值化：取使类间方差最大的灰度作为阈值"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    prob = hist / hist.sum()
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))
+    if not np.isfinite(between).any():
+        return gray
+    threshold = int(np.nanargmax(np.where(np.isfinite(between), between, np.nan)))
+    return np.where(gray > threshold, 255, 0).astype(np.uint8)
+
+def crop_borders(gray, tolerance=INK_TOLERANCE, margin=CROP_MARGIN):
+    """裁掉四周与背景颜色一致的边框，保留margin像素的空白；整张图都是背景时原样返回"""
+    ink = ink_mask(gray, tolerance)
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return gray
+    top, bottom = max(rows[0] - margin, 0), min(rows[-1] + margin + 1, gray.shape[0])
+    left, right = max(cols[0] - margin, 0), min(cols[-1] + margin + 1, gray.shape[1])
+    return gray[top:bottom, left:right]
+
+def _ink_runs(rows):
+    """布尔行序列中连续为True的区间[(起点, 终点)...]"""
+    padded = np.concatenate([[False], rows, [False]]).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return list(zip(edges[::2], edges[1::2]))
+
+def text_line_height(gray, tolerance=INK_TOLERANCE):
+    """由水平投影估计文字行高（有笔画的连续行的中位高度），无法估计时返回None"""
+    heights = [end - start for start, end in _ink_runs(ink_mask(gray, tolerance).any(axis=1)) if end - start >= 3]
+    if not heights:
+        return None
+    return float(np.median(heights))
+
+def downscale(gray, target_height=TARGET_TEXT_HEIGHT):
+    """文字行明显高于目标高度时按比例缩小，减少送入OCR的像素"""
+    height = text_line_height(gray)
+    if height is None or height <= target_height * DOWNSCALE_SLACK:
+        return gray
+    scale = max(target_height / height, MIN_SCALE)
+    from PIL import Image
+    size = (max(1, int(round(gray.shape[1] * scale))), max(1, int(round(gray.shape[0] * scale))))
+    return np.asarray(Image.fromarray(gray).resize(size, Image.LANCZOS), dtype=np.uint8)
+
+def split_strips(gray, max_height=MAX_STRIP_HEIGHT, tolerance=INK_TOLERANCE):
+    """
+    把过高的图片切成不超过max_height的多条，切分点尽量选在空白行（行间距）上
+    :return: 从上到下的灰度数组列表
+    """
+    if gray.shape[0] <= max_height:
+        return [gray]
+    blank = ~ink_mask(gray, tolerance).any(axis=1)
+    strips = []
+    start = 0
+    while gray.shape[0] - start > max_height:
+        limit = start + max_height
+        # 在后半段中找最靠后的空白行作为切分点，找不到时直接在上限处切开
+        candidates = np.flatnonzero(blank[start + max_height // 2:limit])
+        cut = start + max_height // 2 + int(candidates[-1]) if candidates.size else limit
+        strips.append(gray[start:cut])
+        start = cut
+    strips.append(gray[start:])
+    return [strip for strip in strips if strip.shape[0] > 0]
+
+def preprocess(image, steps):
+    """
+    OCR前的预处理，steps为启用的步骤（contrast、crop、downscale、binarize、split）
+    :param image: PIL图像
+    :return: 依次送入OCR的灰度数组列表（未启用split时只有一个）
+    """
+    gray = to_gray(image)
+    if gray.shape[0] < 2 or gray.shape[1] < 2:
+        return [gray]
+    if 'contrast' in steps:
+        gray = auto_contrast(gray)
+    if 'crop' in steps:
+        gray = crop_borders(gray)
+    if 'downscale' in steps:
+        gray = downscale(gray)
+    if 'binarize' in steps:
+        gray = binarize(gray)
+    if 'split' in steps:
+        return split_strips(gray)
+    return [gray]
@@ -0,0 +1,171 @@
+import glob
+import hashlib
+import json
+import os
+import zipfile
+
+def json_list_item(record):
+    """与json.dump(list, indent=4)中列表元素相同的排版"""
+    return "\n".join("    " + line for line in json.dumps(record, ensure_ascii=False, indent=4).split("\n"))
+
+def _temp_path(path):
+    # 临时文件与目标在同一目录，os.replace才是原子的；带进程号，避免并发写同一目录时互相覆盖
+    return f"{path}.{os.getpid()}.tmp"
+
+def atomic_write(path, text):
+    """先写临时文件再改名，读取方看到的要么是旧文件，要么是完整的新文件"""
+    temp = _temp_path(path)
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(temp, path)
+
+def _load_records(path):
+    """读取已有的汇总JSON，文件不存在或不是代码块记录列表时返回空列表"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+    except (OSError, ValueError):
+        return []
+    if not isinstance(records, list):
+        return []
+    return [record for record in records if isinstance(record, dict) and isinstance(record.get("path"), str)]
+
+def content_name(code, suffix):
+    """按内容哈希命名的代码块文件名，内容相同的代码块得到同一个文件名"""
+    return hashlib.sha1(code.encode("utf-8")).hexdigest()[:16] + suffix
+
+class OutputWriter:
+    """
+    一个文档的输出：代码块先缓存在内存中，commit()时依次写出代码块文件（或压缩包）和汇总JSON
+    每个文件都先写临时文件再改名，JSON最后写出，出现时对应的代码块文件都已完整；
+    之后删除上一次输出（旧JSON中列出）但这次不再输出、也没有其他文档引用的代码块文件或压缩包
+    add()返回的path是commit()之后才存在的文件
+    :param dedup: 代码块文件按内容哈希命名，内容相同的代码块（包括其他文档中已写出的）共用一个文件
+    :param archive_path: 给出时所有代码块打包进这一个zip文件，记录中path为压缩包路径，member为包内文件名
+    :param low_memory: 代码块不在内存中缓存，到达时即写入临时文件（JSON逐条写入临时文件），commit()时改名，
+                       返回的记录不含code
+    """
+
+    def __init__(self, output_dir, json_path, archive_path=None, dedup=False, low_memory=False):
+        self.output_dir = output_dir
+        self.json_path = json_path
+        self.archive_path = archive_path
+        self.dedup = dedup
+        self.low_memory = low_memory
+        self.records = []
+        # 文件名（压缩包内为成员名） -> 代码；低内存模式下只记录文件名对应代码的哈希
+        self.pending = {}
+        self.temp_files = []
+        self.archive = None
+        self.json_file = None
+        if low_memory:
+            if archive_path is not None:
+                self.archive = zipfile.ZipFile(self._track(archive_path), "w", zipfile.ZIP_DEFLATED)
+            self.json_file = open(_temp_path(json_path), "w", encoding="utf-8")
+
+    def _track(self, path):
+        temp = _temp_path(path)
+        self.temp_files.append((temp, path))
+        return temp
+
+    def _name(self, record):
+        """确定代码块的文件名；不按内容命名时，同名但内容不同的代码块依次加上编号"""
+        name = os.path.basename(record["path"])
+        stem, suffix = os.path.splitext(name)
+        if self.dedup:
+            return content_name(record["code"], suffix)
+        digest = hashlib.sha1(record["code"].encode("utf-8")).digest()
+        number = 1
+        while name in self.pending and self.pending[name] not in (record["code"], digest):
+            name = f"{stem}_{number}{suffix}"
+            number += 1
+        return name
+
+    def add(self, record):
+        """加入一个代码块记录，返回写入JSON的记录（path按命名方式改写）"""
+        name = self._name(record)
+        if self.archive_path is not None:
+            record = dict(record, path=self.archive_path, member=name)
+        else:
+            record = dict(record, path=os.path.join(self.output_dir, name))
+        if not self.low_memory:
+            self.pending[name] = record["code"]
+            self.records.append(record)
+            return record
+
+        if name not in self.pending:
+            if self.archive is not None:
+                self.archive.writestr(name, record["code"])
+            elif not (self.dedup and os.path.exists(record["path"])):
+                with open(self._track(record["path"]), "w", encoding="utf-8") as f:
+                    f.write(record["code"])
+            self.pending[name] = hashlib.sha1(record["code"].encode("utf-8")).digest()
+        self.json_file.write(("[\n" if not self.records else ",\n") + json_list_item(record))
+        self.records.append({key: value for key, value in record.items() if key != "code"})
+        return record
+
+    def _output_names(self):
+        """这次输出的文件名（代码块文件或压缩包）"""
+        if self.archive_path is not None:
+            return {os.path.basename(self.archive_path)}
+        return set(self.pending)
+
+    def _remove_stale(self, previous):
+        """
+        删除上一次输出而这次没有输出的文件；其他文档的JSON仍引用的文件保留
+        （上一次可能按内容命名，与其他文档共用文件，所以不论这次是否按内容命名都要检查）
+        """
+        stale = {os.path.basename(record["path"]) for record in previous} - self._output_names()
+        if stale:
+            json_path = os.path.abspath(self.json_path)
+            for path in glob.glob(os.path.join(glob.escape(self.output_dir), "*.json")):
+                if os.path.abspath(path) != json_path:
+                    stale.difference_update(os.path.basename(record["path"]) for record in _load_records(path))
+        for name in stale:
+            path = os.path.join(self.output_dir, name)
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def commit(self):
+        """写出全部文件并清理上一次输出中多余的文件，返回JSON路径"""
+        previous = _load_records(self.json_path)
+        if self.low_memory:
+            self.json_file.write("\n]" if self.records else "[]")
+            self.json_file.close()
+            if self.archive is not None:
+                self.archive.close()
+            for temp, path in self.temp_files:
+                os.replace(temp, path)
+            self.temp_files = []
+            # JSON最后改名
+            os.replace(_temp_path(self.json_path), self.json_path)
+            self._remove_stale(previous)
+            return self.json_path
+
+        if self.archive_path is not None:
+            temp = _temp_path(self.archive_path)
+            with zipfile.ZipFile(temp, "w", zipfile.ZIP_DEFLATED) as archive:
+                for name, code in self.pending.items():
+                    archive.writestr(name, code)
+            os.replace(temp, self.archive_path)
+        else:
+            for name, code in self.pending.items():
+                path = os.path.join(self.output_dir, name)
+                # 按内容命名的文件已存在时内容必然相同，无需重写
+                if not (self.dedup and os.path.exists(path)):
+                    atomic_write(path, code)
+        atomic_write(self.json_path, json.dumps(self.records, ensure_ascii=False, indent=4))
+        self._remove_stale(previous)
+        return self.json_path
+
+    def abort(self):
+        """出错时删除已写出的临时文件，不影响已有的输出"""
+        if self.json_file is not None:
+            self.json_file.close()
+            self.temp_files.append((_temp_path(self.json_path), self.json_path))
+        if self.archive is not None:
+            self.archive.close()
+        for temp, _ in self.temp_files:
+            if os.path.exists(temp):
+                os.remove(temp)
+        self.temp_files = []
@@ -0,0 +1,106 @@
+import numpy as np
+
+# 代码中常见的符号
+CODE_SYMBOLS = b"{};()#<>="
+# 各特征的权重：符号密度、缩进行比例、类标识符比例
+FEATURE_WEIGHTS = np.array([4.0, 1.0, 1.0])
+# 打分窗口的行数，约为幻灯片上最短的完整代码块
+TRIAGE_WINDOW = 4
+
+def _byte_class(chars):
+    table = np.zeros(256, dtype=bool)
+    table[list(chars)] = True
+    return table
+
+_SYMBOL = _byte_class(CODE_SYMBOLS)
+_SPACE = _byte_class(b" \t")
+_BLANK = _byte_class(b" \t\r\n\f\v")
+_UPPER = _byte_class(range(ord("A"), ord("Z") + 1))
+_LOWER = _byte_class(range(ord("a"), ord("z") + 1))
+_ALPHA = _UPPER | _LOWER
+_WORD = _ALPHA | _byte_class(b"0123456789_")
+_NEWLINE, _UNDERSCORE, _PAREN, _DOT = ord("\n"), ord("_"), ord("("), ord(".")
+
+def _line_features(texts):
+    """
+    多页文本中每个非空行的特征计数，所有页面的字节拼接为一个数组后一次求出，再按行号用bincount汇总
+    :return: (计数, 总数, 各行所在页号)，计数和总数为(行数, 3)数组，依次为
+             代码符号数 / 非空白ASCII字符数（中文等多字节字符不计入）、
+             以空格或制表符开头的行数 / 行数、
+             类标识符（含下划线、后接左括号、a.b成员访问或驼峰大小写的单词）数 / 单词数
+    """
+    count = len(texts)
+    pages = [text.encode("utf-8") for text in texts]
+    # 每页前加一个换行，页首即行首，也保证相邻页面的字节不会连成一个单词
+    data = np.frombuffer(b"".join(b"\n" + page for page in pages), dtype=np.uint8)
+    page_of = np.repeat(np.arange(count), [len(page) + 1 for page in pages])
+    prev = np.concatenate([[_NEWLINE], data[:-1]])
+    after = np.concatenate([data[1:], [_NEWLINE]])
+    # 每个换行开始新的一行，换行本身不属于任何特征
+    newline = data == _NEWLINE
+    line_of = np.cumsum(newline) - 1
+    lines = int(line_of[-1]) + 1
+
+    def per_line(mask):
+        return np.bincount(line_of, weights=mask, minlength=lines)
+
+    line_start = (prev == _NEWLINE) & ~newline
+    word_start = _ALPHA[data] & ~_WORD[prev]
+    identifier = (((data == _UNDERSCORE) | (data == _PAREN)) & _WORD[prev]
+                  | (data == _DOT) & _ALPHA[prev] & _ALPHA[after]
+                  | _UPPER[data] & _LOWER[prev])
+    counts = np.stack([per_line(_SYMBOL[data]), per_line(line_start & _SPACE[data] & (after != _NEWLINE)),
+                       per_line(identifier)], axis=1)
+    totals = np.stack([per_line(~_BLANK[data] & (data < 128)), per_line(line_start), per_line(word_start)], axis=1)
+    # 空行不参与窗口，否则段落间的空行会稀释相邻的代码
+    keep = totals[:, 1] > 0
+    return counts[keep], totals[keep], page_of[newline][keep]
+
+def page_features(texts):
+    """
+    多页文本的特征（见_line_features），按页汇总
+    :return: (页数, 3)数组，依次为符号密度、缩进行比例、类标识符比例
+    """
+    count = len(texts)
+    if not count:
+        return np.zeros((0, 3))
+    counts, totals, line_page = _line_features(texts)
+    page_counts = np.stack([np.bincount(line_page, weights=column, minlength=count) for column in counts.T], axis=1)
+    page_totals = np.stack([np.bincount(line_page, weights=column, minlength=count) for column in totals.T], axis=1)
+    return page_counts / np.maximum(page_totals, 1)
+
+def triage_scores(texts, window=TRIAGE_WINDOW):
+    """
+    各页是否像代码的得分：每页中连续window个非空行的特征加权和，取各窗口的最大值
+    按窗口而不是整页打分，同一页上的大段文字不会拉低其中的一段代码；不足window行的页面整页作为一个窗口
+    """
+    count = len(texts)
+    scores = np.zeros(count)
+    if not count:
+        return scores
+    counts, totals, line_page = _line_features(texts)
+    if not len(line_page):
+        return scores
+    # 各页非空行的起止行号（行按页连续排列）
+    pages, first = np.unique(line_page, return_index=True)
+    last = np.append(first[1:], len(line_page))
+    page_end = np.zeros(count, dtype=np.int64)
+    page_end[pages] = last
+    page_first = np.zeros(count, dtype=np.int64)
+    page_first[pages] = first
+    # 用前缀和求每个窗口的计数和总数：从第i行开始、到第i+window行或页末为止
+    starts = np.arange(len(line_page))
+    ends = np.minimum(starts + window, page_end[line_page])
+    prefix_counts = np.concatenate([np.zeros((1, 3)), np.cumsum(counts, axis=0)])
+    prefix_totals = np.concatenate([np.zeros((1, 3)), np.cumsum(totals, axis=0)])
+    window_scores = ((prefix_counts[ends] - prefix_counts[starts])
+                     / np.maximum(prefix_totals[ends] - prefix_totals[starts], 1)) @ FEATURE_WEIGHTS
+    # 页末不足window行的窗口只是其他窗口的一部分，不单独计分（每页的第一个窗口除外）
+    full = (starts + window <= page_end[line_page]) | (starts == page_first[line_page])
+    window_scores[~full] = -np.inf
+    scores[pages] = np.maximum.reduceat(window_scores, first)
+    return scores
+
+def pages_to_scan(texts, threshold):
+    """得分不低于threshold的页面需要做文本代码识别，返回布尔列表"""
+    return (triage_scores(texts) >= threshold).tolist()
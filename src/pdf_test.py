@@ -1,44 +1,165 @@
 import os
-from PIL import Image
 import sys
-import easyocr
-from text_to_code import checkcode,postprocess_code_blocks
+from text_to_code import checkcode,postprocess_code_blocks,detect_language,locate_code_blocks
 import fitz
 from difflib import SequenceMatcher
 import json
+import argparse
+import contextlib
+import signal
+import time
+import hashlib
+import struct
+import re
+import io
+from recognition_cache import RecognitionCache
+from stage_profiler import profiler
+from memory_guard import MemoryGuard, release_memory
+from output_writer import OutputWriter
 
 # 定义全局reader变量，避免反复初始化
 reader = None
 
-def image_to_text(image):
+# easyocr（依赖torch）、PIL和numpy都在第一次真正需要识别图片时才导入，纯文本PDF不加载这些模块
+def get_reader():
+    """获取全局EasyOCR reader，首次调用时初始化"""
     global reader
-    
-    # 首次使用时初始化reader
     if reader is None:
+        import easyocr
         # 只需导入一次所需语言模型 ['en']=英语, ['en', 'ch_sim']=英语+简体中文
         reader = easyocr.Reader(['en'], gpu=False) 
         print("EasyOCR初始化完成")
-    
-    # 预处理图像（提高OCR精度）
-    img = image
-    img = img.convert('L')  # 灰度化
+    return reader
+
+# OCR前的图片预处理步骤（见ocr_preprocess.py），默认不做二值化
+OCR_PREPROCESS_STEPS = ("contrast", "crop", "downscale", "binarize", "split")
+DEFAULT_OCR_PREPROCESS = ("contrast", "crop", "downscale", "split")
+
+def preprocess_image(image, steps=DEFAULT_OCR_PREPROCESS):
+    """预处理图像（提高OCR精度、减少像素），返回依次识别的灰度数组列表"""
+    from ocr_preprocess import preprocess
+    with profiler.span("preprocess", steps=",".join(steps)):
+        return preprocess(image, steps)
+
+# 相邻文本框中心的纵向距离超过中位框高的该比例时视为新的一行
+OCR_ROW_GAP = 0.5
+# 行首相对左边界超过该字符数才算缩进
+MIN_INDENT_COLUMNS = 1.5
+
+def layout_ocr_text(results, y_offsets=None):
+    """
+    按EasyOCR返回的文本框位置还原文本：按中心纵坐标聚成行，行内按横坐标排序，
+    行首相对最左文本的偏移按估计的字符宽度换算为缩进层级（每层4个空格）
+    :param results: [(四点坐标, 文本, 置信度)...]
+    :param y_offsets: 与results对应的纵向偏移（图片切条识别时各条在原图中的位置）
+    """
+    import numpy as np
+    keep = [i for i, (_, text, _) in enumerate(results) if text.strip()]
+    if not keep:
+        return ""
+    boxes = np.array([np.asarray(results[i][0], dtype=np.float64).reshape(-1, 2) for i in keep])
+    texts = [results[i][1].strip() for i in keep]
+    if y_offsets is not None:
+        boxes[:, :, 1] += np.asarray([y_offsets[i] for i in keep], dtype=np.float64)[:, None]
+    left, right = boxes[:, :, 0].min(axis=1), boxes[:, :, 0].max(axis=1)
+    top, bottom = boxes[:, :, 1].min(axis=1), boxes[:, :, 1].max(axis=1)
+    centers = (top + bottom) / 2
+    lengths = np.array([len(text) for text in texts], dtype=np.float64)
+    char_width = max(float(np.median((right - left) / lengths)), 1.0)
+
+    # 按中心纵坐标排序，间距超过阈值处断开为新行；行内按横坐标排序
+    order = np.argsort(centers, kind='stable')
+    gaps = np.diff(centers[order]) > OCR_ROW_GAP * max(float(np.median(bottom - top)), 1.0)
+    row_of = np.empty(len(texts), dtype=np.int64)
+    row_of[order] = np.concatenate([[0], np.cumsum(gaps)])
+    ordered = np.lexsort((left, row_of))
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(row_of[ordered]) > 0]))
+    rows = np.split(ordered, starts[1:])
+
+    # 缩进单位取最小的非零缩进，其余缩进按它的倍数换算为层级
+    columns = np.array([(left[row[0]] - left.min()) / char_width for row in rows])
+    indented = columns[columns >= MIN_INDENT_COLUMNS]
+    unit = float(indented.min()) if indented.size else 1.0
+    lines = []
+    for row, column in zip(rows, columns):
+        level = int(round(column / unit)) if column >= MIN_INDENT_COLUMNS else 0
+        lines.append('    ' * level + ' '.join(texts[i] for i in row))
+    return '\n'.join(lines)
+
+def image_to_text(image, steps=DEFAULT_OCR_PREPROCESS):
+    # 首次使用时初始化reader
+    reader = get_reader()
     
     # 使用EasyOCR进行文本识别
     try:
-        # 将PIL图像转换为numpy数组
-        import numpy as np
-        img_array = np.array(img)
-        
-        # 执行OCR
-        results = reader.readtext(img_array)
+        # 预处理后的图片可能被切成多条，按从上到下的顺序识别，记录每条在图中的纵向位置
+        results = []
+        y_offsets = []
+        offset = 0
+        for img_array in preprocess_image(image, steps):
+            # 执行OCR
+            with profiler.span("readtext"):
+                strip_results = reader.readtext(img_array)
+            results.extend(strip_results)
+            y_offsets.extend([offset] * len(strip_results))
+            offset += img_array.shape[0]
         
-        # 提取所有识别的文本并拼接
-        extracted_text = '\n'.join([text for _, text, _ in results])
-        return extracted_text
+        # 按文本框位置还原行和缩进
+        return layout_ocr_text(results, y_offsets)
     except Exception as e:
         print(f"OCR处理错误: {e}")
         return ""
 
+def _pad_to(array, height, width):
+    """用图片边框的中位灰度把图片补到指定大小（补在右侧和下方，不影响原有坐标）"""
+    import numpy as np
+    pad_h, pad_w = height - array.shape[0], width - array.shape[1]
+    if pad_h == 0 and pad_w == 0:
+        return array
+    border = np.concatenate([array[0], array[-1], array[:, 0], array[:, -1]])
+    return np.pad(array, ((0, pad_h), (0, pad_w)), mode='constant', constant_values=int(np.median(border)))
+
+def images_to_text(images, batch_size=8, steps=DEFAULT_OCR_PREPROCESS):
+    """
+    批量OCR：预处理后的图片（条）按尺寸排序后每batch_size张分为一组，组内补边到相同大小再调用readtext_batched
+    :param images: PIL图像列表
+    :return: 与images一一对应的识别文本
+    """
+    reader = get_reader()
+    arrays = []
+    owners = []
+    strip_offsets = []
+    for index, img in enumerate(images):
+        offset = 0
+        for array in preprocess_image(img, steps):
+            arrays.append(array)
+            owners.append(index)
+            strip_offsets.append(offset)
+            offset += array.shape[0]
+    # 尺寸相近的图片放在同一组，尽量减少补边的像素
+    order = sorted(range(len(arrays)), key=lambda i: arrays[i].shape)
+    strip_results = [[] for _ in arrays]
+    for start in range(0, len(order), batch_size):
+        group = order[start:start + batch_size]
+        height = max(arrays[i].shape[0] for i in group)
+        width = max(arrays[i].shape[1] for i in group)
+        try:
+            with profiler.span("readtext_batched", images=len(group)):
+                results = reader.readtext_batched([_pad_to(arrays[i], height, width) for i in group],
+                                                  batch_size=batch_size)
+        except Exception as e:
+            print(f"批量OCR处理错误: {e}")
+            continue
+        for i, result in zip(group, results):
+            strip_results[i] = result
+    # 同一张图片各条的文本框合在一起还原行和缩进（补边在右侧和下方，坐标不受影响）
+    image_results = [[] for _ in images]
+    image_offsets = [[] for _ in images]
+    for owner, result, offset in zip(owners, strip_results, strip_offsets):
+        image_results[owner].extend(result)
+        image_offsets[owner].extend([offset] * len(result))
+    return [layout_ocr_text(result, offsets) for result, offsets in zip(image_results, image_offsets)]
+
 def merge_rectangles(rectangles):
     if not rectangles:
         return None
@@ -46,130 +167,1188 @@ def merge_rectangles(rectangles):
     y0 = min(rect.y0 for rect in rectangles)
     x1 = max(rect.x1 for rect in rectangles)
     y1 = max(rect.y1 for rect in rectangles)
-    print(x0, y0, x1, y1)
     return fitz.Rect(x0, y0, x1, y1)
 
+# 识别结果缓存默认放在输出目录下，大小上限64MB
+CACHE_FILE_NAME = ".recognition_cache.sqlite"
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+LANGUAGE_TO_SUFFIX = {'C': '.c', 'C++': '.cpp', 'Java': '.java', 'Python': '.py', 'Unknown': '.txt'}
+
+# 识别逻辑变化导致结果不同时递增，使旧的缓存条目失效
+CACHE_VERSION = 13
+
+# 图片过滤阈值：短边或面积过小的图标、过于细长的分隔线不做OCR
+MIN_IMAGE_SIDE = 16
+MIN_IMAGE_AREA = 64 * 64
+MAX_IMAGE_ASPECT = 25
+# 文字判定：缩小到该尺寸后统计，强边缘密度和主色占比均达到阈值才认为可能含文字
+TEXT_PROBE_SIZE = 256
+STRONG_EDGE = 48
+MIN_EDGE_DENSITY = 0.005
+MIN_BACKGROUND_SHARE = 0.25
+
+def looks_like_text(image):
+    """
+    粗略判断图片是否可能包含文字
+    代码截图背景颜色单一、笔画边缘锐利；照片颜色连续，缺少占主导的背景色
+    """
+    import numpy as np
+    small = image.convert('L')
+    small.thumbnail((TEXT_PROBE_SIZE, TEXT_PROBE_SIZE))
+    pixels = np.asarray(small, dtype=np.int16)
+    if pixels.shape[0] < 2 or pixels.shape[1] < 2:
+        return True
+    # 水平方向相邻像素的灰度差超过阈值即视为强边缘
+    edges = np.abs(np.diff(pixels, axis=1)) > STRONG_EDGE
+    edge_density = np.count_nonzero(edges) / edges.size
+    # 灰度量化为16级，最多的一级作为背景色
+    histogram = np.bincount((pixels >> 4).ravel(), minlength=16)
+    background_share = histogram.max() / pixels.size
+    return edge_density >= MIN_EDGE_DENSITY and background_share >= MIN_BACKGROUND_SHARE
+
+IMAGE_STAT_NAMES = ("images", "xref_hits", "hash_hits", "too_small", "bad_aspect", "not_text", "unreadable",
+                    "ocr_calls", "ocr_paused")
+
+class ImageOCRFilter:
+    """
+    文档级的OCR前置过滤：按xref和图片内容哈希缓存OCR结果，
+    每页重复出现的logo、页眉图片只识别一次；过小、过于细长或不像文字的图片直接跳过
+    stats记录各类情况的次数，ocr_calls为实际调用EasyOCR的次数，
+    ocr_paused为超出内存上限的次数：暂停一批预读（改为逐张识别），或逐张识别时超限
+    （释放缓存后与其他超限的工作进程串行识别，识别后再次释放）
+    """
+
+    def __init__(self, doc, preprocess=DEFAULT_OCR_PREPROCESS, guard=None):
+        self.doc = doc
+        # MemoryGuard，超出常驻内存上限时不再预读整批图片，逐张识别也改为串行并在识别后释放缓存
+        self.guard = guard
+        self.preprocess = tuple(preprocess)
+        # 预处理步骤不同，识别结果也不同，作为页面缓存键的一部分
+        self.cache_variant = ",".join(self.preprocess)
+        self.by_xref = {}
+        self.by_digest = {}
+        self.seen = set()
+        self.stats = dict.fromkeys(IMAGE_STAT_NAMES, 0)
+
+    def image_text(self, xref):
+        """返回图片的OCR文本，跳过的图片返回空字符串"""
+        self.stats["images"] += 1
+        if xref in self.seen:
+            self.stats["xref_hits"] += 1
+        self.seen.add(xref)
+        if xref not in self.by_xref:
+            self._resolve(xref)
+        return self.by_xref[xref]
+
+    def prefetch(self, xrefs, batch_size):
+        """
+        批量OCR：先确定这些图片中真正需要识别的部分，再分批送入EasyOCR，
+        结果写入缓存，之后的image_text调用直接命中
+        """
+        if self.guard is not None and not self.guard.has_room():
+            # 内存超限：本批图片留到image_text中逐张识别，识别完立即释放
+            self.stats["ocr_paused"] += 1
+            return
+        pending = {}
+        for xref in dict.fromkeys(xrefs):
+            if xref not in self.by_xref:
+                self._resolve(xref, pending)
+        if not pending:
+            return
+        digests = list(pending)
+        self.stats["ocr_calls"] += len(digests)
+        texts = images_to_text([pending[digest][0] for digest in digests], batch_size, self.preprocess)
+        for digest, text in zip(digests, texts):
+            pending[digest][0].close()
+            self.by_digest[digest] = text
+            for xref in pending[digest][1]:
+                self.by_xref[xref] = text
+
+    def _resolve(self, xref, pending=None):
+        """
+        确定xref对应的文本并写入缓存
+        pending不为None时，需要OCR的图片按内容哈希放入pending（图片, [xref...]），由调用方批量识别
+        """
+        # 提取图像数据
+        with profiler.span("extract_image"):
+            base_image = self.doc.extract_image(xref)
+        image_bytes = base_image.pop("image")
+        digest = hashlib.sha1(image_bytes).hexdigest()
+        if digest in self.by_digest:
+            self.stats["hash_hits"] += 1
+            self.by_xref[xref] = self.by_digest[digest]
+            return
+        if pending is not None and digest in pending:
+            self.stats["hash_hits"] += 1
+            pending[digest][1].append(xref)
+            return
+        img_pil = self._ocr_candidate(base_image, image_bytes)
+        if img_pil is None:
+            text = ""
+        elif pending is not None:
+            pending[digest] = (img_pil, [xref])
+            return
+        else:
+            self.stats["ocr_calls"] += 1
+            with self.guard.ocr_slot() if self.guard is not None else contextlib.nullcontext(False) as paused:
+                if paused:
+                    self.stats["ocr_paused"] += 1
+                text = image_to_text(img_pil, self.preprocess)
+                img_pil.close()
+        self.by_digest[digest] = text
+        self.by_xref[xref] = text
+
+    def _ocr_candidate(self, base_image, image_bytes):
+        """通过过滤条件时返回PIL图像，否则返回None"""
+        width, height = base_image["width"], base_image["height"]
+        if min(width, height) < MIN_IMAGE_SIDE or width * height < MIN_IMAGE_AREA:
+            self.stats["too_small"] += 1
+            return None
+        if max(width, height) / max(min(width, height), 1) > MAX_IMAGE_ASPECT:
+            self.stats["bad_aspect"] += 1
+            return None
+        # 转换为PIL图像
+        from PIL import Image
+        try:
+            with profiler.span("pil_decode"):
+                img_pil = Image.open(io.BytesIO(image_bytes))
+                img_pil.load()
+        except Exception as e:
+            print(f"无法读取图片: {e}")
+            self.stats["unreadable"] += 1
+            return None
+        with profiler.span("looks_like_text"):
+            is_text = looks_like_text(img_pil)
+        if not is_text:
+            self.stats["not_text"] += 1
+            return None
+        return img_pil
+
+def sum_image_stats(stats_list):
+    """汇总多个ImageOCRFilter（例如多个工作进程）的统计"""
+    total = dict.fromkeys(IMAGE_STAT_NAMES, 0)
+    for stats in stats_list:
+        for name, value in stats.items():
+            total[name] += value
+    return total
+
+# PyMuPDF span flags中的等宽标记（TEXT_FONT_MONOSPACED）；很多PDF的字体描述不带该标记，同时按字体名判断
+MONOSPACE_FLAG = 8
+MONOSPACE_FONT = re.compile(r"courier|consol|mono|menlo|monaco|inconsolata|lucida ?console|source ?code|fira ?code"
+                            r"|cascadia|jetbrains|andale|typewriter", re.I)
+
+def is_monospace_span(span):
+    return bool(span.get("flags", 0) & MONOSPACE_FLAG) or MONOSPACE_FONT.search(span.get("font", "")) is not None
+
+def document_uses_monospace(doc):
+    """文档中是否用到等宽字体，只读取各页的字体资源，不解析页面内容"""
+    for page_index in range(doc.page_count):
+        for font in doc.get_page_fonts(page_index):
+            if MONOSPACE_FONT.search(font[3]):
+                return True
+    return False
+
+class LayoutLine:
+    """版面中的一行文本：text为各span拼接后的文本，rect为整行的外接矩形"""
+    __slots__ = ("text", "rect", "spans")
+
+    def __init__(self, text, rect, spans):
+        self.text = text
+        self.rect = rect
+        self.spans = spans
+
+class PageLayout:
+    """
+    页面版面模型：一次get_text("dict")取得所有文本行（含bbox、字体信息），
+    一次get_image_info取得图片位置，文本提取、图片定位和代码块定位都基于这一份结构
+    self.text的第i行即self.lines[i]，提取代码块时得到的行号可直接换算为位置
+    """
+
+    def __init__(self, page):
+        self.rect = page.rect
+        self.width, self.height = page.rect.width, page.rect.height
+        self.lines = []
+        # TEXTFLAGS_TEXT不包含图片块，避免为每张图片解码数据
+        with profiler.span("get_text"):
+            data = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
+        for block in data["blocks"]:
+            if block.get("type", 0) != 0:
+                continue
+            for line in block["lines"]:
+                spans = line["spans"]
+                self.lines.append(LayoutLine(''.join(span["text"] for span in spans), fitz.Rect(line["bbox"]), spans))
+        # 与page.get_text()相同：每行文本后跟一个换行符
+        self.text = ''.join(line.text + '\n' for line in self.lines)
+        self._monospace = None
+        with profiler.span("get_image_info"):
+            self.xrefs = [img[0] for img in page.get_images(full=True)]
+            self.image_rects = {}
+            for info in page.get_image_info(xrefs=True):
+                self.image_rects.setdefault(info["xref"], fitz.Rect(info["bbox"]))
+
+    def monospace_text(self):
+        """
+        只由等宽字体的行（非空白字符过半为等宽字体）组成的文本，不相邻的两段之间插入空行
+        :return: (文本, 文本中每行对应的版面行号，插入的空行为None)
+        """
+        if self._monospace is None:
+            self._monospace = self._monospace_text()
+        return self._monospace
+
+    def _monospace_text(self):
+        text_lines = []
+        line_map = []
+        for index, line in enumerate(self.lines):
+            total = mono = 0
+            for span in line.spans:
+                size = len(span["text"].strip())
+                total += size
+                if is_monospace_span(span):
+                    mono += size
+            if not total or mono * 2 <= total:
+                continue
+            if line_map and line_map[-1] != index - 1:
+                text_lines.append('')
+                line_map.append(None)
+            text_lines.append(line.text)
+            line_map.append(index)
+        return ''.join(line + '\n' for line in text_lines), line_map
+
+    def image_rect(self, xref):
+        """图片在页面中的位置，找不到时返回整页"""
+        return self.image_rects.get(xref, self.rect)
+
+    def lines_rect(self, indices):
+        """由行号（对应self.text中的行）计算这些行的外接矩形，没有有效行时返回整页"""
+        rects = [self.lines[i].rect for i in indices if i < len(self.lines)]
+        return merge_rectangles(rects) or self.rect
+
+    def relative(self, rect):
+        """把矩形换算为相对页面宽高的[x, y, w, h]"""
+        return [rect[0] / self.width, rect[1] / self.height,
+                (rect[2] - rect[0]) / self.width, (rect[3] - rect[1]) / self.height]
+
+# 识别一段文本中的代码块
+def recognize_text(text, position_of):
+    """
+    :param text: 待识别的文本，每行以换行结尾
+    :param position_of: 由代码块所在行的行号列表求相对位置[x, y, w, h]的函数
+    :return: 代码块记录列表，slot为代码块编号
+    """
+    records = []
+    with profiler.span("detect_language"):
+        lang = detect_language(text)
+    if lang:
+        with profiler.span("locate_code_blocks", language=lang):
+            origin_text_code, text_code, line_indices = locate_code_blocks(text, lang)
+        for num, line in enumerate(text_code):
+            records.append({
+                "type": "code",
+                "slot": str(num),
+                "position": position_of(line_indices[num]),
+                "language": lang,
+                "code": line  # 保存修正后的代码
+            })
+    return records
+
+# 识别单个页面中的文本代码和图片代码
+def page_code_text(layout, font_filter):
+    """
+    页面中待识别代码的文本：整页文本，或font_filter为真时只取等宽字体的行（该页没有等宽行时仍为整页文本）
+    :return: (文本, 由文本中的行号列表求相对位置的函数)
+    """
+    if font_filter:
+        text, line_map = layout.monospace_text()
+        if line_map:
+            return text, lambda indices: layout.relative(layout.lines_rect(
+                [line_map[i] for i in indices if i < len(line_map) and line_map[i] is not None]))
+    return layout.text, lambda indices: layout.relative(layout.lines_rect(indices))
+
+def recognize_page(layout, images, font_filter=False, scan_text=True):
+    """
+    :param layout: 页面的PageLayout
+    :param images: 该文档的ImageOCRFilter
+    :param font_filter: 为真时先只在等宽字体的行中识别文本代码（文档用等宽字体排版代码时），
+                        没有等宽行或等宽行中没有识别出代码的页面识别整页文本
+    :param scan_text: 为假时跳过文本代码识别（页面初筛认为不含代码），只识别图片
+    :return: 该页代码块记录列表，slot为代码块在页内的编号（决定输出文件名），不含页码和路径
+    """
+    # 处理页面文本中的代码，代码块由版面中的哪些行组成在提取时已经确定，直接合并这些行的位置
+    records = recognize_text(*page_code_text(layout, font_filter)) if scan_text else []
+    # 等宽行中没有识别出代码（例如只是一行命令）时再对整页文本识别，代码本身可能用比例字体排版
+    if scan_text and not records and font_filter and layout.monospace_text()[1]:
+        records = recognize_text(*page_code_text(layout, False))
+    
+    # 图像代码处理部分
+    img_num = 0
+    for xref in layout.xrefs:
+        # OCR识别图像中的文本（重复、过小或不像文字的图片不做OCR）
+        img_text = images.image_text(xref)
+        
+        # 检查提取的文本是否包含代码
+        with profiler.span("checkcode"):
+            img_iscode, origin_img_code_blocks, img_code_blocks, img_lang = checkcode(img_text)
+        
+        if img_iscode and img_code_blocks:
+            # 获取图像在页面中的位置
+            img_rect = layout.image_rect(xref)
+            for block_num, block in enumerate(img_code_blocks):
+                # 添加到JSON输出；同一张图片的多个代码块各自编号，避免写入同一个文件
+                records.append({
+                    "type": "image_code",
+                    "slot": f"img_{img_num}" if block_num == 0 else f"img_{img_num}_{block_num}",
+                    "position": layout.relative(img_rect),
+                    "language": img_lang,
+                    "code": block
+                })
+            
+            img_num += 1
+    return records
+
+def recognition_variant(images, font_filter, triage=None):
+    """影响识别结果的设置，作为页面缓存键的一部分"""
+    return images.cache_variant + ("|mono" if font_filter else "") + (f"|triage={triage}" if triage is not None else "")
+
+def page_cache_key(doc, layout, variant=""):
+    """
+    页面内容哈希：页面文本、页面尺寸以及每张嵌入图片的原始数据
+    内容不变的页面（即使页码变化）得到相同的键；variant为影响识别结果的设置（如OCR预处理步骤）
+    """
+    with profiler.span("cache_key"):
+        return _page_digest(doc, layout, variant)
+
+def _page_digest(doc, layout, variant):
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}|{variant}|{layout.width}x{layout.height}|".encode("utf-8"))
+    digest.update(layout.text.encode("utf-8"))
+    # 记录中的位置由行和图片的外接矩形换算，文本不变而版面移动时也要重新识别；字体决定等宽筛选的结果
+    for line in layout.lines:
+        digest.update(struct.pack("<4d", *line.rect))
+        digest.update("\x1f".join(span.get("font", "") for span in line.spans).encode("utf-8"))
+    for xref, rect in layout.image_rects.items():
+        digest.update(struct.pack("<q4d", xref, *rect))
+    for xref in layout.xrefs:
+        try:
+            # 直接读取图片流的原始字节，无需解码
+            image_bytes = doc.xref_stream_raw(xref)
+        except Exception:
+            image_bytes = doc.extract_image(xref)["image"]
+        digest.update(b"|img|")
+        digest.update(hashlib.sha256(image_bytes or b"").digest())
+    return digest.hexdigest()
+
+# 识别单个页面，返回带页码和输出路径的代码块记录
+def process_page(doc, layout, page_id, file_name, output_dir, images, cache=None, key=None, font_filter=False,
+                 scan_text=True):
+    """
+    :param doc: 页面所属的fitz文档（用于提取图片）
+    :param layout: 页面的PageLayout
+    :param page_id: 页码，从1开始
+    :param images: 该文档的ImageOCRFilter
+    :param cache: RecognitionCache，页面内容未变化时直接复用上次的识别结果
+    :param key: 已计算好的页面缓存键（可选）
+    :param font_filter: 只在等宽字体的行中识别文本代码
+    :param scan_text: 为假时跳过文本代码识别（由process_pages按初筛结果给出，缓存键中含初筛阈值）
+    :return: 该页代码块记录列表，path为代码文件的输出路径（由调用方写入）
+    """
+    with profiler.span("page", page=page_id):
+        records = None
+        if cache is not None:
+            key = key or page_cache_key(doc, layout, recognition_variant(images, font_filter))
+            with profiler.span("cache_get"):
+                records = cache.get(key)
+        if records is None:
+            records = recognize_page(layout, images, font_filter, scan_text)
+            if cache is not None:
+                with profiler.span("cache_put"):
+                    cache.put(key, records)
+
+        return output_records(records, page_id, file_name, output_dir)
+
+def output_records(records, page_id, file_name, output_dir):
+    """为识别记录补上页码和代码文件的输出路径，output_dir为None（不写文件）时path为None"""
+    result = []
+    for record in records:
+        out_file = None
+        if output_dir is not None:
+            out_file = os.path.join(output_dir, f"{file_name}_Page_{page_id}_{record['slot']}"
+                                                f"{LANGUAGE_TO_SUFFIX[record['language']]}")
+        result.append({
+            "type": record["type"],
+            "page": page_id,
+            "position": record["position"],
+            "path": out_file,
+            "language": record["language"],
+            "code": record["code"]
+        })
+    return result
+
+# 批量OCR时每次预读的页数，这些页面中待识别的图片合并后分批送入EasyOCR
+OCR_PAGE_WINDOW = 16
+# 低内存模式下每次处理的页数，每处理完一组释放一次缓存
+LOW_MEMORY_PAGE_WINDOW = 4
+# 页面初筛的默认阈值（见page_triage，按页内得分最高的行窗口计分）：合成语料中代码页（包括与大段文字同页的代码）
+# 得分不低于1.6，去掉缩进的短代码片段约0.8，含括号、分号的课件文字约0.2；取较低的值，宁可多识别也不漏掉代码
+DEFAULT_TRIAGE_THRESHOLD = 0.15
+
+def process_pages(doc, page_indices, file_name, output_dir, images, cache=None, ocr_batch=1, font_filter=False,
+                  triage=None, page_stats=None):
+    """
+    识别一组页面，返回每页的代码块记录列表
+    ocr_batch>1时先收集这组页面中（未命中缓存的）图片，按批做OCR，再逐页生成记录
+    triage不为None时先对这组页面的文本一次性打分，得分低于triage的页面跳过文本代码识别（图片照常识别），
+    跳过的页数累加到page_stats["triage_skipped"]
+    """
+    layouts = [PageLayout(doc[i]) for i in page_indices]
+    variant = recognition_variant(images, font_filter, triage)
+    keys = [page_cache_key(doc, layout, variant) if cache is not None else None for layout in layouts]
+    scan = [True] * len(layouts)
+    if triage is not None:
+        from page_triage import pages_to_scan
+        with profiler.span("triage", first_page=page_indices[0] + 1, pages=len(page_indices)):
+            # 按整页文本打分：等宽行中没有代码时仍会识别整页文本
+            scan = pages_to_scan([layout.text for layout in layouts], triage)
+        if page_stats is not None:
+            page_stats["triage_skipped"] += scan.count(False)
+    if ocr_batch > 1:
+        xrefs = [xref for layout, key in zip(layouts, keys) if key is None or not cache.contains(key)
+                 for xref in layout.xrefs]
+        with profiler.span("ocr_prefetch", first_page=page_indices[0] + 1, pages=len(page_indices)):
+            images.prefetch(xrefs, ocr_batch)
+    return [process_page(doc, layout, i + 1, file_name, output_dir, images, cache, key, font_filter, scan_text)
+            for i, layout, key, scan_text in zip(page_indices, layouts, keys, scan)]
+
+def new_page_stats():
+    """页面统计：triage_skipped为页面初筛跳过文本代码识别的页数"""
+    return {"triage_skipped": 0}
+
+def _page_windows(page_count, window):
+    return [list(range(start, min(start + window, page_count))) for start in range(0, page_count, window)]
+
+def open_document(source):
+    """打开PDF：source为文件路径，或PDF内容（bytes、bytearray、memoryview，直接在内存中打开）"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def open_cache(cache_path, cache_size):
+    """打开识别结果缓存，cache_path为None时不使用缓存"""
+    if not cache_path:
+        return None
+    return RecognitionCache(cache_path, max_bytes=cache_size)
+
+# 多进程模式下每个工作进程各自打开一份文档和缓存连接，OCR reader也在进程内按需初始化
+_worker_doc = None
+_worker_cache = None
+_worker_images = None
+_worker_low_memory = False
+
+def _init_page_worker(source, cache_path, cache_size, profile=False, preprocess=DEFAULT_OCR_PREPROCESS,
+                      low_memory=False, memory_limit=None, ocr_lock=None):
+    global _worker_doc, _worker_cache, _worker_images, _worker_low_memory
+    profiler.enable(profile)
+    _worker_doc = open_document(source)
+    _worker_cache = open_cache(cache_path, cache_size)
+    _worker_images = ImageOCRFilter(_worker_doc, preprocess,
+                                    MemoryGuard(memory_limit, ocr_lock) if memory_limit is not None else None)
+    _worker_low_memory = low_memory
+
+def _process_pages_in_worker(task):
+    page_indices, file_name, output_dir, ocr_batch, font_filter, triage = task
+    page_stats = new_page_stats()
+    page_records = process_pages(_worker_doc, page_indices, file_name, output_dir, _worker_images, _worker_cache,
+                                 ocr_batch, font_filter, triage, page_stats)
+    if _worker_low_memory:
+        release_memory()
+    # 附带本进程累计的图片统计（由主进程按进程汇总）、本批页面的页面统计和计时记录
+    return page_records, os.getpid(), dict(_worker_images.stats), page_stats, profiler.drain()
+
+def _iter_pages_parallel(source, file_name, output_dir, workers, cache_path, cache_size, ocr_batch, image_stats,
+                         preprocess=DEFAULT_OCR_PREPROCESS, low_memory=False, memory_limit=None, font_filter=False,
+                         triage=None, page_stats=None):
+    """
+    将页面分组分发到进程池处理，按页码顺序逐页返回结果
+    source为文件路径或PDF内容，PDF内容随初始化参数传给每个工作进程
+    image_stats为各工作进程的图片统计，key为进程号；各批页面的页面统计累加到page_stats
+    memory_limit为每个工作进程的常驻内存上限（字节），超出上限的工作进程通过共用的锁串行OCR
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    if isinstance(source, memoryview):
+        # memoryview不能pickle，传给工作进程前复制为bytes
+        source = source.tobytes()
+    doc = open_document(source)
+    page_count = doc.page_count
+    doc.close()
+    # 每个进程一次领取几页，减少进程间通信，同时作为批量OCR的范围；torch与fork不兼容，统一使用spawn
+    window = min(LOW_MEMORY_PAGE_WINDOW if low_memory else OCR_PAGE_WINDOW, max(1, page_count // (workers * 4)))
+    tasks = [(indices, file_name, output_dir, ocr_batch, font_filter, triage)
+             for indices in _page_windows(page_count, window)]
+    context = multiprocessing.get_context("spawn")
+    ocr_lock = context.Lock() if memory_limit is not None else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_page_worker,
+                             initargs=(source, cache_path, cache_size, profiler.enabled, preprocess, low_memory,
+                                       memory_limit, ocr_lock)) as executor:
+        # map按提交顺序返回，保证JSON中的页面顺序和文件编号与单进程一致
+        for page_records, pid, stats, batch_stats, trace in executor.map(_process_pages_in_worker, tasks):
+            image_stats[pid] = stats
+            if page_stats is not None:
+                for name, value in batch_stats.items():
+                    page_stats[name] += value
+            profiler.merge(*trace)
+            yield from page_records
+
+def _iter_pages_sequential(doc, file_name, output_dir, images, cache, ocr_batch, low_memory=False, font_filter=False,
+                           triage=None, page_stats=None):
+    """
+    单进程按页码顺序处理；批量OCR或页面初筛时每次处理OCR_PAGE_WINDOW页
+    低内存模式下每次最多处理LOW_MEMORY_PAGE_WINDOW页，处理完一组即释放该组的版面、图片和MuPDF缓存
+    """
+    window = OCR_PAGE_WINDOW if ocr_batch > 1 or triage is not None else 1
+    if low_memory:
+        window = min(window, LOW_MEMORY_PAGE_WINDOW)
+    for indices in _page_windows(doc.page_count, window):
+        yield from process_pages(doc, indices, file_name, output_dir, images, cache, ocr_batch, font_filter, triage,
+                                 page_stats)
+        if low_memory:
+            release_memory()
+
+def code_block_json_path(output_dir, file_name):
+    return os.path.join(output_dir, os.path.splitext(file_name)[0] + "_code_block.json")
+
+def trace_json_path(output_dir, file_name):
+    return os.path.join(output_dir, os.path.splitext(file_name)[0] + "_trace.json")
+
+def code_block_archive_path(output_dir, file_name):
+    return os.path.join(output_dir, os.path.splitext(file_name)[0] + "_code_blocks.zip")
+
+def write_code_blocks(page_results, file_name, output_dir, page_count, on_event=None, low_memory=False, dedup=False,
+                      archive=False):
+    """
+    写出每个代码块文件和汇总JSON（见OutputWriter：先缓存，最后原子地写出，JSON最后出现），
+    写出后打印各代码文件的路径；block事件随页面到达即发出，其中path指向的文件在summary事件之前才写出
+    :param page_results: 按页码顺序到达的每页代码块记录列表
+    :param output_dir: 输出目录，为None时不写任何文件，只收集记录
+    :param low_memory: 为真时代码块和JSON随页面到达写入临时文件，完成后改名为正式文件；
+                       内存中只保留不含code的记录（代码在path指向的文件中）
+    :param dedup: 代码块文件按内容哈希命名，内容相同的代码块共用一个文件
+    :param archive: 所有代码块打包进一个zip文件（*_code_blocks.zip），记录中的member为包内文件名
+    :return: (JSON文件路径（不写文件时为None）, 全部代码块记录)
+    """
+    writer = None
+    json_code_block = []
+    if output_dir is not None:
+        writer = OutputWriter(output_dir, code_block_json_path(output_dir, file_name),
+                              code_block_archive_path(output_dir, file_name) if archive else None, dedup, low_memory)
+        json_code_block = writer.records
+    try:
+        for page_index, records in enumerate(page_results):
+            for record in records:
+                if writer is not None:
+                    record = writer.add(record)
+                else:
+                    json_code_block.append(record)
+                if on_event:
+                    on_event({"event": "block", **record})
+            if on_event:
+                on_event({"event": "progress", "page": page_index + 1, "pages": page_count,
+                          "blocks": len(json_code_block)})
+        if writer is None:
+            return None, json_code_block
+        # 将代码块文件和代码块信息（JSON）一并写出
+        with profiler.span("write_output", blocks=len(json_code_block)):
+            json_path = writer.commit()
+        for path in dict.fromkeys(record["path"] for record in json_code_block):
+            print(path)
+        return json_path, json_code_block
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
 # 检查pdf文件，扫描代码块和图片
-def parse_pdf(pdf_path, file_name, output_dir):
+def parse_pdf(pdf_path, file_name, output_dir, workers=1, cache_path=None, cache_size=DEFAULT_CACHE_SIZE,
+              ocr_batch=1, on_event=None, profile=False, preprocess=DEFAULT_OCR_PREPROCESS, low_memory=False,
+              memory_limit=None, font_filter=True, triage=DEFAULT_TRIAGE_THRESHOLD, dedup=False, archive=False):
     """
     :param pdf_path: 文件路径
     :param file_name: 文件名
+    :param workers: 并行处理页面的进程数，1为单进程顺序处理
+    :param cache_path: 识别结果缓存（SQLite）路径，None表示不使用缓存
+    :param cache_size: 缓存大小上限（字节），超出时按LRU淘汰
+    :param ocr_batch: 批量OCR的批大小，1为逐张识别
+    :param on_event: 进度回调，每识别出一个代码块调用一次（event为block，path指向的文件在summary事件前写出），
+                     每处理完一页调用一次（event为progress），结束时调用一次（event为summary）
+    :param profile: 为真（或设置了PDF_TEST_PROFILE环境变量）时记录各阶段耗时，
+                    在JSON旁写出Chrome trace文件（*_trace.json）
+    :param preprocess: OCR前启用的图片预处理步骤，取值见OCR_PREPROCESS_STEPS，空则直接识别灰度图
+    :param low_memory: 低内存模式：小窗口分批处理页面并在每批后释放缓存，结果边处理边写入磁盘，
+                       返回的记录不含code
+    :param memory_limit: 常驻内存上限（字节，多进程时为每个进程的上限），超出时暂停批量OCR、改为逐张识别，
+                         超限的工作进程之间串行识别，每张识别后释放缓存
+    :param font_filter: 文档用到等宽字体时，有等宽行的页面先只在这些行中识别文本代码，
+                        没有等宽行或等宽行中没有识别出代码的页面仍对整页文本识别；
+                        文档没有等宽字体时不逐页检查，直接对整页文本识别
+    :param triage: 页面初筛阈值，按符号密度、缩进和标识符特征打分，低于该值的页面跳过文本代码识别；None为不初筛
+    :param dedup: 代码块文件按内容哈希命名，内容相同的代码块共用一个文件
+    :param archive: 所有代码块打包进一个zip文件（*_code_blocks.zip），不再逐个写出代码块文件
     :return: 提取PDF中的代码块和图像中的代码
     """
-    Language_to_suffix = {'C': '.c', 'C++': '.cpp', 'Java': '.java', 'Python': '.py', 'Unknown': '.txt'}
-    json_code_block = []
-    count = 0
-    page_id = 0
-    file_path = os.path.join(pdf_path, file_name)
-    doc = fitz.open(file_path)
-    for page in doc:
-        width, height = page.rect.width, page.rect.height
-        text = page.get_text()
-        page_id += 1
-        
-        # 处理页面文本中的代码
-        iscode, origin_text_code, text_code, lang = checkcode(text)
-        if iscode:
-            count += 1
-            num = 0
-            for i in range(0,len(text_code)):
-                line = text_code[i]
-                origin_text = origin_text_code[i]
-                out_file = output_dir + "/" + file_name + '_' + "Page_" + str(page_id) + "_" + str(num) + Language_to_suffix[lang]
-                print(out_file)
-                # 应用语法修正
-                
-                with open(out_file, "w", encoding="utf-8") as f:
-                    f.write(line)
-                num += 1
-                
-                # 使用原始代码进行位置查找（因为修正后的代码可能与PDF中的不完全匹配）
-                rectan = page.search_for(origin_text)
-                rect = merge_rectangles(rectan)
-                json_code_block.append({
-                    "type": "code",
-                    "page": page_id,
-                    "position": [rect.x0 / width, rect.y0 / height, (rect.x1 - rect.x0) / width, (rect.y1 - rect.y0) / height],
-                    "path": out_file,
-                    "language": lang,
-                    "code": line  # 保存修正后的代码
-                })
-        
-        # 图像代码处理部分
-        img_num = 0
-        # 1. 提取页面中的图像
-        for img_index, img in enumerate(page.get_images(full=True)):
-            xref = img[0]
-            
-            # 提取图像数据
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            
-            # 转换为PIL图像
-            import io
-            img_pil = Image.open(io.BytesIO(image_bytes))
-            
-            # OCR识别图像中的文本
-            img_text = image_to_text(img_pil)
-            
-            # 检查提取的文本是否包含代码
-            img_iscode, origin_img_code_blocks, img_code_blocks, img_lang = checkcode(img_text)
-            
-            if img_iscode and img_code_blocks:
-                for block_idx, block in enumerate(img_code_blocks):
-                    out_img_file = f"{output_dir}/{file_name}_Page_{page_id}_img_{img_num}{Language_to_suffix[img_lang]}"
-                    print(out_img_file)
-                    # 应用语法修正
-                    
-                    # 保存代码到文件
-                    with open(out_img_file, "w", encoding="utf-8") as f:
-                        f.write(block)
-                    
-                    # 获取图像在页面中的位置
-                    img_rect = None
-                    for item in page.get_text("dict")["blocks"]:
-                        if item["type"] == 1 and "image" in item:  # 图像类型块
-                            if item["image"] == xref:
-                                img_rect = item["bbox"]
-                                break
-                    
-                    # 如果找不到位置，使用合理的默认值
-                    if not img_rect:
-                        # 尝试另一种方法获取图像位置
-                        try:
-                            img_rect = page.get_image_rects(xref)[0]
-                        except:
-                            img_rect = fitz.Rect(0, 0, width, height)
-                    
-                    # 添加到JSON输出
-                    json_code_block.append({
-                        "type": "image_code",
-                        "page": page_id,
-                        "position": [
-                            img_rect[0] / width, 
-                            img_rect[1] / height,
-                            (img_rect[2] - img_rect[0]) / width,
-                            (img_rect[3] - img_rect[1]) / height
-                        ],
-                        "path": out_img_file,
-                        "language": img_lang,
-                        "code": block
-                    })
-                
-                img_num += 1
-
-    # 将代码块信息保存到JSON文件
-    output_json_dir = output_dir + "\\" + os.path.splitext(file_name)[0] + "_code_block.json"
-    with open(output_json_dir, "w", encoding="utf-8") as f:
-        json.dump(json_code_block, f, ensure_ascii=False, indent=4)
+    summary, blocks = _parse_document(os.path.join(pdf_path, file_name), file_name, output_dir, workers, cache_path,
+                                      cache_size, ocr_batch, on_event, profile, preprocess, low_memory, memory_limit,
+                                      font_filter, triage, dedup, archive)
+    return summary["json_path"], blocks
+
+class CodeBlock:
+    """
+    识别出的一个代码块，position为相对页面宽高的[x, y, w, h]，path为写出的代码文件（不写文件时为None），
+    打包输出时path为压缩包路径，member为包内文件名
+    """
+    __slots__ = ("type", "page", "position", "path", "language", "code", "member")
+
+    def __init__(self, type, page, position, path, language, code, member=None):
+        self.type = type
+        self.page = page
+        self.position = position
+        self.path = path
+        self.language = language
+        self.code = code
+        self.member = member
+
+    @classmethod
+    def from_record(cls, record):
+        # 低内存模式下记录不含code
+        return cls(record["type"], record["page"], record["position"], record["path"], record["language"],
+                   record.get("code"), record.get("member"))
+
+    def to_dict(self):
+        """与汇总JSON中的记录格式相同"""
+        result = {name: getattr(self, name) for name in self.__slots__}
+        if self.member is None:
+            del result["member"]
+        return result
+
+    def __repr__(self):
+        return f"CodeBlock(page={self.page}, type={self.type!r}, language={self.language!r})"
+
+class RecognitionResult:
+    """
+    recognize_pdf的结果：blocks为按页码排列的CodeBlock列表，
+    json_path为写出的汇总JSON（不写文件时为None），stages为开启计时时各阶段的耗时统计
+    """
+    __slots__ = ("blocks", "pages", "elapsed", "images", "json_path", "stages")
+
+    def __init__(self, blocks, pages, elapsed, images, json_path=None, stages=None):
+        self.blocks = blocks
+        self.pages = pages
+        self.elapsed = elapsed
+        self.images = images
+        self.json_path = json_path
+        self.stages = stages
+
+    def to_dict(self):
+        return {"json_path": self.json_path, "pages": self.pages, "elapsed": self.elapsed, "images": self.images,
+                "stages": self.stages, "blocks": [block.to_dict() for block in self.blocks]}
+
+    def __repr__(self):
+        return f"RecognitionResult(pages={self.pages}, blocks={len(self.blocks)}, elapsed={self.elapsed:.2f})"
+
+def recognize_pdf(source, file_name=None, output_dir=None, **options):
+    """
+    库调用入口：识别PDF中的代码块，返回RecognitionResult
+    :param source: PDF文件路径，或PDF内容（bytes、bytearray、memoryview），内容直接在内存中打开，不经过临时文件
+    :param file_name: 文档名，用于输出文件命名；默认取路径中的文件名，source为内容时为document.pdf
+    :param output_dir: 给出时与parse_pdf一样写出每个代码块文件和汇总JSON，None时不写任何文件
+    :param options: 与parse_pdf相同的其他参数（workers、cache_path、ocr_batch、on_event、profile、preprocess等）
+    """
+    if file_name is None:
+        file_name = os.path.basename(source) if isinstance(source, str) else "document.pdf"
+    summary, blocks = _parse_document(source, file_name, output_dir, **options)
+    return RecognitionResult([CodeBlock.from_record(record) for record in blocks], summary["pages"],
+                             summary["elapsed"], summary["images"], summary["json_path"], summary.get("stages"))
+
+def _parse_document(source, file_name, output_dir, workers=1, cache_path=None, cache_size=DEFAULT_CACHE_SIZE,
+                    ocr_batch=1, on_event=None, profile=False, preprocess=DEFAULT_OCR_PREPROCESS, low_memory=False,
+                    memory_limit=None, font_filter=True, triage=DEFAULT_TRIAGE_THRESHOLD, dedup=False, archive=False):
+    """parse_pdf和recognize_pdf的共同实现，返回(summary事件, 全部代码块记录)"""
+    start = time.time()
+    profiled = profiler.enabled
+    profiler.enable(profile or profiled)
+    try:
+        return _parse_pdf(source, file_name, output_dir, workers, cache_path, cache_size, ocr_batch, on_event, start,
+                          preprocess, low_memory, memory_limit, font_filter, triage, dedup, archive)
+    finally:
+        profiler.enable(profiled)
+
+def _parse_pdf(source, file_name, output_dir, workers, cache_path, cache_size, ocr_batch, on_event, start,
+               preprocess, low_memory, memory_limit, font_filter, triage, dedup, archive):
+    profiler_start = time.perf_counter()
+    cache = None
+    image_stats = {}
+    page_stats = new_page_stats()
+    doc = open_document(source)
+    page_count = doc.page_count
+    if font_filter:
+        with profiler.span("font_scan"):
+            font_filter = document_uses_monospace(doc)
+        if not font_filter:
+            print("文档中没有等宽字体，对整页文本识别代码")
+    if workers > 1:
+        doc.close()
+        page_results = _iter_pages_parallel(source, file_name, output_dir, workers, cache_path, cache_size,
+                                            ocr_batch, image_stats, preprocess, low_memory, memory_limit, font_filter,
+                                            triage, page_stats)
+    else:
+        cache = open_cache(cache_path, cache_size)
+        images = ImageOCRFilter(doc, preprocess, MemoryGuard(memory_limit) if memory_limit is not None else None)
+        image_stats[os.getpid()] = images.stats
+        page_results = _iter_pages_sequential(doc, file_name, output_dir, images, cache, ocr_batch, low_memory,
+                                              font_filter, triage, page_stats)
+
+    output_json_dir, json_code_block = write_code_blocks(page_results, file_name, output_dir, page_count, on_event,
+                                                         low_memory, dedup, archive)
+    if workers <= 1:
+        doc.close()
+    if cache is not None:
+        print(f"识别缓存: 命中 {cache.hits} 页, 重新识别 {cache.misses} 页")
+        cache.close()
+    if triage is not None:
+        print(f"页面初筛: 跳过 {page_stats['triage_skipped']} 页的文本代码识别")
+    images_total = sum_image_stats(image_stats.values())
+    print(f"图片 {images_total['images']} 张, 实际OCR {images_total['ocr_calls']} 次, "
+          f"省去 {images_total['images'] - images_total['ocr_calls']} 次: {images_total}")
+    summary = {"event": "summary", "json_path": output_json_dir, "pages": page_count,
+               "blocks": len(json_code_block), "elapsed": time.time() - start, "images": images_total,
+               "font_filter": font_filter, "triage": triage, "triage_skipped": page_stats["triage_skipped"]}
+    if profiler.enabled:
+        profiler.record("parse_pdf", profiler_start, time.perf_counter(), {"file": file_name, "pages": page_count})
+        summary["stages"] = profiler.summary()
+        if output_dir is None:
+            profiler.drain()
+        else:
+            summary["trace_path"] = trace_json_path(output_dir, file_name)
+            profiler.write(summary["trace_path"])
+            print(f"各阶段耗时已写入 {summary['trace_path']}")
+    if on_event:
+        on_event(summary)
+    return summary, json_code_block
+
+# Office Open XML文档中段落、文本、制表符和换行对应的标签（不含命名空间）
+OOXML_PARAGRAPH = "p"
+OOXML_TEXT = "t"
+OOXML_TAB = "tab"
+OOXML_BREAK = ("br", "cr")
+
+def _ooxml_text(xml_bytes):
+    """把一个Office XML部件中的段落拼成文本，每个段落一行"""
+    import xml.etree.ElementTree as ET
+    lines = []
+    for paragraph in ET.fromstring(xml_bytes).iter():
+        if paragraph.tag.rsplit("}", 1)[-1] != OOXML_PARAGRAPH:
+            continue
+        parts = []
+        for node in paragraph.iter():
+            tag = node.tag.rsplit("}", 1)[-1]
+            if tag == OOXML_TEXT:
+                parts.append(node.text or "")
+            elif tag == OOXML_TAB:
+                parts.append("\t")
+            elif tag in OOXML_BREAK:
+                parts.append("\n")
+        lines.append("".join(parts) + "\n")
+    return "".join(lines)
+
+def office_pages(file_path):
+    """
+    从.docx/.pptx中按页提取文本，pptx每张幻灯片为一页，docx没有固定分页，整个正文作为一页
+    只提取文字，文档中嵌入的图片不做OCR
+    """
+    import zipfile
+    with zipfile.ZipFile(file_path) as archive:
+        if file_path.lower().endswith(".pptx"):
+            slide_name = re.compile(r"ppt/slides/slide(\d+)\.xml$")
+            slides = sorted((int(m.group(1)), name) for name in archive.namelist()
+                            for m in [slide_name.match(name)] if m)
+            return [_ooxml_text(archive.read(name)) for _, name in slides]
+        return [_ooxml_text(archive.read("word/document.xml"))]
+
+def parse_office(doc_path, file_name, output_dir, on_event=None):
+    """
+    识别.docx/.pptx中的文本代码，输出格式与parse_pdf相同，代码块位置为整页
+    :return: (JSON文件路径, 全部代码块记录)
+    """
+    start = time.time()
+    pages = office_pages(os.path.join(doc_path, file_name))
+    page_results = (output_records(recognize_text(text, lambda indices: [0, 0, 1, 1]), page_id, file_name, output_dir)
+                    for page_id, text in enumerate(pages, 1))
+    output_json_dir, json_code_block = write_code_blocks(page_results, file_name, output_dir, len(pages), on_event)
+    if on_event:
+        on_event({"event": "summary", "json_path": output_json_dir, "pages": len(pages),
+                  "blocks": len(json_code_block), "elapsed": time.time() - start})
+    return output_json_dir, json_code_block
+
+# 批量模式支持的文件类型及对应的解析函数
+BATCH_SUFFIXES = (".pdf", ".docx", ".pptx")
+MANIFEST_NAME = "batch_manifest.json"
+
+def collect_batch_files(target):
+    """目录（递归查找）或glob模式下所有支持的文件，按路径排序"""
+    import glob
+    if os.path.isdir(target):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(target) for name in names]
+    else:
+        paths = glob.glob(target, recursive=True)
+    return sorted(path for path in paths if path.lower().endswith(BATCH_SUFFIXES) and os.path.isfile(path))
+
+def batch_root(target):
+    """批量模式的根目录：目录本身，或glob模式中第一个通配符之前的部分"""
+    import glob
+    if os.path.isdir(target):
+        return target
+    parts = []
+    for part in os.path.normpath(target).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or "."
+
+def batch_output_dirs(sources, root, output_dir):
+    """
+    每个文件的输出目录：在output_dir下按源文件相对root的子目录存放，不同子目录中的同名文件互不覆盖
+    同一目录中文件名（不含扩展名）相同的文件（如Lecture.pdf和Lecture.pptx）再各自放进以完整文件名命名的子目录
+    :return: {源文件路径: 输出目录}
+    """
+    from collections import Counter
+    def stem_key(source):
+        return os.path.dirname(source), os.path.splitext(os.path.basename(source))[0].lower()
+    stems = Counter(stem_key(source) for source in sources)
+    result = {}
+    for source in sources:
+        directory = os.path.normpath(os.path.join(output_dir, os.path.relpath(os.path.dirname(source), root)))
+        if stems[stem_key(source)] > 1:
+            directory = os.path.join(directory, os.path.basename(source))
+        result[source] = directory
+    return result
+
+def load_manifest(output_dir):
+    """上次批量识别的清单，按源文件的绝对路径索引；没有清单时为空"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            entries = json.load(f).get("entries", [])
+    except (OSError, ValueError):
+        return {}
+    return {os.path.abspath(entry["source"]): entry for entry in entries if "source" in entry}
+
+def is_up_to_date(source, json_path, previous):
+    """
+    上次清单中该源文件已完成（或跳过）、输出的JSON就是json_path，且JSON存在并不早于源文件时，认为无需重新识别
+    :param previous: 上次清单中该源文件的记录，没有时为None
+    """
+    if previous is None or previous.get("status") not in ("done", "skipped"):
+        return False
+    if previous.get("json_path") is None or os.path.abspath(previous["json_path"]) != os.path.abspath(json_path):
+        return False
+    return os.path.exists(json_path) and os.path.getmtime(json_path) >= os.path.getmtime(source)
+
+def run_batch_job(source, output_dir, options):
+    """识别单个文件，返回清单中的一条记录；异常记为failed，不影响其他文件"""
+    start = time.time()
+    doc_path, file_name = os.path.split(source)
+    entry = {"source": source, "size": os.path.getsize(source)}
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        summary = {}
+        if source.lower().endswith(".pdf"):
+            json_path, blocks = parse_pdf(doc_path, file_name, output_dir, on_event=summary.update, **options)
+        else:
+            json_path, blocks = parse_office(doc_path, file_name, output_dir, on_event=summary.update)
+        entry.update(status="done", json_path=json_path, pages=summary.get("pages"), blocks=len(blocks))
+    except Exception as e:
+        entry.update(status="failed", error=f"{type(e).__name__}: {e}")
+    entry["elapsed"] = time.time() - start
+    return entry
+
+def run_batch(target, output_dir, jobs=1, force=False, memory_budget=None, **options):
+    """
+    批量识别目录或glob模式匹配到的所有文件，并在输出目录写出清单
+    输出按源文件相对目录（或glob模式中通配符之前部分）的子目录存放，见batch_output_dirs
+    :param jobs: 同时处理的文件数，大于1时使用进程池，每个进程的OCR模型在多个文件间复用
+    :param force: 为真时忽略已有输出，全部重新识别
+    :param memory_budget: 同时处理的文件总大小上限（字节），用于限制内存占用；单个超限文件仍会独占处理
+    :param options: 传给parse_pdf的其他参数（cache_path、cache_size、ocr_batch、workers、profile、preprocess、
+                    low_memory、memory_limit、font_filter、triage、dedup、archive）
+    :return: 清单内容
+    """
+    from collections import deque
+    start = time.time()
+    entries = []
+    todo = []
+    sources = collect_batch_files(target)
+    output_dirs = batch_output_dirs(sources, batch_root(target), output_dir)
+    previous = load_manifest(output_dir)
+    for source in sources:
+        json_path = code_block_json_path(output_dirs[source], os.path.basename(source))
+        if not force and is_up_to_date(source, json_path, previous.get(os.path.abspath(source))):
+            entries.append({"source": source, "size": os.path.getsize(source), "status": "skipped",
+                            "json_path": json_path})
+        else:
+            todo.append(source)
+    # 大文件先开始，避免最后只剩一个大文件在跑而其他进程空闲
+    queue = deque(sorted(todo, key=os.path.getsize, reverse=True))
+
+    if jobs <= 1:
+        while queue:
+            source = queue.popleft()
+            entries.append(run_batch_job(source, output_dirs[source], options))
+    else:
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        import multiprocessing
+        # 文件级并行时每个文件内部不再开进程池
+        options = dict(options, workers=1)
+        running = {}
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+            while queue or running:
+                # 按大小顺序提交，正在处理的文件总大小不超过预算（没有正在处理的文件时总是提交）
+                while queue and len(running) < jobs and (
+                        not running or memory_budget is None
+                        or sum(running.values()) + os.path.getsize(queue[0]) <= memory_budget):
+                    source = queue.popleft()
+                    running[executor.submit(run_batch_job, source, output_dirs[source], options)] = \
+                        os.path.getsize(source)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    entries.append(future.result())
+
+    entries.sort(key=lambda entry: entry["source"])
+    counts = {status: sum(entry["status"] == status for entry in entries) for status in ("done", "skipped", "failed")}
+    manifest = {
+        "target": target,
+        "output_dir": output_dir,
+        "jobs": jobs,
+        "elapsed": time.time() - start,
+        "files": len(entries),
+        **counts,
+        "blocks": sum(entry.get("blocks", 0) for entry in entries),
+        "entries": entries,
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    print(f"批量识别: 共 {manifest['files']} 个文件, 完成 {counts['done']}, 跳过 {counts['skipped']}, "
+          f"失败 {counts['failed']}, 用时 {manifest['elapsed']:.1f}s")
+    return manifest
+
+def parse_preprocess_steps(text):
+    """解析逗号分隔的预处理步骤，none或空表示不预处理，含未知步骤时返回None"""
+    steps = tuple(step.strip() for step in text.split(",") if step.strip() and step.strip() != "none")
+    if any(step not in OCR_PREPROCESS_STEPS for step in steps):
+        return None
+    return steps
+
+def ndjson_writer(stream):
+    """返回把事件逐行写为JSON并立即刷新的回调，可作为parse_pdf的on_event"""
+    def write(event):
+        stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+        stream.flush()
+    return write
+
+def warm_up():
+    """
+    预加载识别所需的模型和规则：EasyOCR模型、PyMuPDF、text_to_code中的正则
+    常驻服务启动时调用一次，之后的请求不再承担初始化开销
+    """
+    get_reader()
+    # 用一段小代码跑一遍checkcode，让所有特征正则进入编译缓存
+    checkcode("#include <stdio.h>\nint main() {\n    printf(\"hi\");\n    return 0;\n}")
+    fitz.open().close()
+
+class RecognitionServer:
+    """
+    常驻识别服务：通过stdin/stdout按行收发JSON请求，模型只加载一次
+    请求: {"id": 1, "method": "parse_pdf", "params": {"pdf": "a.pdf", "output_dir": "out"}}
+    响应: {"id": 1, "result": {...}} 或 {"id": 1, "error": {"message": "..."}}
+    事件: parse_pdf请求带"stream": true时，响应前会先发出{"id": 1, "event": "block"/"progress"/"summary", ...}
+          block事件中path指向的文件在summary事件之前才写出
+    支持的方法: health, parse_pdf, shutdown
+    """
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin or sys.stdin
+        self.stdout = stdout or sys.stdout
+        self.started_at = time.time()
+        self.busy = False
+        self.stopping = False
+        self.served = 0
+        self.current_id = None
+
+    def send(self, message):
+        self.stdout.write(json.dumps(message, ensure_ascii=False) + "\n")
+        self.stdout.flush()
+
+    def health(self, params):
+        # 预热完成、发出ready事件后才开始读取请求，能应答时服务必然已就绪
+        return {
+            "status": "ready",
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started_at,
+            "served": self.served,
+            "ocr_loaded": reader is not None,
+        }
+
+    def parse_pdf(self, params):
+        full_path = params["pdf"]
+        output_dir = params.get("output_dir", ".")
+        pdf_path, file_name = os.path.split(full_path)
+        start = time.time()
+        # 预处理步骤与命令行--ocr-preprocess相同，为逗号分隔的字符串，也接受步骤列表
+        preprocess = params.get("preprocess", DEFAULT_OCR_PREPROCESS)
+        if not isinstance(preprocess, str):
+            preprocess = ",".join(preprocess)
+        steps = parse_preprocess_steps(preprocess)
+        if steps is None:
+            raise ValueError(f"未知的预处理步骤: {preprocess}")
+        cache_path = os.path.join(output_dir, CACHE_FILE_NAME) if params.get("cache", True) else None
+        # stream为真时，在最终响应之前把代码块和进度作为带请求id的事件逐条发出
+        request_id = self.current_id
+        on_event = (lambda event: self.send({"id": request_id, **event})) if params.get("stream") else None
+        json_path, blocks = parse_pdf(pdf_path, file_name, output_dir, workers=params.get("workers", 1),
+                                      cache_path=cache_path, ocr_batch=params.get("ocr_batch", 1),
+                                      on_event=on_event, profile=params.get("profile", False),
+                                      preprocess=steps,
+                                      low_memory=params.get("low_memory", False),
+                                      memory_limit=params.get("memory_limit"),
+                                      font_filter=params.get("font_filter", True),
+                                      triage=params.get("triage", DEFAULT_TRIAGE_THRESHOLD),
+                                      dedup=params.get("dedup", False), archive=params.get("archive", False))
+        return {"json_path": json_path, "blocks": len(blocks), "elapsed": time.time() - start}
+
+    def shutdown(self, params):
+        self.stopping = True
+        return {"status": "stopping"}
+
+    def handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            self.send({"id": None, "error": {"message": f"无效的JSON请求: {e}"}})
+            return
+        request_id = self.current_id = request.get("id")
+        handler = {"health": self.health, "parse_pdf": self.parse_pdf, "shutdown": self.shutdown}.get(request.get("method"))
+        if handler is None:
+            self.send({"id": request_id, "error": {"message": f"未知方法: {request.get('method')}"}})
+            return
+        self.busy = True
+        try:
+            # 处理过程中的print输出全部转到stderr，保证stdout只有协议消息
+            with contextlib.redirect_stdout(sys.stderr):
+                result = handler(request.get("params") or {})
+            self.served += 1
+            self.send({"id": request_id, "result": result})
+        except Exception as e:
+            self.send({"id": request_id, "error": {"message": str(e), "type": type(e).__name__}})
+        finally:
+            self.busy = False
+
+    def _on_signal(self, signum, frame):
+        # 正在处理请求时等当前请求完成再退出，否则立即退出
+        self.stopping = True
+        if not self.busy:
+            raise SystemExit(0)
+
+    def serve_forever(self):
+        signal.signal(signal.SIGTERM, self._on_signal)
+        with contextlib.redirect_stdout(sys.stderr):
+            warm_up()
+        self.send({"event": "ready", "pid": os.getpid()})
+        try:
+            for line in iter(self.stdin.readline, ""):
+                if line.strip():
+                    self.handle(line)
+                if self.stopping:
+                    break
+        except (SystemExit, KeyboardInterrupt):
+            pass
+        self.send({"event": "stopped", "served": self.served})
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("用法错误：请提供PDF文件路径，及可选的输出目录。\n示例：python pdf_test.py ./Lab05.pdf ./output/")
+    parser = argparse.ArgumentParser(description="扫描PDF中的代码块和图片中的代码",
+                                     epilog="示例：python pdf_test.py ./Lab05.pdf ./output/")
+    parser.add_argument("pdf", nargs="?", help="PDF文件路径；批量模式下为目录或glob模式")
+    parser.add_argument("output_dir", nargs="?", default=".", help="输出目录，默认为当前目录")
+    parser.add_argument("--serve", action="store_true", help="以常驻服务模式运行，通过stdin/stdout收发JSON请求")
+    parser.add_argument("--batch", action="store_true",
+                        help="批量模式：识别目录（递归）或glob模式匹配的所有PDF/DOCX/PPTX，并写出清单")
+    parser.add_argument("--jobs", type=int, default=1, help="批量模式下同时处理的文件数，默认为1")
+    parser.add_argument("--force", action="store_true", help="批量模式下忽略已是最新的输出，全部重新识别")
+    parser.add_argument("--batch-memory", type=int,
+                        help="批量模式下同时处理的文件总大小上限（MB），默认不限制")
+    parser.add_argument("--workers", type=int, default=1, help="并行处理页面的进程数，默认为1（单进程）")
+    parser.add_argument("--ocr-batch", type=int, default=1,
+                        help=f"批量OCR的批大小，大于1时每{OCR_PAGE_WINDOW}页的图片合并分批识别，默认为1（逐张识别）")
+    parser.add_argument("--ocr-preprocess", default=",".join(DEFAULT_OCR_PREPROCESS), metavar="STEPS",
+                        help=f"OCR前的图片预处理步骤，逗号分隔，可选{'/'.join(OCR_PREPROCESS_STEPS)}，"
+                             f"none表示不预处理，默认{','.join(DEFAULT_OCR_PREPROCESS)}")
+    parser.add_argument("--low-memory", action="store_true",
+                        help=f"低内存模式：每{LOW_MEMORY_PAGE_WINDOW}页释放一次缓存，结果边处理边写入磁盘，适合很大的扫描版PDF")
+    parser.add_argument("--memory-limit", type=int,
+                        help="常驻内存上限（MB，多进程时为每个进程），超出时暂停批量OCR、改为逐张识别，"
+                             "多进程间串行识别并在每张识别后释放缓存，默认不限制")
+    parser.add_argument("--no-font-filter", action="store_true",
+                        help="不按等宽字体筛选代码行，总是对整页文本识别代码")
+    parser.add_argument("--triage-threshold", type=float, default=DEFAULT_TRIAGE_THRESHOLD,
+                        help=f"页面初筛阈值，文本特征得分低于该值的页面跳过文本代码识别，默认{DEFAULT_TRIAGE_THRESHOLD}")
+    parser.add_argument("--no-triage", action="store_true", help="不做页面初筛，所有页面都识别文本代码")
+    parser.add_argument("--dedup", action="store_true",
+                        help="代码块文件按内容哈希命名，内容相同的代码块（包括其他文档中的）共用一个文件")
+    parser.add_argument("--archive", action="store_true",
+                        help="每个文档的代码块打包进一个zip文件（<文档名>_code_blocks.zip），不再逐个写出代码块文件")
+    parser.add_argument("--stream", metavar="PATH",
+                        help="以NDJSON格式逐条输出代码块、每页进度和最终汇总，PATH为-时输出到stdout")
+    parser.add_argument("--profile", action="store_true",
+                        help="记录各阶段耗时和调用次数，在输出目录写出Chrome trace文件（也可设置PDF_TEST_PROFILE=1）")
+    parser.add_argument("--cache", help=f"识别结果缓存路径，默认为输出目录下的{CACHE_FILE_NAME}")
+    parser.add_argument("--no-cache", action="store_true", help="不使用识别结果缓存，所有页面重新识别")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help="识别结果缓存大小上限（MB），默认64")
+    args = parser.parse_args()
+
+    if args.serve:
+        RecognitionServer().serve_forever()
+        sys.exit(0)
+
+    if not args.pdf:
+        print("用法错误：请提供PDF文件路径，及可选的输出目录。\n示例：python pdf_test.py ./Lab05.pdf ./output/\n"
+              "批量模式：python pdf_test.py --batch ./slides/ ./output/ --jobs 2")
         sys.exit(1)
 
-    full_path = sys.argv[1]
-    pdf_path, file_name = os.path.split(full_path)
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else "."
+    cache_path = None if args.no_cache else (args.cache or os.path.join(args.output_dir, CACHE_FILE_NAME))
+    preprocess = parse_preprocess_steps(args.ocr_preprocess)
+    if preprocess is None:
+        parser.error(f"未知的预处理步骤: {args.ocr_preprocess}")
+    memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit else None
+    triage = None if args.no_triage else args.triage_threshold
+    if args.batch:
+        os.makedirs(args.output_dir, exist_ok=True)
+        run_batch(args.pdf, args.output_dir, jobs=args.jobs, force=args.force,
+                  memory_budget=args.batch_memory * 1024 * 1024 if args.batch_memory else None,
+                  workers=args.workers, cache_path=cache_path, cache_size=args.cache_size * 1024 * 1024,
+                  ocr_batch=args.ocr_batch, profile=args.profile, preprocess=preprocess, low_memory=args.low_memory,
+                  memory_limit=memory_limit, font_filter=not args.no_font_filter, triage=triage, dedup=args.dedup,
+                  archive=args.archive)
+        sys.exit(0)
 
-    parse_pdf(pdf_path, file_name, output_dir)
\ No newline at end of file
+    pdf_path, file_name = os.path.split(args.pdf)
+    with contextlib.ExitStack() as stack:
+        on_event = None
+        if args.stream == "-":
+            # stdout只保留NDJSON，其余输出转到stderr
+            on_event = ndjson_writer(sys.stdout)
+            stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        elif args.stream:
+            on_event = ndjson_writer(stack.enter_context(open(args.stream, "w", encoding="utf-8")))
+        parse_pdf(pdf_path, file_name, args.output_dir, workers=args.workers,
+                  cache_path=cache_path, cache_size=args.cache_size * 1024 * 1024, ocr_batch=args.ocr_batch,
+                  on_event=on_event, profile=args.profile, preprocess=preprocess, low_memory=args.low_memory,
+                  memory_limit=memory_limit, font_filter=not args.no_font_filter, triage=triage, dedup=args.dedup,
+                  archive=args.archive)
\ No newline at end of file
@@ -2,7 +2,8 @@
  * Python 环境管理工具
  * 用于激活和使用指定的 Conda 环境
  */
-import { execSync } from 'child_process';
+import { execSync, spawn, ChildProcess } from 'child_process';
+import * as readline from 'readline';
 
 export class CondaEnv {
     private condaPath: string;
@@ -74,6 +75,257 @@ export class CondaEnv {
     }
 }
 
+// 识别服务启动时要加载 OCR 模型；识别大文件时每页都会发出进度事件，超时按两次事件的间隔计算
+const RECOGNITION_READY_TIMEOUT = 3 * 60 * 1000;
+const RECOGNITION_IDLE_TIMEOUT = 10 * 60 * 1000;
+// 运行服务只检测编译器；单次运行包括编译（code_runner.py 中最长 60s）和运行（最长 10s）
+const RUNNER_READY_TIMEOUT = 60 * 1000;
+const RUNNER_REQUEST_TIMEOUT = 2 * 60 * 1000;
+
+/**
+ * 服务进程不可用：启动失败、进程退出、启动或请求超时、输入管道出错
+ * 与服务返回的 error 响应（例如文件不存在）区分，调用方只在这种情况下改用其他方式执行
+ */
+export class DaemonUnavailableError extends Error {
+    constructor(message: string) {
+        super(message);
+        this.name = 'DaemonUnavailableError';
+    }
+}
+
+/**
+ * 按行收发 JSON 请求的常驻 Python 服务进程（pdf_test.py --serve、code_runner.py --serve）
+ * 服务启动完成后先发出 {"event": "ready"}，之后每个请求对应一条带相同 id 的响应
+ * 启动超时、请求超时或输入管道出错时结束进程并拒绝所有未完成的请求，下次请求时重新启动
+ */
+class JsonLineDaemon {
+    private command: string;
+    private args: string[];
+    private label: string;
+    private readyTimeout: number;
+    private requestTimeout: number;
+    private proc: ChildProcess | null = null;
+    private nextId = 1;
+    private pending = new Map<number, {
+        resolve: (value: any) => void;
+        reject: (reason: Error) => void;
+        onEvent?: (event: any) => void;
+        timeout: number;
+        timer?: NodeJS.Timeout;
+    }>();
+    private readyPromise: Promise<void> | null = null;
+    private rejectReady: ((reason: Error) => void) | null = null;
+
+    /**
+     * @param command 启动服务的可执行文件
+     * @param args 启动参数
+     * @param label 日志和错误信息中的服务名称
+     * @param readyTimeout 等待服务启动完成的时间（毫秒）
+     * @param requestTimeout 请求的默认超时（毫秒），收到该请求的流式事件时重新计时
+     */
+    constructor(command: string, args: string[], label: string, readyTimeout: number, requestTimeout: number) {
+        this.command = command;
+        this.args = args;
+        this.label = label;
+        this.readyTimeout = readyTimeout;
+        this.requestTimeout = requestTimeout;
+    }
+
+    /**
+     * 启动服务进程（如未启动），并等待其加载完成
+     */
+    start(): Promise<void> {
+        if (this.readyPromise) {
+            return this.readyPromise;
+        }
+        this.readyPromise = new Promise<void>((resolve, reject) => {
+            this.rejectReady = reject;
+            const proc = spawn(this.command, this.args);
+            this.proc = proc;
+            const readyTimer = setTimeout(() => {
+                this.fail(proc, new DaemonUnavailableError(`${this.label}服务启动超时 (${this.readyTimeout / 1000}s)`));
+            }, this.readyTimeout);
+
+            const rl = readline.createInterface({ input: proc.stdout! });
+            rl.on('line', (line) => {
+                let message: any;
+                try {
+                    message = JSON.parse(line);
+                } catch {
+                    // 非协议输出（例如 conda 自身的提示）直接忽略
+                    return;
+                }
+                if (message.event === 'ready') {
+                    clearTimeout(readyTimer);
+                    this.rejectReady = null;
+                    resolve();
+                    return;
+                }
+                const request = this.pending.get(message.id);
+                if (!request) {
+                    return;
+                }
+                if (message.event) {
+                    // 请求完成前的流式事件（代码块、进度、汇总），说明服务仍在工作，重新计时
+                    this.armTimer(proc, message.id);
+                    request.onEvent?.(message);
+                    return;
+                }
+                clearTimeout(request.timer);
+                this.pending.delete(message.id);
+                if (message.error) {
+                    request.reject(new Error(message.error.message));
+                } else {
+                    request.resolve(message.result);
+                }
+            });
+            proc.stderr?.on('data', (data) => console.log(`[${this.label}] ${data}`));
+            // 进程已退出时写入会触发 EPIPE，不处理会成为未捕获的异常
+            proc.stdin?.on('error', (error) => {
+                this.fail(proc, new DaemonUnavailableError(`${this.label}服务的输入管道出错: ${error.message}`));
+            });
+            proc.on('error', (error) => {
+                clearTimeout(readyTimer);
+                this.fail(proc, new DaemonUnavailableError(`${this.label}服务无法启动: ${error.message}`));
+            });
+            proc.on('exit', (code) => {
+                clearTimeout(readyTimer);
+                this.fail(proc, new DaemonUnavailableError(`${this.label}服务已退出 (code ${code})`));
+            });
+        });
+        return this.readyPromise;
+    }
+
+    /**
+     * 服务进程不可用：拒绝启动等待和所有未完成的请求，结束进程，下次请求时重新启动
+     */
+    private fail(proc: ChildProcess, reason: DaemonUnavailableError): void {
+        if (this.proc !== proc) {
+            // 该进程已经处理过（例如超时后结束进程又触发了 exit）
+            return;
+        }
+        this.proc = null;
+        this.readyPromise = null;
+        this.rejectReady?.(reason);
+        this.rejectReady = null;
+        for (const request of this.pending.values()) {
+            clearTimeout(request.timer);
+            request.reject(reason);
+        }
+        this.pending.clear();
+        proc.kill();
+    }
+
+    /**
+     * 为请求重新开始计时，超时时视为服务卡住
+     */
+    private armTimer(proc: ChildProcess, id: number): void {
+        const request = this.pending.get(id);
+        if (!request) {
+            return;
+        }
+        clearTimeout(request.timer);
+        request.timer = setTimeout(() => {
+            this.fail(proc, new DaemonUnavailableError(`${this.label}服务请求超时 (${request.timeout / 1000}s 内没有响应)`));
+        }, request.timeout);
+    }
+
+    /**
+     * 向服务发送请求
+     * @param method 方法名
+     * @param params 方法参数
+     * @param onEvent 接收该请求流式事件的回调（可选）
+     * @param timeout 超时（毫秒），默认为构造时给出的请求超时
+     */
+    async request(method: string, params: object = {}, onEvent?: (event: any) => void,
+        timeout: number = this.requestTimeout): Promise<any> {
+        await this.start();
+        const proc = this.proc!;
+        const id = this.nextId++;
+        return new Promise((resolve, reject) => {
+            this.pending.set(id, { resolve, reject, onEvent, timeout });
+            this.armTimer(proc, id);
+            proc.stdin!.write(JSON.stringify({ id, method, params }) + '\n');
+        });
+    }
+
+    /**
+     * 请求服务在处理完当前任务后退出
+     */
+    stop(): void {
+        if (this.proc) {
+            this.proc.stdin?.write(JSON.stringify({ id: this.nextId++, method: 'shutdown' }) + '\n');
+            this.proc.stdin?.end();
+        }
+    }
+}
+
+/**
+ * 常驻的代码识别服务（pdf_test.py --serve）
+ * 模型只在启动时加载一次，之后通过 stdin/stdout 按行收发 JSON 请求
+ */
+export class RecognitionDaemon extends JsonLineDaemon {
+    /**
+     * @param scriptPath pdf_test.py 的路径
+     * @param condaPath Conda 可执行文件路径
+     * @param envName 环境名称
+     */
+    constructor(scriptPath: string, condaPath: string = 'conda', envName: string = 'dailywork') {
+        // --no-capture-output 让 conda 直接透传 stdin/stdout，-u 关闭 Python 输出缓冲
+        super(condaPath, [
+            'run', '--no-capture-output', '-n', envName,
+            'python', '-u', scriptPath, '--serve'
+        ], '代码识别', RECOGNITION_READY_TIMEOUT, RECOGNITION_IDLE_TIMEOUT);
+    }
+
+    /**
+     * 识别 PDF 中的代码块，返回生成的 JSON 文件路径和代码块数量
+     * @param onEvent 传入时以流式模式运行，每识别出一个代码块（block）、处理完一页（progress）都会回调
+     */
+    parsePdf(pdfPath: string, outputDir: string, onEvent?: (event: any) => void): Promise<{ json_path: string; blocks: number; elapsed: number }> {
+        return this.request('parse_pdf', { pdf: pdfPath, output_dir: outputDir, stream: !!onEvent }, onEvent);
+    }
+}
+
+/**
+ * 代码块的运行结果，status 为 ok / unavailable / compile_error / runtime_error / timeout
+ */
+export interface RunCodeResult {
+    language: string;
+    status: string;
+    exit_code: number | null;
+    stdout: string;
+    stderr: string;
+    truncated: boolean;
+    cached: boolean;
+    compile_time: number;
+    run_time: number;
+}
+
+/**
+ * 常驻的代码运行服务（code_runner.py --serve）
+ * 编译器只在启动时检测一次，编译结果按代码内容缓存，同一代码块再次运行时不再编译
+ */
+export class CodeRunnerDaemon extends JsonLineDaemon {
+    /**
+     * @param scriptPath code_runner.py 的路径
+     * @param cacheDir 编译结果缓存目录
+     * @param pythonPath 运行服务的 Python，默认为 PATH 中的 python（只依赖标准库）
+     */
+    constructor(scriptPath: string, cacheDir: string, pythonPath: string = 'python') {
+        super(pythonPath, ['-u', scriptPath, '--serve', '--cache-dir', cacheDir], '代码运行',
+            RUNNER_READY_TIMEOUT, RUNNER_REQUEST_TIMEOUT);
+    }
+
+    /**
+     * 运行一段代码
+     * @param env 运行 Python 代码的 conda 环境，不传时使用服务自身的 Python
+     */
+    runCode(code: string, language: string, env?: string): Promise<RunCodeResult> {
+        return this.request('run_code', { code, language, env });
+    }
+}
+
 // 创建默认的 dailywork 环境实例
 export const defaultEnv = new CondaEnv('conda', 'dailywork');
 
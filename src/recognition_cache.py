@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import time
+
+class RecognitionCache:
+    """
+    基于SQLite的识别结果缓存
+    键为内容哈希（由调用方计算），值为可JSON序列化的识别结果
+    总大小超过上限时按最近使用时间（LRU）淘汰
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        """
+        :param path: SQLite数据库文件路径，不存在时自动创建
+        :param max_bytes: 缓存内容总大小上限（字节）
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 多进程模式下每个进程各自连接，timeout用于等待其他进程的写锁
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+        self.hits = 0
+        self.misses = 0
+        # 记录当前总大小，避免每次写入都全表求和（其他进程的写入在淘汰时重新统计）
+        self.total_bytes = self._sum_sizes()
+
+    def get(self, key):
+        """查询缓存，命中时刷新最近使用时间并返回结果，未命中返回None"""
+        row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def contains(self, key):
+        """判断键是否存在，不影响命中统计和使用时间"""
+        return self.conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, value):
+        """写入缓存，必要时淘汰最久未使用的条目"""
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        self.total_bytes += size
+        self.conn.execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+            (key, data, size, time.time()),
+        )
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+    def _sum_sizes(self):
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _evict(self):
+        total = self._sum_sizes()
+        # 从最久未使用的条目开始删除，直到总大小回到上限以内
+        stale = []
+        for key, size in self.conn.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self.conn.executemany("DELETE FROM entries WHERE key = ?", stale)
+        self.total_bytes = total
+
+    def close(self):
+        self.conn.close()
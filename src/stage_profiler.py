@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import time
+
+# 设置该环境变量（非空且不为0）时默认开启记录
+PROFILE_ENV = "PDF_TEST_PROFILE"
+
+class _NullSpan:
+    """未开启记录时span()返回的空上下文，不做任何计时"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ("profiler", "name", "args", "start")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+class StageProfiler:
+    """
+    分阶段计时：with profiler.span("ocr", page=3): ...
+    开启后每个span记录为一条Chrome trace的完整事件（ph为X），并累计各阶段的调用次数和总耗时
+    未开启时span()直接返回共享的空上下文，开销只有一次属性判断
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self.counts = {}
+        self.totals = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start, end, args=None):
+        self.events.append({
+            "name": name,
+            "ph": "X",
+            # perf_counter是系统级单调时钟，各工作进程的时间戳可以直接对齐，单位微秒
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args or {},
+        })
+        self.counts[name] = self.counts.get(name, 0) + 1
+        self.totals[name] = self.totals.get(name, 0.0) + (end - start)
+
+    def drain(self):
+        """取出已记录的事件和统计并清空，供工作进程把结果交回主进程"""
+        result = (self.events, self.counts, self.totals)
+        self.events, self.counts, self.totals = [], {}, {}
+        return result
+
+    def merge(self, events, counts, totals):
+        """合并其他进程drain()得到的结果"""
+        self.events.extend(events)
+        for name, count in counts.items():
+            self.counts[name] = self.counts.get(name, 0) + count
+            self.totals[name] = self.totals.get(name, 0.0) + totals[name]
+
+    def summary(self):
+        """各阶段的调用次数和总耗时（秒），按总耗时从大到小排列"""
+        return {name: {"calls": self.counts[name], "seconds": self.totals[name]}
+                for name in sorted(self.totals, key=self.totals.get, reverse=True)}
+
+    def write(self, path):
+        """写出Chrome trace JSON（可在chrome://tracing或Perfetto中打开），并清空已记录的内容"""
+        trace = {"traceEvents": self.events, "displayTimeUnit": "ms", "otherData": {"stages": self.summary()}}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, ensure_ascii=False)
+        self.drain()
+
+# 进程内共享的实例
+profiler = StageProfiler(os.environ.get(PROFILE_ENV, "") not in ("", "0"))
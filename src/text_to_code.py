@@ -1,251 +1,365 @@
 import re
-from pygments.lexers import guess_lexer, get_lexer_by_name
-from pygments.util import ClassNotFound
+import functools
 
-def extract_code_blocks_improved(text, lang=None):
+# 主函数和类定义的正则模式
+MAIN_PATTERNS = {
+    'C': [r'^\s*(int|void)\s+main\s*\('],
+    'C++': [r'^\s*(int|void)\s+main\s*\('],
+    'Java': [r'^\s*public\s+(static\s+)?void\s+main\s*\('],
+    'Python': [r'^\s*if\s+__name__\s*==\s*[\'"]__main__[\'"]\s*:', r'^\s*def\s+main\s*\(']
+}
+
+# 函数和类定义的通用模式
+FUNCTION_PATTERNS = {
+    'C': [
+        r'^\s*(int|void|char|float|double|long)\s+\w+\s*\(.*\)\s*\{?',
+        r'^\s*(struct|enum)\s+\w+(\s+\{)?'
+    ],
+    'C++': [
+        r'^\s*(int|void|char|float|double|long|auto)\s+\w+\s*\(.*\)\s*\{?',
+        r'^\s*(class|struct|enum)\s+\w+(\s+\{)?',
+        r'^\s*template\s*<.*>\s*(class|struct)\s+\w+'
+    ],
+    'Java': [
+        r'^\s*(public|private|protected)(\s+static)?\s+\w+\s+\w+\s*\(.*\)\s*\{?',
+        r'^\s*(public|private|protected)\s+(class|interface|enum)\s+\w+'
+    ],
+    'Python': [
+        r'^\s*def\s+\w+\s*\(.*\)\s*:',
+        r'^\s*class\s+\w+(\s*\(.*\))?\s*:',
+        r'^\s*@\w+(\s*\(.*\))?\s*$'
+    ]
+}
+
+# 预处理器和导入声明模式
+IMPORT_PATTERNS = {
+    'C': [r'^\s*#include\s*[<"].*[>"]'],
+    'C++': [r'^\s*#include\s*[<"].*[>"]', r'^\s*using\s+namespace\s+\w+\s*;'],
+    'Java': [r'^\s*import\s+[\w.]+\s*;', r'^\s*package\s+[\w.]+\s*;'],
+    'Python': [r'^\s*import\s+\w+', r'^\s*from\s+[\w.]+\s+import']
+}
+
+def _combine_patterns(patterns):
+    """把一组正则合并为一个交替正则，任一模式命中即匹配；空列表返回None"""
+    if not patterns:
+        return None
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+def _compile_block_patterns():
+    """按语言预编译代码块起始行和导入行的合并正则，None键对应不指定语言时的全部模式"""
+    start = {lang: _combine_patterns(MAIN_PATTERNS[lang] + FUNCTION_PATTERNS[lang]) for lang in MAIN_PATTERNS}
+    imports = {lang: _combine_patterns(IMPORT_PATTERNS[lang]) for lang in IMPORT_PATTERNS}
+    start[None] = _combine_patterns([p for patterns in MAIN_PATTERNS.values() for p in patterns] +
+                                    [p for patterns in FUNCTION_PATTERNS.values() for p in patterns])
+    imports[None] = _combine_patterns([p for patterns in IMPORT_PATTERNS.values() for p in patterns])
+    return start, imports
+
+_BLOCK_START_PATTERNS, _IMPORT_LINE_PATTERNS = _compile_block_patterns()
+
+def _iter_lines(text):
+    """惰性地按换行符切分文本，切分结果与str.split相同"""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+def _finish_block(block, with_lines):
     """
-    准确提取文本中的代码块，确保一个程序对应一个完整代码块
+    将累积的(行号, 行)拼成代码块，无效时返回None
+    with_lines为True时返回(代码块, 非空行的行号列表)
+    """
+    code = '\n'.join(line for _, line in block).strip()
+    if not is_valid_code(code):
+        return None
+    if with_lines:
+        return code, [index for index, line in block if line.strip()]
+    return code
+
+def iter_code_blocks(lines, lang=None, with_lines=False):
+    """
+    逐行扫描并在代码块结束（花括号闭合 / 缩进回退 / 连续空行）时立即产出
     
     Args:
-        text: 输入文本
+        lines: 行的可迭代对象，可以是列表、文件对象或生成器
         lang: 编程语言（可选），用于更准确的代码块识别
+        with_lines: 为True时同时产出代码块各行在输入中的行号（从0开始）
         
-    Returns:
-        提取出的代码块列表
+    Yields:
+        通过is_valid_code检查的原始代码块，with_lines为True时为(代码块, 行号列表)
     """
-    # 分割文本行
-    lines = text.split('\n')
-    blocks = []
-    current_block = []
-    in_code_block = False
-    include_buffer = []  # 用于临时存储include语句
-    
-    # 主函数和类定义的正则模式
-    main_patterns = {
-        'C': [r'^\s*(int|void)\s+main\s*\('],
-        'C++': [r'^\s*(int|void)\s+main\s*\('],
-        'Java': [r'^\s*public\s+(static\s+)?void\s+main\s*\('],
-        'Python': [r'^\s*if\s+__name__\s*==\s*[\'"]__main__[\'"]\s*:', r'^\s*def\s+main\s*\(']
-    }
-    
-    # 函数和类定义的通用模式
-    function_patterns = {
-        'C': [
-            r'^\s*(int|void|char|float|double|long)\s+\w+\s*\(.*\)\s*\{?',
-            r'^\s*(struct|enum)\s+\w+(\s+\{)?'
-        ],
-        'C++': [
-            r'^\s*(int|void|char|float|double|long|auto)\s+\w+\s*\(.*\)\s*\{?',
-            r'^\s*(class|struct|enum)\s+\w+(\s+\{)?',
-            r'^\s*template\s*<.*>\s*(class|struct)\s+\w+'
-        ],
-        'Java': [
-            r'^\s*(public|private|protected)(\s+static)?\s+\w+\s+\w+\s*\(.*\)\s*\{?',
-            r'^\s*(public|private|protected)\s+(class|interface|enum)\s+\w+'
-        ],
-        'Python': [
-            r'^\s*def\s+\w+\s*\(.*\)\s*:',
-            r'^\s*class\s+\w+(\s*\(.*\))?\s*:',
-            r'^\s*@\w+(\s*\(.*\))?\s*$'
-        ]
-    }
-    
-    # 预处理器和导入声明模式
-    import_patterns = {
-        'C': [r'^\s*#include\s*[<"].*[>"]'],
-        'C++': [r'^\s*#include\s*[<"].*[>"]', r'^\s*using\s+namespace\s+\w+\s*;'],
-        'Java': [r'^\s*import\s+[\w.]+\s*;', r'^\s*package\s+[\w.]+\s*;'],
-        'Python': [r'^\s*import\s+\w+', r'^\s*from\s+[\w.]+\s+import']
-    }
-    
-    # 根据语言选择适当的模式
     if lang:
-        active_main_patterns = main_patterns.get(lang, [])
-        active_function_patterns = function_patterns.get(lang, [])
-        active_import_patterns = import_patterns.get(lang, [])
+        start_regex = _BLOCK_START_PATTERNS.get(lang)
+        import_regex = _IMPORT_LINE_PATTERNS.get(lang)
     else:
-        active_main_patterns = [p for patterns in main_patterns.values() for p in patterns]
-        active_function_patterns = [p for patterns in function_patterns.values() for p in patterns]
-        active_import_patterns = [p for patterns in import_patterns.values() for p in patterns]
+        start_regex = _BLOCK_START_PATTERNS[None]
+        import_regex = _IMPORT_LINE_PATTERNS[None]
+    brace_lang = lang in ['C', 'C++', 'Java']
+    indent_lang = lang == 'Python'
     
+    current_block = []
+    in_code_block = False
+    include_buffer = []  # 用于临时存储include语句
     brace_count = 0  # 用于跟踪花括号匹配
     indent_level = 0  # 用于Python的缩进级别
     
-    i = 0
-    while i < len(lines):
-        line = lines[i].rstrip()
+    # 连续空行的判断需要看下一行，因此始终预读一行
+    lines = iter(lines)
+    next_line = next(lines, None)
+    index = -1
+    while next_line is not None:
+        line = next_line.rstrip()
+        next_line = next(lines, None)
+        index += 1
+        stripped = line.strip()
         
         # 检查是否为导入/包含语句
-        is_import = any(re.search(pattern, line) for pattern in active_import_patterns)
-        
-        # 检查是否为代码块的起始点
-        is_start = False
+        is_import = import_regex is not None and import_regex.search(line) is not None
         
         # 检查是否为主函数或函数定义开始
-        for pattern in active_main_patterns + active_function_patterns:
-            if re.search(pattern, line):
-                is_start = True
-                if current_block:
-                    # 如果已有代码块，先保存它
-                    code = '\n'.join(current_block).strip()
-                    if is_valid_code(code):
-                        blocks.append(code)
-                current_block = []
-                # 如果有缓存的include语句，添加到新代码块开始
-                if include_buffer:
-                    current_block.extend(include_buffer)
-                    include_buffer = []
-                in_code_block = True
-                if lang == 'Python':
-                    indent_level = len(re.match(r'^\s*', line).group())
-                break
+        is_start = start_regex is not None and start_regex.search(line) is not None
+        if is_start:
+            if current_block:
+                # 如果已有代码块，先保存它
+                finished = _finish_block(current_block, with_lines)
+                if finished:
+                    yield finished
+            current_block = []
+            # 如果有缓存的include语句，添加到新代码块开始
+            if include_buffer:
+                current_block.extend(include_buffer)
+                include_buffer = []
+            in_code_block = True
+            if indent_lang:
+                indent_level = len(line) - len(line.lstrip())
         
         # 处理导入/包含语句
         if is_import:
             if in_code_block:
                 # 如果已经在代码块中，直接添加到当前块
-                current_block.append(line)
+                current_block.append((index, line))
             else:
                 # 否则，添加到缓冲区
-                include_buffer.append(line)
+                include_buffer.append((index, line))
         # 处理其他代码行
         elif in_code_block or is_start:
-            if not (line.strip().startswith('//') or 
-                   line.strip().startswith('==') or 
-                   line.strip().startswith(':') or
+            if not (stripped.startswith('//') or 
+                   stripped.startswith('==') or 
+                   stripped.startswith(':') or
                    'DESKTOP' in line):
-                current_block.append(line)
+                current_block.append((index, line))
         
         # 更新花括号计数
-        if lang in ['C', 'C++', 'Java']:
+        if brace_lang:
             brace_count += line.count('{') - line.count('}')
         
         # 检查代码块是否结束
         if in_code_block:
-            if lang in ['C', 'C++', 'Java']:
-                if brace_count == 0 and line.strip() == '}':
-                    code = '\n'.join(current_block).strip()
-                    if is_valid_code(code):
-                        blocks.append(code)
+            if brace_lang:
+                if brace_count == 0 and stripped == '}':
+                    finished = _finish_block(current_block, with_lines)
+                    if finished:
+                        yield finished
                     current_block = []
                     in_code_block = False
                     include_buffer = []  # 清空include缓冲区
-            elif lang == 'Python':
-                if line.strip() and len(re.match(r'^\s*', line).group()) <= indent_level:
+            elif indent_lang:
+                if stripped and len(line) - len(line.lstrip()) <= indent_level:
                     if current_block:
-                        code = '\n'.join(current_block).strip()
-                        if is_valid_code(code):
-                            blocks.append(code)
+                        finished = _finish_block(current_block, with_lines)
+                        if finished:
+                            yield finished
                         current_block = []
                         in_code_block = False
                         include_buffer = []  # 清空include缓冲区
                         indent_level = 0
         
         # 处理多个空行作为代码块分隔
-        if in_code_block and not line.strip() and i+1 < len(lines) and not lines[i+1].strip():
+        if in_code_block and not stripped and next_line is not None and not next_line.strip():
             if current_block:
-                code = '\n'.join(current_block).strip()
-                if is_valid_code(code):
-                    blocks.append(code)
+                finished = _finish_block(current_block, with_lines)
+                if finished:
+                    yield finished
                 current_block = []
                 in_code_block = False
                 include_buffer = []  # 清空include缓冲区
                 brace_count = 0
                 indent_level = 0
-        
-        i += 1
     
     # 处理最后一个代码块
     if current_block:
-        code = '\n'.join(current_block).strip()
-        if is_valid_code(code):
-            blocks.append(code)
+        finished = _finish_block(current_block, with_lines)
+        if finished:
+            yield finished
+
+def extract_code_blocks_improved(text, lang=None):
+    """
+    准确提取文本中的代码块，确保一个程序对应一个完整代码块
     
+    Args:
+        text: 输入文本，或逐行产出文本的可迭代对象
+        lang: 编程语言（可选），用于更准确的代码块识别
+        
+    Returns:
+        提取出的代码块列表
+    """
+    lines = _iter_lines(text) if isinstance(text, str) else text
+    blocks = list(iter_code_blocks(lines, lang))
     return blocks, postprocess_code_blocks(blocks,lang)
 
-def checkcode(text):
+def locate_code_blocks(text, lang=None):
     """
-    :param text:
-    :return:
-    通过语言特性识别编程语言（C,C++,Python,Java）
+    与extract_code_blocks_improved相同，另外返回每个代码块由输入中的哪些行组成
+    调用方可据此直接由版面中各行的位置计算代码块的位置，无需在页面中搜索文本
+    
+    Returns:
+        (原始代码块列表, 修正后的代码块列表, 每个代码块的行号列表)
     """
-    LANGUAGE_FEATURES = {
-        "C": [
-            (r"#include\s+<[a-z]+\.h>", 5),  # 头文件包含
-            (r"int\s+main\s*\(.*?\)\s*{", 4),  # main函数定义
-            (r"printf\s*\(", 3),  # 标准输出函数
-            (r"->|struct\s+\w+", 2),  # 指针和结构体
-            (r'`\b(?:[\w\s]+\b)+?\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # 带返回值的函数
-            (r'`void\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # void类函数
-        ],
-        "C++": [
-            (r"#include\s+<[a-z]+>", 4),  # 标准库头文件
-            (r"using\s+namespace\s+std;", 5),  # 命名空间声明
-            (r"std::\w+", 3),  # STL组件
-            (r"class\s+\w+\s*{", 4),  # 类声明
-            (r"cout\s*<<", 3),  # 输出流
-            (r'`\b(?:[\w\s]+\b)+?\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # 带返回值的函数
-            (r'`void\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # void类函数
-        ],
-        "Java": [
-            (r"public\s+class\s+\w+", 5),  # 类声明
-            (r"System\.out\.print", 4),  # 标准输出
-            (r"import\s+java\.", 4),  # 包导入
-            (r"@Override|@Test", 3)  # 注解
-        ],
-        "Python": [
-            (r"def\s+\w+\s*\(", 5),  # 函数定义
-            (r"import\s+(os|sys|numpy)", 3),  # 常见模块
-            (r"print\(.*?\)", 3),  # 输出语句
-            (r"lambda\s+.*?:", 2),  # 匿名函数
-            (r"^[\t ]+", 4)  # 缩进语法（需逐行检查）
-        ]
-    }
-    LANGUAGE_FEATURES["C"].extend([
+    lines = _iter_lines(text) if isinstance(text, str) else text
+    located = list(iter_code_blocks(lines, lang, with_lines=True))
+    blocks = [code for code, _ in located]
+    return blocks, postprocess_code_blocks(blocks,lang), [indices for _, indices in located]
+
+# 各语言的特征正则及权重
+LANGUAGE_FEATURES = {
+    "C": [
+        (r"#include\s+<[a-z]+\.h>", 5),  # 头文件包含
+        (r"int\s+main\s*\(.*?\)\s*{", 4),  # main函数定义
+        (r"printf\s*\(", 3),  # 标准输出函数
+        (r"->|struct\s+\w+", 2),  # 指针和结构体
+        (r'`\b(?:[\w\s]+\b)+?\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # 带返回值的函数
+        (r'`void\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # void类函数
         (r"#define\s+\w+", 3),                        # 宏定义
         (r"typedef\s+struct", 4),                     # 结构体类型定义
         (r"malloc\s*\(|free\s*\(", 3),                # 内存分配函数
         (r"FILE\s*\*", 3),                            # 文件操作
-    ])
-    
-    LANGUAGE_FEATURES["C++"].extend([
+    ],
+    "C++": [
+        (r"#include\s+<[a-z]+>", 4),  # 标准库头文件
+        (r"using\s+namespace\s+std;", 5),  # 命名空间声明
+        (r"std::\w+", 3),  # STL组件
+        (r"class\s+\w+\s*{", 4),  # 类声明
+        (r"cout\s*<<", 3),  # 输出流
+        (r'`\b(?:[\w\s]+\b)+?\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # 带返回值的函数
+        (r'`void\s+\w+\s*[)]∗[)]∗\s*{[\s\S]+?}(?=\n\w)', 4),  # void类函数
         (r"new\s+\w+|delete\s+\w+", 4),               # 内存管理
         (r"template\s*<", 5),                         # 模板
         (r"namespace\s+\w+", 4),                      # 命名空间
         (r"\w+<\w+>", 3),                             # 模板实例化
-    ])
-    
-    LANGUAGE_FEATURES["Python"].extend([
-        (r":\s*\n\s+", 5),                            # 代码块缩进
-        (r"with\s+\w+", 4),                           # with语句
-        (r"for\s+\w+\s+in\s+", 4),                    # for循环
-        (r"#.*?coding[:=]\s*([-\w.]+)", 3),           # 编码声明
-    ])
-    
-    LANGUAGE_FEATURES["Java"].extend([
+    ],
+    "Java": [
+        (r"public\s+class\s+\w+", 5),  # 类声明
+        (r"System\.out\.print", 4),  # 标准输出
+        (r"import\s+java\.", 4),  # 包导入
+        (r"@Override|@Test", 3),  # 注解
         (r"public\s+static\s+void\s+main", 5),        # main方法
         (r"@\w+", 3),                                 # 注解
         (r"new\s+\w+\s*\(", 3),                       # 对象创建
         (r"try\s*{[\s\S]*?}\s*catch", 4),             # 异常处理
-    ])
-    
-    scores = {lang: 0 for lang in LANGUAGE_FEATURES}
-    lines = text.split('\n')
+    ],
+    "Python": [
+        (r"def\s+\w+\s*\(", 5),  # 函数定义
+        (r"import\s+(os|sys|numpy)", 3),  # 常见模块
+        (r"print\(.*?\)", 3),  # 输出语句
+        (r"lambda\s+.*?:", 2),  # 匿名函数
+        (r"^[\t ]+", 4),  # 缩进语法（需逐行检查）
+        (r":\s*\n\s+", 5),                            # 代码块缩进
+        (r"with\s+\w+", 4),                           # with语句
+        (r"for\s+\w+\s+in\s+", 4),                    # for循环
+        (r"#.*?coding[:=]\s*([-\w.]+)", 3),           # 编码声明
+    ]
+}
 
-    for lang, patterns in LANGUAGE_FEATURES.items():
-        for line in lines:
-            for pattern, weight in patterns:
-                if re.search(pattern, line):
+def _compile_features(features):
+    """
+    导入时编译一次特征表：相同的正则只保留一份，记录它对哪些语言加多少分；
+    另把全部特征合并成一个交替正则，用于一次扫描排除不含任何特征的行
+    """
+    credits = {}
+    for lang, patterns in features.items():
+        for pattern, weight in patterns:
+            credits.setdefault(pattern, []).append((lang, weight))
+    table = [(re.compile(pattern), tuple(credit)) for pattern, credit in credits.items()]
+    combined = re.compile('|'.join(f'(?:{pattern})' for pattern in credits))
+    return table, combined
+
+_FEATURE_TABLE, _ANY_FEATURE = _compile_features(LANGUAGE_FEATURES)
+
+def score_languages(text):
+    """
+    按行统计各语言的特征得分：每个特征在一行中出现即加一次权重
+    大部分行（正文）只需合并正则的一次扫描即可跳过
+    """
+    scores = {lang: 0 for lang in LANGUAGE_FEATURES}
+    for line in text.split('\n'):
+        # 合并正则找不到匹配，说明这一行不含任何特征
+        first = _ANY_FEATURE.search(line)
+        if first is None:
+            continue
+        # 合并正则返回最左匹配，任何特征都不可能在它之前开始匹配
+        pos = first.start()
+        for regex, credit in _FEATURE_TABLE:
+            if regex.search(line, pos):
+                for lang, weight in credit:
                     scores[lang] += weight
+    return scores
 
-    max_score = max(scores.values())
-    if max_score <= 5:
+def checkcode(text):
+    """
+    :param text:
+    :return:
+    通过语言特性识别编程语言（C,C++,Python,Java）
+    """
+    lang = detect_language(text)
+    if lang is None:
         return False, None, None, "Unknown"
     else:
-        lang = max(scores, key=scores.get)
         origin_blocks, blocks = extract_code_blocks_improved(text, lang)
         return True, origin_blocks, blocks, lang
 
+def detect_language(text):
+    """返回得分最高的语言，最高分不超过5时认为不是代码，返回None"""
+    scores = score_languages(text)
+    max_score = max(scores.values())
+    if max_score <= 5:
+        return None
+    return max(scores, key=scores.get)
+
+# 猜测结果按代码块内容缓存的条目数
+GUESS_CACHE_SIZE = 4096
+
+# 猜测语言时只比较项目支持的四种语言的词法分析器，首次猜测时才导入pygments
+_guess_lexers = None
+
+def _load_guess_lexers():
+    global _guess_lexers
+    if _guess_lexers is None:
+        from pygments.lexers.c_cpp import CLexer, CppLexer
+        from pygments.lexers.jvm import JavaLexer
+        from pygments.lexers.python import PythonLexer
+        # 顺序决定得分相同时的优先级
+        _guess_lexers = (CLexer, CppLexer, JavaLexer, PythonLexer)
+    return _guess_lexers
+
+@functools.lru_cache(maxsize=GUESS_CACHE_SIZE)
+def guess_language(code):
+    """
+    用pygments猜测代码块的语言，与guess_lexer的规则相同（取analyse_text得分最高者，满分直接返回），
+    但只在C/C++/Java/Python中选择，不必遍历pygments的全部词法分析器
+    :return: 小写的语言名（c、c++、java、python），都不匹配时返回None
+    """
+    best, best_score = None, 0.0
+    for lexer in _load_guess_lexers():
+        score = lexer.analyse_text(code)
+        if score == 1.0:
+            return lexer.name.lower()
+        if score > best_score:
+            best, best_score = lexer, score
+    return best.name.lower() if best else None
+
 def is_valid_code(code):
     """判断提取的内容是否为有效的代码块"""
     if not code.strip():
@@ -262,16 +376,9 @@ def is_valid_code(code):
         if re.search(marker, code):
             return True
             
-    # 使用pygments尝试检测语言
-    try:
-        lexer = guess_lexer(code)
-        lang = lexer.name.lower()
-        return lang in ['c', 'c++', 'java', 'python']
-    except ClassNotFound:
-        pass
-        
-    # 长度检查 - 太短的可能不是有效代码
-    return len(code.strip().split('\n')) >= 3
+    # 使用pygments尝试检测语言；原先pygments找不到词法分析器时按行数（不少于3行）判断，
+    # 但guess_lexer总会退回到得分0.01的TextLexer，从不抛出ClassNotFound，按行数判断的分支实际上不会执行
+    return guess_language(code) is not None
 
 def postprocess_code_blocks(blocks, lang):
     """
@@ -286,168 +393,493 @@ def postprocess_code_blocks(blocks, lang):
     result = []
     
     for block in blocks:
-        try:
-            # 尝试检测代码语言
-            lexer = guess_lexer(block)
-            if (lang == None) or (lang == "Unknown"):
-                lang = lexer.name.lower()
-            
-            # 根据不同语言进行处理
-            if 'c' in lang:
-                fixed_block = fix_c_code(block)
-            elif 'c++' in lang:
-                fixed_block = fix_cpp_code(block)
-            elif 'java' in lang:
-                fixed_block = fix_java_code(block)
-            elif 'python' in lang:
-                fixed_block = fix_python_code(block)
-            else:
-                fixed_block = block
-                
-            result.append(fixed_block)
-        except ClassNotFound:
+        # 调用方未给出语言时才尝试检测代码语言
+        if (lang == None) or (lang == "Unknown"):
+            lang = guess_language(block)
+        if lang is None:
             # 如果无法检测语言，保持原样
             result.append(block)
+            continue
+        
+        # 根据不同语言进行处理
+        if 'c' in lang:
+            fixed_block = fix_c_code(block)
+        elif 'c++' in lang:
+            fixed_block = fix_cpp_code(block)
+        elif 'java' in lang:
+            fixed_block = fix_java_code(block)
+        elif 'python' in lang:
+            fixed_block = fix_python_code(block)
+        else:
+            fixed_block = block
+            
+        result.append(fixed_block)
     
     return result
 
+# 格式化用的词法规则：一次扫描得到空白、换行、注释、字符串、数字、标识符、运算符和括号
+# 字符串和注释整体作为一个记号，格式化时原样输出；未闭合的字符串一直延续到行尾
+_FORMAT_TOKEN_PATTERNS = {
+    'c': re.compile(r'''
+        (?P<space>[ \t\r\f\v]+)
+      | (?P<newline>\n)
+      | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+      | (?P<string>(?:u8|[LuU])?"(?:\\.|[^"\\\n])*(?:"|$)|(?:u8|[LuU])?'(?:\\.|[^'\\\n])*(?:'|$))
+      | (?P<preproc>\#[^\n]*)
+      | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+      | (?P<word>[A-Za-z_$][\w$]*)
+      | (?P<op>\.\.\.|<<=|>>=|->|::|\+\+|--|&&|\|\||[-+*/%&|^!=<>]=|<<|>>|[-+*/%&|^!~<>=?:.,;@\\])
+      | (?P<open>[(\[{])
+      | (?P<close>[)\]}])
+      | (?P<other>.)
+    ''', re.X | re.S | re.M),
+    'python': re.compile(r'''
+        (?P<space>[ \t\r\f\v]+)
+      | (?P<newline>\n)
+      | (?P<comment>\#[^\n]*)
+      | (?P<string>(?i:[rbuf]{0,2})(?:""".*?(?:"""|\Z)|\'\'\'.*?(?:\'\'\'|\Z)
+                   |"(?:\\.|[^"\\\n])*(?:"|$)|'(?:\\.|[^'\\\n])*(?:'|$)))
+      | (?P<number>\.?\d(?:[eE][+-]|[\w.])*)
+      | (?P<word>[A-Za-z_]\w*)
+      | (?P<op>\.\.\.|\*\*=|//=|<<=|>>=|->|:=|\*\*|//|<<|>>|[-+*/%&|^@=!<>]=|[-+*/%&|^~<>=.,;:@\\])
+      | (?P<open>[(\[{])
+      | (?P<close>[)\]}])
+      | (?P<other>.)
+    ''', re.X | re.S | re.M),
+}
+
+# 两侧加空格的二元运算符
+_BINARY_OPS = frozenset(['=', '+=', '-=', '*=', '/=', '%=', '&=', '|=', '^=', '<<=', '>>=', '**=', '//=', ':=',
+                         '==', '!=', '<=', '>=', '<', '>', '&&', '||', '+', '-', '*', '/', '%', '&', '|', '^',
+                         '<<', '>>', '**', '//'])
+# 可以作为一元运算符的符号
+_UNARY_OPS = frozenset(['+', '-', '*', '&', '!', '~', '**'])
+# 其后出现的运算符按一元处理的关键字
+_UNARY_CONTEXT_WORDS = frozenset(['return', 'case', 'sizeof', 'throw', 'yield', 'and', 'or', 'not', 'in', 'is',
+                                  'if', 'elif', 'while', 'else', 'lambda', 'assert', 'await'])
+# 后面的左括号前保留空格的关键字
+_CONTROL_WORDS = frozenset(['if', 'for', 'while', 'switch', 'catch', 'return', 'elif', 'and', 'or', 'not', 'in',
+                            'is', 'else', 'with', 'assert', 'yield', 'except', 'lambda', 'synchronized', 'try',
+                            'do', 'case', 'throw', 'new', 'delete', 'import', 'from', 'raise', 'del', 'await'])
+# C/C++中，出现在*、&之前时表示指针或引用声明的类型关键字
+_TYPE_WORDS = frozenset(['int', 'char', 'float', 'double', 'long', 'short', 'void', 'unsigned', 'signed', 'bool',
+                         'const', 'auto', 'size_t', 'FILE', 'string'])
+# 出现在这些记号之后的"标识符 *"按声明处理（如 Node *next;）
+_DECLARATION_STARTS = frozenset(['{', '}', ';', 'struct', 'const', 'static', 'unsigned', 'extern', 'class',
+                                 'union', 'enum'])
+# C/C++/Java中模板（泛型）尖括号内允许出现的记号
+_TEMPLATE_INNER = frozenset(['::', ',', '.', '*', '&', '?', '[', ']'])
+_ACCESS_LABELS = frozenset(['case', 'default', 'public', 'private', 'protected'])
+
+class _FormatToken:
+    __slots__ = ('kind', 'text', 'spaced', 'role')
+
+    def __init__(self, kind, text, spaced):
+        self.kind = kind
+        self.text = text
+        # 源代码中该记号前是否有空白，规则无法判断时保留原样
+        self.spaced = spaced
+        # 运算符在上下文中的作用：binary、unary、prefix、postfix、template、member、kwarg、slice、label、ternary
+        self.role = None
+
+def _merge_split_strings(lines):
+    """OCR或排版把一个字符串拆到两行时（两行的双引号数都是奇数），把这两行合并为一行"""
+    merged = []
+    pending = None
+    for line in lines:
+        odd = line.count('"') % 2 == 1 and '"""' not in line
+        if pending is not None:
+            if odd:
+                merged.append(pending.rstrip() + line.strip())
+                pending = None
+                continue
+            merged.append(pending)
+            pending = None
+        if odd:
+            pending = line
+        else:
+            merged.append(line)
+    if pending is not None:
+        merged.append(pending)
+    return merged
+
+def _tokenize_lines(code, family):
+    """把代码切成逐行的记号列表；跨行的字符串和注释归入开始的那一行"""
+    lines = [[]]
+    indents = ['']
+    spaced = False
+    for match in _FORMAT_TOKEN_PATTERNS[family].finditer(code):
+        kind, text = match.lastgroup, match.group()
+        if kind == 'space':
+            if not lines[-1]:
+                indents[-1] = text
+            spaced = True
+        elif kind == 'newline':
+            lines.append([])
+            indents.append('')
+            spaced = False
+        else:
+            lines[-1].append(_FormatToken(kind, text, spaced))
+            spaced = False
+    return lines, indents
+
+def _is_template_open(tokens, i):
+    """tokens[i]为<时判断是否为模板或泛型的尖括号，是则返回对应的右尖括号位置列表"""
+    if i == 0 or tokens[i - 1].kind != 'word':
+        return None
+    depth = 1
+    closers = []
+    for j in range(i + 1, len(tokens)):
+        token = tokens[j]
+        if token.text == '<':
+            depth += 1
+            closers.append(j)
+        elif token.text in ('>', '>>'):
+            depth -= len(token.text)
+            closers.append(j)
+            if depth <= 0:
+                return closers if depth == 0 else None
+        elif token.kind not in ('word', 'number') and token.text not in _TEMPLATE_INNER:
+            return None
+    return None
+
+def _is_cast(tokens, i):
+    """tokens[i]为)时判断是否为类型转换的右括号，如(int)、(char *)、(unsigned long)，sizeof(int)等不算"""
+    j = i - 1
+    has_type = False
+    while j >= 0 and tokens[j].text != '(':
+        if tokens[j].text in _TYPE_WORDS:
+            has_type = True
+        elif tokens[j].text not in ('*', '&'):
+            return False
+        j -= 1
+    if j < 0 or not has_type:
+        return False
+    before = tokens[j - 1] if j > 0 else None
+    return (before is None or before.kind in ('op', 'open')
+            or before.text in _UNARY_CONTEXT_WORDS and before.text != 'sizeof')
+
+def _is_annotated(tokens, i):
+    """tokens[i]为括号内的=时判断所在参数是否带类型注解（如 x: int = 3）"""
+    depth = 0
+    for j in range(i - 1, -1, -1):
+        token = tokens[j]
+        if token.kind == 'close':
+            depth += 1
+        elif token.kind == 'open':
+            if not depth:
+                return False
+            depth -= 1
+        elif not depth and token.text == ',':
+            return False
+        elif not depth and token.text == ':':
+            return True
+    return False
+
+def _assign_roles(tokens, lang, brackets):
+    """确定一行中各运算符的作用；brackets为跨行保持的括号栈"""
+    python = lang == 'Python'
+    ternary = 0
+    for i, token in enumerate(tokens):
+        prev = tokens[i - 1] if i > 0 else None
+        text = token.text
+        if token.kind == 'open':
+            brackets.append(text)
+            continue
+        if token.kind == 'close':
+            if brackets:
+                brackets.pop()
+            continue
+        if token.kind != 'op' or token.role is not None:
+            continue
+        operand_before = prev is not None and (
+            prev.kind in ('word', 'number', 'string', 'close') and prev.text not in _UNARY_CONTEXT_WORDS
+            or prev.role in ('postfix', 'template'))
+        if operand_before and prev.text == ')' and not python and _is_cast(tokens, i - 1):
+            # 类型转换之后的运算符作用于后面的操作数，如 (int) *p、(double) -x
+            operand_before = False
+        if text in ('.', '::') or (text == '->' and lang in ('C', 'C++')):
+            token.role = 'member'
+        elif text in ('++', '--'):
+            token.role = 'postfix' if operand_before else 'prefix'
+        elif text == '<' and lang in ('C++', 'Java') and operand_before:
+            closers = _is_template_open(tokens, i)
+            if closers:
+                token.role = 'template'
+                for j in closers:
+                    tokens[j].role = 'template'
+            else:
+                token.role = 'binary'
+        elif python and text == '=' and brackets and brackets[-1] == '(':
+            # 带类型注解的默认值两侧加空格（PEP 8）：def f(x: int = 3)
+            token.role = 'binary' if _is_annotated(tokens, i) else 'kwarg'
+        elif python and text == ':':
+            token.role = 'slice' if brackets and brackets[-1] == '[' else 'label'
+        elif text == '?':
+            ternary += 1
+            token.role = 'ternary'
+        elif text == ':':
+            if ternary:
+                ternary -= 1
+                token.role = 'ternary'
+            elif tokens[0].text in _ACCESS_LABELS or i == 1:
+                token.role = 'label'
+        elif text in _UNARY_OPS and not operand_before:
+            token.role = 'unary'
+        elif text in ('*', '&') and lang in ('C', 'C++') and prev.kind == 'word' and i + 1 < len(tokens) and (
+                tokens[i + 1].kind == 'word' or tokens[i + 1].text in ('*', '&', ')')) and (
+                prev.text in _TYPE_WORDS or i == 1 or tokens[i - 2].text in _DECLARATION_STARTS):
+            # 指针或引用声明：int *p、Node *next、(char *)
+            token.role = 'unary'
+        elif text in _BINARY_OPS or text == '->':
+            token.role = 'binary'
+        elif text == '@' and i == 0:
+            token.role = 'unary'
+
+def _space_between(prev, token, lang):
+    """两个相邻记号之间是否需要空格，返回None表示保留源代码中的空白"""
+    text, role = token.text, token.role
+    python = lang == 'Python'
+    # 右侧记号决定的情况
+    if text in (',', ';', ')', ']') or role in ('member', 'postfix', 'slice', 'kwarg'):
+        if role == 'member' and python and prev.text in ('from', 'import'):
+            return None
+        return False
+    if role in ('label', 'template'):
+        return False
+    if text == '(' and (prev.kind == 'close' or prev.kind == 'word' and prev.text not in _CONTROL_WORDS):
+        return False
+    if text == '[' and prev.kind in ('word', 'close', 'string') and prev.text not in _CONTROL_WORDS:
+        return False
+    # 左侧记号决定的情况
+    prev_text, prev_role = prev.text, prev.role
+    if prev_text in ('(', '[') or prev_role in ('member', 'prefix', 'unary', 'kwarg', 'slice'):
+        return False
+    if python and prev_text == '{':
+        return False
+    if prev_role == 'template':
+        return token.kind == 'word' and prev_text != '<'
+    if prev_text in (',', ';') or prev_role in ('binary', 'ternary', 'label'):
+        return True
+    if prev_text in (')', '}') and token.kind == 'word':
+        return True
+    # 其余由右侧记号决定
+    if role in ('binary', 'ternary', 'unary', 'prefix') or token.kind == 'comment':
+        return True
+    if text == '{':
+        return not python
+    if text == '}':
+        return False if python or prev_text == '{' else None
+    if text == '(':
+        return True
+    if token.kind in ('word', 'number') and prev.kind in ('word', 'number'):
+        return True
+    if token.kind == 'string' and prev.kind == 'word' and prev_text in _CONTROL_WORDS | _UNARY_CONTEXT_WORDS:
+        return True
+    return None
+
 def format_code(code, lang):
     """
     格式化代码，修复空格缺失和格式对齐问题
-    
+    按记号流逐行输出：字符串、字符常量和注释原样保留，运算符两侧的空格由其在上下文中的作用决定，
+    C/C++/Java按花括号层次重新缩进，Python保留原有缩进
+
     Args:
         code: 要格式化的代码
         lang: 编程语言
-    
+
     Returns:
         格式化后的代码
     """
-    # 首先保护字符串字面量
-    protected_strings = []
-    def protect_strings(match):
-        protected_strings.append(match.group(0))
-        return f"__STRING_{len(protected_strings)-1}__"
-    
-    # 保护字符串字面量，包括多行字符串
-    string_pattern = r'("(?:[^"\\]|\\.)*")'
-    protected_code = re.sub(string_pattern, protect_strings, code)
-    
-    lines = protected_code.split('\n')
+    python = lang == 'Python'
+    lines, indents = _tokenize_lines('\n'.join(_merge_split_strings(code.split('\n'))),
+                                     'python' if python else 'c')
     result = []
     indent_level = 0
-    
-    # 常见的需要空格的操作符和关键字
-    operators = ['=', '+', '-', '*', '/', '%', '==', '!=', '>=', '<=', '>', '<', '&&', '||']
-    keywords = {
-        'C': ['if', 'else', 'for', 'while', 'do', 'switch', 'case', 'return', 'void', 'int', 'char', 'float', 'double', 'long'],
-        'C++': ['if', 'else', 'for', 'while', 'do', 'switch', 'case', 'return', 'class', 'template', 'void', 'int', 'char', 'float', 'double', 'long'],
-        'Java': ['if', 'else', 'for', 'while', 'do', 'switch', 'case', 'return', 'class', 'interface', 'void', 'int', 'char', 'float', 'double', 'long'],
-        'Python': ['if', 'else', 'elif', 'for', 'while', 'def', 'class', 'return', 'import', 'from']
-    }
-    
-    # 获取当前语言的关键字
-    current_keywords = keywords.get(lang, keywords['C'])
-    
-    # 合并分散的字符串字面量
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-        
-        # 如果这一行以字符串开始但没有结束，尝试与下一行合并
-        if line.count('"') % 2 == 1 and i + 1 < len(lines):
-            next_line = lines[i + 1].strip()
-            if next_line.count('"') % 2 == 1:
-                lines[i] = line + next_line
-                del lines[i + 1]
-                continue
-        i += 1
-    
-    for i, line in enumerate(lines):
-        # 移除行首尾空格
-        line = line.strip()
-        
-        if not line:
+    brackets = []
+    for tokens, indent in zip(lines, indents):
+        if not tokens:
             result.append('')
             continue
-            
+        # 预处理指令原样保留
+        if tokens[0].kind == 'preproc':
+            result.append(''.join((' ' if token.spaced and i else '') + token.text
+                                  for i, token in enumerate(tokens)))
+            continue
+        _assign_roles(tokens, lang, brackets)
+
         # 处理缩进
-        if lang in ['C', 'C++', 'Java']:
-            # 减少缩进的情况
-            if '}' in line:
-                indent_level = max(0, indent_level - 1)
-            # 添加缩进
-            if indent_level > 0:
-                line = '    ' * indent_level + line
-            # 增加缩进的情况
-            if '{' in line:
-                indent_level += 1
-        
-        # 修复空格问题
-        # 1. 修复关键字后直接跟标识符或数字的情况
-        for keyword in current_keywords:
-            pattern = fr'\b{keyword}(\w+)'
-            if re.search(pattern, line):
-                line = re.sub(pattern, fr'{keyword} \1', line)
-        
-        # 2. 在操作符前后添加空格
-        for op in operators:
-            if op in line:
-                # 避免修改 -> 运算符
-                if op == '-' and '->' in line:
-                    continue
-                # 避免修改 #include 中的 <
-                if op in ['<', '>'] and '#include' in line:
-                    continue
-                # 添加空格，但避免重复空格
-                line = line.replace(op, f' {op} ').replace('  ', ' ')
-        
-        # 3. 修复函数调用和定义的空格
-        if '(' in line and not line.strip().startswith('#'):
-            # 修复函数名和括号之间的空格
-            line = re.sub(r'(\w+)\s+\(', r'\1(', line)
-            # 修复参数之间的逗号后的空格
-            line = re.sub(r',\s*', r', ', line)
-            # 修复指针声明的空格
-            line = re.sub(r'\*\s*(\w+)', r'* \1', line)
-        
-        result.append(line)
-    
-    formatted = '\n'.join(result)
-    
-    # 恢复被保护的字符串
-    for i, string in enumerate(protected_strings):
-        formatted = formatted.replace(f"__STRING_{i}__", string)
-    
-    # 最后的清理：删除多余的空格
-    formatted = re.sub(r' +', ' ', formatted)
-    formatted = re.sub(r' +$', '', formatted, flags=re.MULTILINE)
-    
-    return formatted
+        if python:
+            parts = [indent]
+        else:
+            leading = 0
+            while leading < len(tokens) and tokens[leading].text == '}':
+                leading += 1
+            opens = sum(1 for token in tokens if token.text == '{')
+            closes = sum(1 for token in tokens if token.text == '}')
+            parts = ['    ' * max(0, indent_level - leading)]
+            indent_level = max(0, indent_level + opens - closes)
+
+        parts.append(tokens[0].text)
+        for prev, token in zip(tokens, tokens[1:]):
+            space = _space_between(prev, token, lang)
+            if space is None:
+                space = token.spaced
+            if space:
+                # 代码之后的行尾注释前空两格（PEP 8）
+                parts.append('  ' if token.kind == 'comment' and token is tokens[-1] else ' ')
+            parts.append(token.text)
+        result.append(''.join(parts).rstrip())
+
+    return '\n'.join(result)
+
+# 头文件和导入的推断规则：头文件（包、模块） -> 用到后需要它的标识符，按需扩充
+C_HEADER_RULES = {
+    'stdio.h': 'printf scanf fprintf fscanf sprintf snprintf sscanf puts gets fgets fputs putchar getchar '
+               'fopen fclose fread fwrite fseek ftell rewind fflush perror FILE EOF stdin stdout stderr',
+    'stdlib.h': 'malloc calloc realloc free exit atoi atof atol strtol strtod rand srand qsort bsearch system '
+                'EXIT_SUCCESS EXIT_FAILURE',
+    'string.h': 'strlen strcpy strncpy strcat strncat strcmp strncmp strchr strrchr strstr strtok '
+                'memcpy memmove memset memcmp',
+    'math.h': 'sqrt pow fabs sin cos tan asin acos atan atan2 exp log log10 floor ceil fmod round M_PI',
+    'ctype.h': 'isalpha isdigit isalnum isspace isupper islower ispunct toupper tolower',
+    'time.h': 'clock difftime ctime localtime strftime CLOCKS_PER_SEC time_t clock_t',
+    'stdbool.h': 'bool true false',
+    'limits.h': 'INT_MAX INT_MIN LONG_MAX LONG_MIN UINT_MAX CHAR_MAX CHAR_MIN',
+    'stdint.h': 'int8_t int16_t int32_t int64_t uint8_t uint16_t uint32_t uint64_t',
+    'assert.h': 'assert',
+}
+
+CPP_HEADER_RULES = {
+    'iostream': 'cout cin cerr clog endl',
+    'string': 'string getline to_string stoi stol stod',
+    'vector': 'vector',
+    'map': 'map multimap',
+    'set': 'set multiset',
+    'unordered_map': 'unordered_map',
+    'unordered_set': 'unordered_set',
+    'list': 'list',
+    'deque': 'deque',
+    'queue': 'queue priority_queue',
+    'stack': 'stack',
+    'algorithm': 'sort stable_sort reverse find swap max_element min_element binary_search lower_bound upper_bound',
+    'numeric': 'accumulate iota',
+    'utility': 'pair make_pair',
+    'sstream': 'stringstream istringstream ostringstream',
+    'fstream': 'fstream ifstream ofstream',
+    'iomanip': 'setw setprecision setfill',
+    'memory': 'unique_ptr shared_ptr make_unique make_shared',
+    'cmath': 'sqrt pow fabs sin cos tan exp log floor ceil',
+    'cstring': 'strlen strcpy strcmp strcat memset memcpy',
+    'cstdlib': 'rand srand',
+    'climits': 'INT_MAX INT_MIN LONG_MAX LONG_MIN',
+}
+# 这些头文件中的名字来自C标准库，不加std::也能使用
+CPP_C_HEADERS = ('cmath', 'cstring', 'cstdlib', 'climits')
+
+JAVA_IMPORT_RULES = {
+    'java.util': 'Scanner List ArrayList LinkedList Map HashMap TreeMap LinkedHashMap Set HashSet TreeSet '
+                 'Arrays Collections Random Iterator Queue Deque ArrayDeque PriorityQueue Stack Optional Objects',
+    'java.util.function': 'Function BiFunction Predicate Consumer Supplier',
+    'java.util.stream': 'Stream IntStream Collectors',
+    'java.io': 'File FileReader FileWriter BufferedReader BufferedWriter InputStreamReader PrintWriter '
+               'IOException FileNotFoundException',
+    'java.math': 'BigInteger BigDecimal',
+    'java.time': 'LocalDate LocalTime LocalDateTime Duration Instant',
+}
+
+PYTHON_IMPORT_RULES = {
+    'random': 'randint choice random shuffle uniform sample randrange',
+    'math': 'sqrt pi sin cos tan floor ceil factorial gcd',
+    'sys': 'argv exit',
+    'os': 'path makedirs remove listdir getcwd',
+    're': 'match search findall finditer fullmatch',
+    'time': 'sleep',
+    'collections': 'deque defaultdict Counter OrderedDict namedtuple',
+    'itertools': 'permutations combinations',
+    'functools': 'reduce lru_cache',
+    'copy': 'deepcopy',
+    'heapq': 'heappush heappop heapify',
+    'bisect': 'bisect_left bisect_right insort',
+}
+# 以"模块名."形式使用即需要导入的标准库模块
+PYTHON_MODULES = frozenset(PYTHON_IMPORT_RULES) | frozenset(
+    ['json', 'datetime', 'statistics', 'csv', 'string', 'turtle', 'typing', 'pathlib'])
+
+def _symbol_index(rules):
+    """把规则表倒排为 标识符 -> 头文件（同一标识符出现在多个头文件时取第一个）"""
+    index = {}
+    for header, symbols in rules.items():
+        for symbol in symbols.split():
+            index.setdefault(symbol, header)
+    return index
+
+C_SYMBOLS = _symbol_index(C_HEADER_RULES)
+CPP_SYMBOLS = _symbol_index(CPP_HEADER_RULES)
+# 不加std::直接使用时需要using namespace std的名字
+CPP_STD_NAMES = frozenset(symbol for symbol, header in CPP_SYMBOLS.items() if header not in CPP_C_HEADERS)
+JAVA_SYMBOLS = _symbol_index(JAVA_IMPORT_RULES)
+PYTHON_SYMBOLS = _symbol_index(PYTHON_IMPORT_RULES)
+
+# 一次扫描代码块：字符串、字符常量和注释整体匹配后跳过，其余为（可能带.、::、->前缀的）标识符
+_TOKEN_PATTERNS = {
+    'c': re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|//[^\n]*|/\*.*?(?:\*/|$)'
+                    r'|(\.|::|->)?\s*([A-Za-z_]\w*)', re.S),
+    'python': re.compile(r'""".*?(?:"""|$)|\'\'\'.*?(?:\'\'\'|$)|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|#[^\n]*'
+                         r'|(\.)?\s*([A-Za-z_]\w*)', re.S),
+}
+
+class CodeTokens:
+    """
+    代码块的标识符索引，各修复函数共用，不必对每个规则逐行做子串查找
+    names: 所有标识符（含关键字）
+    bare: 前面没有.、::、->限定的标识符
+    scoped: 以::限定的标识符（如std::vector中的vector）
+    qualifiers: 以"name."形式出现的非限定标识符（模块、类或对象名）
+    """
+    __slots__ = ('names', 'bare', 'scoped', 'qualifiers')
+
+    def __init__(self, code, family):
+        names, bare, scoped, qualifiers = set(), set(), set(), set()
+        for match in _TOKEN_PATTERNS[family].finditer(code):
+            name = match.group(2)
+            if name is None:
+                continue
+            names.add(name)
+            prefix = match.group(1)
+            if prefix is None:
+                bare.add(name)
+                if code.startswith('.', match.end()):
+                    qualifiers.add(name)
+            elif prefix == '::':
+                scoped.add(name)
+        self.names = frozenset(names)
+        self.bare = frozenset(bare)
+        self.scoped = frozenset(scoped)
+        self.qualifiers = frozenset(qualifiers)
+
+@functools.lru_cache(maxsize=256)
+def code_tokens(code, family='c'):
+    """代码块的CodeTokens，family为'c'（C/C++/Java的注释语法）或'python'"""
+    return CodeTokens(code, family)
+
+_INCLUDE_LINE = re.compile(r'\s*#\s*include\s*[<"]\s*([^>"]+?)\s*[>"]')
+_JAVA_IMPORT_LINE = re.compile(r'\s*import\s+(?:static\s+)?([\w.]+?)(\.\*)?\s*;')
+_PYTHON_IMPORT_LINE = re.compile(r'\s*(?:import|from)\s')
+_PYTHON_PLAIN_IMPORT = re.compile(r'\s*import\s+([\w.]+)\s*$')
+_PYTHON_FROM_IMPORT = re.compile(r'\s*from\s+[\w.]+\s+import\s+\(?([\w\s,]+)\)?\s*$')
 
 def fix_c_code(code):
     """修复和补全C代码"""
     lines = code.split('\n')
     result = []
     includes = set()
-    has_main = False
     brace_count = 0
     
-    # 检查必要的头文件
-    standard_headers = {
-        'printf': 'stdio.h',
-        'malloc': 'stdlib.h',
-        'strlen': 'string.h',
-        'memcpy': 'string.h',
-        'sqrt': 'math.h'
-    }
-    
     # 分析代码中使用的函数
-    for line in code.split('\n'):
-        for func, header in standard_headers.items():
-            if func in line and header not in includes:
-                includes.add(header)
-        if 'main' in line:
-            has_main = True
+    tokens = code_tokens(code)
+    includes.update(C_SYMBOLS[name] for name in tokens.bare if name in C_SYMBOLS)
+    has_main = 'main' in tokens.names
     
     # 添加必要的头文件
     for header in sorted(includes):
@@ -459,7 +891,8 @@ def fix_c_code(code):
     for line in lines:
         # 跳过已经存在的头文件包含
         if line.strip().startswith('#include'):
-            if not any(header in line for header in includes):
+            match = _INCLUDE_LINE.match(line)
+            if not match or match.group(1) not in includes:
                 result.append(line)
             continue
             
@@ -502,36 +935,20 @@ def fix_cpp_code(code):
     lines = code.split('\n')
     result = []
     includes = set()
-    has_namespace = False
-    has_main = False
     brace_count = 0
     
-    # 检查必要的头文件
-    standard_headers = {
-        'cout': 'iostream',
-        'vector': 'vector',
-        'string': 'string',
-        'map': 'map',
-        'set': 'set'
-    }
-    
-    # 分析代码中使用的特性
-    for line in code.split('\n'):
-        for feature, header in standard_headers.items():
-            if feature in line and header not in includes:
-                includes.add(header)
-        if 'namespace' in line:
-            has_namespace = True
-        if 'main' in line:
-            has_main = True
+    # 分析代码中使用的特性（std::vector中的vector同样需要头文件）
+    tokens = code_tokens(code)
+    includes.update(CPP_SYMBOLS[name] for name in tokens.bare | tokens.scoped if name in CPP_SYMBOLS)
+    has_namespace = 'namespace' in tokens.names
+    has_main = 'main' in tokens.names
     
     # 添加必要的头文件
     for header in sorted(includes):
         result.append(f'#include <{header}>')
     
-    # 添加命名空间声明
-    if not has_namespace and any('std::' not in line and ('cout' in line or 'cin' in line or 'string' in line) 
-                               for line in lines):
+    # 添加命名空间声明：有标准库名字没有加std::限定
+    if not has_namespace and not CPP_STD_NAMES.isdisjoint(tokens.bare):
         if result:
             result.append('')
         result.append('using namespace std;')
@@ -543,7 +960,8 @@ def fix_cpp_code(code):
     for line in lines:
         # 跳过已经存在的头文件包含
         if line.strip().startswith('#include'):
-            if not any(header in line for header in includes):
+            match = _INCLUDE_LINE.match(line)
+            if not match or match.group(1) not in includes:
                 result.append(line)
             continue
             
@@ -586,33 +1004,22 @@ def fix_java_code(code):
     lines = code.split('\n')
     result = []
     imports = set()
-    has_class = False
-    has_main = False
     brace_count = 0
     class_name = "Main"  # 默认类名
     
-    # 检查必要的导入
-    standard_imports = {
-        'Scanner': 'java.util.Scanner',
-        'List': 'java.util.List',
-        'ArrayList': 'java.util.ArrayList',
-        'Map': 'java.util.Map',
-        'HashMap': 'java.util.HashMap'
-    }
+    # 已经用通配符导入的包中的类不再单独导入
+    wildcard_packages = set()
+    for line in lines:
+        match = _JAVA_IMPORT_LINE.match(line)
+        if match and match.group(2):
+            wildcard_packages.add(match.group(1))
     
     # 分析代码中使用的类
-    for line in code.split('\n'):
-        for class_name, import_path in standard_imports.items():
-            if class_name in line and import_path not in imports:
-                imports.add(import_path)
-        if 'class' in line:
-            has_class = True
-            # 提取类名
-            match = re.search(r'class\s+(\w+)', line)
-            if match:
-                class_name = match.group(1)
-        if 'main' in line:
-            has_main = True
+    tokens = code_tokens(code)
+    imports.update(f'{JAVA_SYMBOLS[name]}.{name}' for name in tokens.bare
+                   if name in JAVA_SYMBOLS and JAVA_SYMBOLS[name] not in wildcard_packages)
+    has_class = 'class' in tokens.names
+    has_main = 'main' in tokens.names
     
     # 添加必要的导入
     for import_path in sorted(imports):
@@ -629,7 +1036,8 @@ def fix_java_code(code):
     for line in lines:
         # 跳过已经存在的导入语句
         if line.strip().startswith('import'):
-            if not any(imp in line for imp in imports):
+            match = _JAVA_IMPORT_LINE.match(line)
+            if not match or match.group(2) or match.group(1) not in imports:
                 result.append(line)
             continue
             
@@ -671,25 +1079,22 @@ def fix_python_code(code):
     lines = code.split('\n')
     result = []
     imports = set()
-    has_main = False
     current_indent = 0
     
-    # 检查必要的导入
-    standard_imports = {
-        'random': ['randint', 'choice', 'random'],
-        'math': ['sqrt', 'pi', 'sin', 'cos'],
-        'sys': ['argv', 'exit'],
-        'os': ['path', 'makedirs', 'remove'],
-        're': ['match', 'search', 'findall']
-    }
-    
-    # 分析代码中使用的模块
-    for line in code.split('\n'):
-        for module, features in standard_imports.items():
-            if any(feature in line for feature in features) and module not in imports:
-                imports.add(module)
-        if '__main__' in line:
-            has_main = True
+    # 已经通过from ... import导入的名字不再需要导入模块
+    imported_names = set()
+    for line in lines:
+        match = _PYTHON_FROM_IMPORT.match(line)
+        if match:
+            imported_names.update(name.split()[0] for name in match.group(1).split(',') if name.strip())
+    
+    # 分析代码中使用的模块：直接调用模块中的函数，或以"模块名."的形式使用
+    # 导入语句本身不参与分析，否则from random import randint中的random会被当作random()
+    tokens = code_tokens('\n'.join(line for line in lines if not _PYTHON_IMPORT_LINE.match(line)), 'python')
+    imports.update(PYTHON_SYMBOLS[name] for name in tokens.bare
+                   if name in PYTHON_SYMBOLS and name not in imported_names)
+    imports.update(name for name in tokens.qualifiers if name in PYTHON_MODULES and name not in imported_names)
+    has_main = '__main__' in code
     
     # 添加必要的导入
     for module in sorted(imports):
@@ -700,8 +1105,9 @@ def fix_python_code(code):
     # 处理每一行代码
     for line in lines:
         # 跳过已经存在的导入语句
-        if line.strip().startswith('import') or line.strip().startswith('from'):
-            if not any(module in line for module in imports):
+        if _PYTHON_IMPORT_LINE.match(line):
+            match = _PYTHON_PLAIN_IMPORT.match(line)
+            if not match or match.group(1) not in imports:
                 result.append(line)
             continue
         
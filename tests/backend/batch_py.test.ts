@@ -0,0 +1,49 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('batch PDF processing', () => {
+  const srcDir = path.resolve(__dirname, '../../src');
+
+  function runPython(args: string[]) {
+    return spawnSync('python', args, { cwd: srcDir, encoding: 'utf-8' });
+  }
+
+  const hasFitz = runPython(['-c', 'import fitz']).status === 0;
+
+  (hasFitz ? it : it.skip)('keeps same-named files in different subfolders apart', () => {
+    const root = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_batch_'));
+    const script = [
+      'import contextlib, fitz, json, os, sys',
+      'import pdf_test',
+      `root = ${JSON.stringify(root)}`,
+      'for week in ("week1", "week2"):',
+      '    os.makedirs(os.path.join(root, "in", week))',
+      '    doc = fitz.open()',
+      '    code = "#include <stdio.h>\\nint main() {\\n    printf(\\"%s\\");\\n    return 0;\\n}" % week',
+      '    doc.new_page().insert_text((72, 72), code, fontname="cour")',
+      '    doc.save(os.path.join(root, "in", week, "Lab.pdf"))',
+      '    doc.close()',
+      'results = []',
+      'with contextlib.redirect_stdout(sys.stderr):',
+      '    for _ in range(2):',
+      '        manifest = pdf_test.run_batch(os.path.join(root, "in"), os.path.join(root, "out"))',
+      '        results.append([[e["status"], e["json_path"]] for e in manifest["entries"]])',
+      'codes = [[block["code"] for block in json.load(open(path, encoding="utf-8"))] for _, path in results[0]]',
+      'print(json.dumps({"runs": results, "codes": codes}))',
+    ].join('\n');
+    const res = runPython(['-c', script]);
+    fs.rmSync(root, { recursive: true, force: true });
+    expect(res.status).toBe(0);
+    // 新版PyMuPDF会在stdout打印fitz弃用提示，只解析最后一行
+    const { runs, codes } = JSON.parse(res.stdout.trim().split('\n').pop()!);
+    const [first, second] = runs;
+    expect(first.map((entry: string[]) => entry[0])).toEqual(['done', 'done']);
+    expect(first[0][1]).not.toEqual(first[1][1]);
+    expect(codes[0].join()).toMatch(/week1/);
+    expect(codes[1].join()).toMatch(/week2/);
+    // 第二次运行两个文件都是最新的，输出路径不变
+    expect(second).toEqual([['skipped', first[0][1]], ['skipped', first[1][1]]]);
+  }, 60000);
+});
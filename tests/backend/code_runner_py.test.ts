@@ -0,0 +1,55 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('code_runner.py', () => {
+  const pyPath = path.resolve(__dirname, '../../src/code_runner.py');
+  const hasGcc = spawnSync('gcc', ['--version']).status === 0;
+  let cacheDir: string;
+
+  beforeEach(() => {
+    cacheDir = fs.mkdtempSync(path.join(os.tmpdir(), 'code_runner_'));
+  });
+
+  afterEach(() => {
+    fs.rmSync(cacheDir, { recursive: true, force: true });
+  });
+
+  function run(code: string, language: string, extra: string[] = []) {
+    const res = spawnSync('python', [pyPath, '-', '--language', language, '--cache-dir', cacheDir, ...extra],
+      { input: code, encoding: 'utf-8' });
+    expect(res.status).toBe(0);
+    return JSON.parse(res.stdout);
+  }
+
+  it('runs Python code', () => {
+    const result = run('print(6 * 7)', 'Python');
+    expect(result.status).toBe('ok');
+    expect(result.stdout.trim()).toBe('42');
+  });
+
+  (hasGcc ? it : it.skip)('reuses the compiled binary for the same C code', () => {
+    const code = '#include <stdio.h>\nint main() {\n    printf("hi");\n    return 0;\n}';
+    const first = run(code, 'C');
+    const second = run(code, 'C');
+    expect(first.stdout).toBe('hi');
+    expect(first.cached).toBe(false);
+    expect(second.stdout).toBe('hi');
+    expect(second.cached).toBe(true);
+  });
+
+  (hasGcc ? it : it.skip)('reports compile errors', () => {
+    const result = run('int main() { return x; }', 'C');
+    expect(result.status).toBe('compile_error');
+    expect(result.stderr).toMatch(/main\.c/);
+  });
+
+  it('stops runaway code at the timeout and output limit', () => {
+    const looping = run('while True: pass', 'Python', ['--timeout', '1']);
+    expect(looping.status).toBe('timeout');
+    const spamming = run('while True: print("spam")', 'Python', ['--output-limit', '1']);
+    expect(spamming.truncated).toBe(true);
+    expect(spamming.stdout.length).toBeLessThanOrEqual(1024);
+  }, 20000);
+});
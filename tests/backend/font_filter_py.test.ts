@@ -0,0 +1,66 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('monospace font filter', () => {
+  const srcDir = path.resolve(__dirname, '../../src');
+
+  function runPython(args: string[]) {
+    return spawnSync('python', args, { cwd: srcDir, encoding: 'utf-8' });
+  }
+
+  const hasFitz = runPython(['-c', 'import fitz']).status === 0;
+
+  (hasFitz ? it : it.skip)('still finds code on pages without monospace lines', () => {
+    const outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_test_'));
+    // 第1页只有一个Courier单词，第2页的代码用Helvetica排版
+    const script = [
+      'import contextlib, fitz, json, os, sys',
+      'import pdf_test',
+      `out = ${JSON.stringify(outDir)}`,
+      'doc = fitz.open()',
+      'doc.new_page().insert_text((72, 72), "Run the command ls to list files.", fontname="cour")',
+      'code = "#include <stdio.h>\\nint main() {\\n    printf(\\"hi\\");\\n    return 0;\\n}"',
+      'doc.new_page().insert_text((72, 72), code, fontname="helv")',
+      'doc.save(os.path.join(out, "mixed.pdf"))',
+      'doc.close()',
+      'with contextlib.redirect_stdout(sys.stderr):',
+      '    counts = [len(pdf_test.parse_pdf(out, "mixed.pdf", out, font_filter=flag)[1]) for flag in (True, False)]',
+      'print(json.dumps(counts))',
+    ].join('\n');
+    const res = runPython(['-c', script]);
+    fs.rmSync(outDir, { recursive: true, force: true });
+    expect(res.status).toBe(0);
+    // 新版PyMuPDF会在stdout打印fitz弃用提示，只解析最后一行
+    const [filtered, full] = JSON.parse(res.stdout.trim().split('\n').pop()!);
+    expect(full).toBe(1);
+    expect(filtered).toBe(full);
+  }, 60000);
+
+  (hasFitz ? it : it.skip)('falls back to the page text when the monospace lines hold no code', () => {
+    const outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_test_'));
+    // 同一页上方是一行Courier命令，下方的C程序用Helvetica排版
+    const script = [
+      'import contextlib, fitz, json, os, sys',
+      'import pdf_test',
+      `out = ${JSON.stringify(outDir)}`,
+      'doc = fitz.open()',
+      'page = doc.new_page()',
+      'page.insert_text((72, 72), "gcc hello.c -o hello && ./hello", fontname="cour")',
+      'code = "#include <stdio.h>\\nint main() {\\n    printf(\\"hi\\");\\n    return 0;\\n}"',
+      'page.insert_text((72, 100), code, fontname="helv")',
+      'doc.save(os.path.join(out, "command.pdf"))',
+      'doc.close()',
+      'with contextlib.redirect_stdout(sys.stderr):',
+      '    counts = [len(pdf_test.parse_pdf(out, "command.pdf", None, font_filter=flag)[1]) for flag in (True, False)]',
+      'print(json.dumps(counts))',
+    ].join('\n');
+    const res = runPython(['-c', script]);
+    fs.rmSync(outDir, { recursive: true, force: true });
+    expect(res.status).toBe(0);
+    const [filtered, full] = JSON.parse(res.stdout.trim().split('\n').pop()!);
+    expect(full).toBe(1);
+    expect(filtered).toBe(full);
+  }, 60000);
+});
@@ -0,0 +1,47 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('python startup cost', () => {
+  const srcDir = path.resolve(__dirname, '../../src');
+  // text_to_code 自身（含正则编译）的导入耗时上限，单位微秒
+  const IMPORT_BUDGET_US = 200000;
+
+  function runPython(args: string[]) {
+    return spawnSync('python', args, { cwd: srcDir, encoding: 'utf-8' });
+  }
+
+  const hasFitz = runPython(['-c', 'import fitz']).status === 0;
+
+  it('imports text_to_code within budget without loading pygments', () => {
+    const res = runPython(['-X', 'importtime', '-c', 'import text_to_code']);
+    expect(res.status).toBe(0);
+    const lines = res.stderr.split('\n');
+    const own = lines.find((line) => /\|\s*text_to_code\s*$/.test(line));
+    expect(own).toBeDefined();
+    const cumulative = Number(own!.split('|')[1].trim());
+    expect(cumulative).toBeLessThan(IMPORT_BUDGET_US);
+    expect(lines.some((line) => /\|\s*pygments\s*$/.test(line))).toBe(false);
+  });
+
+  (hasFitz ? it : it.skip)('processes a text-only PDF without loading easyocr or torch', () => {
+    const outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_test_'));
+    const script = [
+      'import contextlib, fitz, json, os, sys',
+      'import pdf_test',
+      `out = ${JSON.stringify(outDir)}`,
+      'doc = fitz.open()',
+      'page = doc.new_page()',
+      'page.insert_text((72, 72), "#include <stdio.h>\\nint main() {\\n    return 0;\\n}", fontname="cour")',
+      'doc.save(os.path.join(out, "text_only.pdf"))',
+      'with contextlib.redirect_stdout(sys.stderr):',
+      '    pdf_test.parse_pdf(out, "text_only.pdf", out)',
+      'print(json.dumps([name for name in ("easyocr", "torch") if name in sys.modules]))',
+    ].join('\n');
+    const res = runPython(['-c', script]);
+    fs.rmSync(outDir, { recursive: true, force: true });
+    expect(res.status).toBe(0);
+    expect(JSON.parse(res.stdout.trim())).toEqual([]);
+  });
+});
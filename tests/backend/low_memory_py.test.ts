@@ -0,0 +1,97 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('low-memory PDF processing', () => {
+  const srcDir = path.resolve(__dirname, '../../src');
+  // 页数增加10倍时峰值常驻内存允许的增长，单位MB
+  const GROWTH_BUDGET_MB = 16;
+
+  function runPython(args: string[]) {
+    return spawnSync('python', args, { cwd: srcDir, encoding: 'utf-8' });
+  }
+
+  // 新版PyMuPDF会在stdout打印fitz弃用提示，只解析最后一行
+  function lastJson(stdout: string) {
+    return JSON.parse(stdout.trim().split('\n').pop()!);
+  }
+
+  const hasFitz = runPython(['-c', 'import fitz, resource']).status === 0;
+  const hasOcr = runPython(['-c', 'import fitz, easyocr, PIL']).status === 0;
+
+  // 在独立进程中生成PDF，识别时的峰值内存不包含生成PDF的开销
+  function buildPdf(outDir: string, lines: string[]) {
+    const script = [
+      'import fitz, io, os',
+      `out = ${JSON.stringify(outDir)}`,
+      'doc = fitz.open()',
+      ...lines,
+      'doc.save(os.path.join(out, "big.pdf"))',
+      'doc.close()',
+    ].join('\n');
+    expect(runPython(['-c', script]).status).toBe(0);
+  }
+
+  // 在另一个独立进程中识别，返回[代码块数, 峰值常驻内存MB, 图片统计]
+  function parse(outDir: string, options: string) {
+    const script = [
+      'import contextlib, json, resource, sys',
+      'import pdf_test',
+      `out = ${JSON.stringify(outDir)}`,
+      'summary = {}',
+      'with contextlib.redirect_stdout(sys.stderr):',
+      `    _, blocks = pdf_test.parse_pdf(out, "big.pdf", out, on_event=summary.update, ${options})`,
+      'print(json.dumps([len(blocks), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, summary["images"]]))',
+    ].join('\n');
+    const res = runPython(['-c', script]);
+    expect(res.status).toBe(0);
+    return lastJson(res.stdout);
+  }
+
+  function peakRss(pages: number): [number, number] {
+    const outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_test_'));
+    try {
+      buildPdf(outDir, [
+        `for i in range(${pages}):`,
+        '    code = "#include <stdio.h>\\nint main() {\\n    printf(\\"%d\\");\\n    return 0;\\n}" % i',
+        '    doc.new_page().insert_text((72, 72), code, fontname="cour")',
+      ]);
+      const [blocks, peak] = parse(outDir, 'low_memory=True');
+      return [blocks, peak];
+    } finally {
+      fs.rmSync(outDir, { recursive: true, force: true });
+    }
+  }
+
+  (hasFitz ? it : it.skip)('keeps peak memory flat as the page count grows', () => {
+    const [smallBlocks, smallPeak] = peakRss(20);
+    const [largeBlocks, largePeak] = peakRss(200);
+    expect(smallBlocks).toBeGreaterThan(0);
+    expect(largeBlocks).toBeGreaterThan(smallBlocks);
+    expect(largePeak - smallPeak).toBeLessThan(GROWTH_BUDGET_MB);
+  }, 120000);
+
+  (hasOcr ? it : it.skip)('pauses image OCR once the memory limit is exceeded', () => {
+    const outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_test_'));
+    try {
+      // 每页一张代码截图；1MB的上限在加载OCR模型后必然被超出
+      buildPdf(outDir, [
+        'from PIL import Image, ImageDraw',
+        'for i in range(6):',
+        '    img = Image.new("RGB", (480, 160), "white")',
+        '    draw = ImageDraw.Draw(img)',
+        '    for k, line in enumerate(["int main() {", "    int x = %d;" % i, "    return x;", "}"]):',
+        '        draw.text((10, 10 + 30 * k), line, fill="black")',
+        '    buf = io.BytesIO()',
+        '    img.save(buf, "PNG")',
+        '    doc.new_page().insert_image(fitz.Rect(72, 72, 552, 232), stream=buf.getvalue())',
+      ]);
+      const [, , images] = parse(outDir, 'ocr_batch=4, memory_limit=1024 * 1024');
+      expect(images.ocr_calls).toBeGreaterThan(0);
+      expect(images.ocr_paused).toBeGreaterThanOrEqual(images.ocr_calls);
+    } finally {
+      fs.rmSync(outDir, { recursive: true, force: true });
+    }
+  }, 300000);
+});
@@ -0,0 +1,60 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('output_writer.py', () => {
+  const srcDir = path.resolve(__dirname, '../../src');
+  let outDir: string;
+
+  beforeEach(() => {
+    outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'output_writer_'));
+  });
+
+  afterEach(() => {
+    fs.rmSync(outDir, { recursive: true, force: true });
+  });
+
+  // 依次以给出的代码块输出各文档，返回输出目录中的代码块文件
+  function write(runs: [string, string[]][], options: string) {
+    const script = [
+      'import json, os, sys',
+      'from output_writer import OutputWriter',
+      `out = ${JSON.stringify(outDir)}`,
+      'for doc, codes in json.loads(sys.stdin.read()):',
+      `    writer = OutputWriter(out, os.path.join(out, doc + "_code_block.json"), ${options})`,
+      '    for i, code in enumerate(codes):',
+      '        writer.add({"path": os.path.join(out, "%s_Page_%d_0.c" % (doc, i + 1)), "code": code})',
+      '    writer.commit()',
+    ].join('\n');
+    const res = spawnSync('python', ['-c', script], { cwd: srcDir, input: JSON.stringify(runs), encoding: 'utf-8' });
+    expect(res.status).toBe(0);
+    return fs.readdirSync(outDir).filter((name) => !name.endsWith('.json')).sort();
+  }
+
+  it('removes block files left over from a previous run with more blocks', () => {
+    const files = write([['deck', ['a', 'b', 'c']], ['deck', ['a']]], 'dedup=False');
+    expect(files).toEqual(['deck_Page_1_0.c']);
+  });
+
+  it('removes a previous run\'s block files once they move into an archive', () => {
+    write([['deck', ['a', 'b']]], 'dedup=False');
+    const files = write([['deck', ['a']]], `archive_path=os.path.join(out, "deck_code_blocks.zip")`);
+    expect(files).toEqual(['deck_code_blocks.zip']);
+  });
+
+  it('keeps content-named files that another document still uses', () => {
+    const files = write([['deck', ['a', 'b']], ['other', ['a', 'b']], ['deck', ['a']]], 'dedup=True');
+    expect(files).toHaveLength(2);
+    const alone = write([['other', []]], 'dedup=True');
+    expect(alone).toHaveLength(1);
+  });
+
+  it('keeps shared content-named files when a document is rewritten without dedup', () => {
+    write([['deck', ['a', 'b']], ['other', ['a', 'b']]], 'dedup=True');
+    const files = write([['deck', ['a']]], 'dedup=False');
+    // other仍引用按内容命名的两个文件，deck改为按页命名
+    expect(files.filter((name) => name.startsWith('deck_'))).toEqual(['deck_Page_1_0.c']);
+    expect(files).toHaveLength(3);
+  });
+});
@@ -0,0 +1,70 @@
+import { spawnSync } from 'child_process';
+import fs from 'fs';
+import os from 'os';
+import path from 'path';
+
+describe('page triage', () => {
+  const srcDir = path.resolve(__dirname, '../../src');
+
+  function runPython(args: string[]) {
+    return spawnSync('python', args, { cwd: srcDir, encoding: 'utf-8' });
+  }
+
+  const hasFitz = runPython(['-c', 'import fitz, numpy']).status === 0;
+  const hasNumpy = runPython(['-c', 'import numpy']).status === 0;
+
+  const PROSE = [
+    'This lecture introduces the basic control structures used in most programs, one at a time.',
+    'Each example below is followed by a short discussion of its output and of common mistakes.',
+    'Remember to compile with warnings enabled and read every message the compiler prints carefully.',
+    'The exercise at the end of the section asks you to extend the program with a second loop.',
+    'Loops repeat a block of statements until the condition becomes false, then the program continues.',
+  ];
+  // 去掉缩进的完整C程序，与文字用同一种比例字体
+  const CODE = ['#include <stdio.h>', 'int main() {', 'printf("hello, world\\n");', 'return 0;', '}'];
+
+  (hasNumpy ? it : it.skip)('scores code on a page by its best line window, not the page average', () => {
+    const script = [
+      'import json, sys',
+      'from page_triage import page_features, triage_scores, FEATURE_WEIGHTS',
+      'prose, code = json.loads(sys.stdin.read())',
+      'texts = ["\\n".join(prose + [""] + code), "\\n".join(prose)]',
+      'print(json.dumps([triage_scores(texts).tolist(), (page_features(texts) @ FEATURE_WEIGHTS).tolist()]))',
+    ].join('\n');
+    const res = spawnSync('python', ['-c', script],
+      { cwd: srcDir, input: JSON.stringify([PROSE, CODE]), encoding: 'utf-8' });
+    expect(res.status).toBe(0);
+    const [[slide, prose], [slideAverage]] = JSON.parse(res.stdout);
+    // 整页平均时文字把代码页拉到默认阈值以下
+    expect(slideAverage).toBeLessThan(0.15);
+    expect(slide).toBeGreaterThan(0.5);
+    expect(prose).toBeLessThan(0.15);
+  });
+
+  (hasFitz ? it : it.skip)('keeps code that shares a slide with prose and reports skipped pages', () => {
+    const outDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pdf_triage_'));
+    const script = [
+      'import contextlib, fitz, json, os, sys',
+      'import pdf_test',
+      `out = ${JSON.stringify(outDir)}`,
+      'prose, code = json.loads(sys.stdin.read())',
+      'doc = fitz.open()',
+      'doc.new_page().insert_text((72, 72), "\\n".join(prose + [""] + code), fontname="helv")',
+      'doc.new_page().insert_text((72, 72), "\\n".join(prose), fontname="helv")',
+      'doc.save(os.path.join(out, "slide.pdf"))',
+      'doc.close()',
+      'summary = {}',
+      'with contextlib.redirect_stdout(sys.stderr):',
+      '    _, blocks = pdf_test.parse_pdf(out, "slide.pdf", None, on_event=summary.update)',
+      'print(json.dumps([len(blocks), summary["triage_skipped"]]))',
+    ].join('\n');
+    const res = spawnSync('python', ['-c', script],
+      { cwd: srcDir, input: JSON.stringify([PROSE, CODE]), encoding: 'utf-8' });
+    fs.rmSync(outDir, { recursive: true, force: true });
+    expect(res.status).toBe(0);
+    // 新版PyMuPDF会在stdout打印fitz弃用提示，只解析最后一行
+    const [blocks, skipped] = JSON.parse(res.stdout.trim().split('\n').pop()!);
+    expect(blocks).toBe(1);
+    expect(skipped).toBe(1);
+  }, 60000);
+});
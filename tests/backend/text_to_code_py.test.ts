@@ -9,6 +9,20 @@ describe('text_to_code.py functions', () => {
     return res.stdout + res.stderr;
   }
 
+  // 在src目录下调用text_to_code中的函数，参数和返回值经JSON传递
+  function callFunction(name: string, ...args: string[]) {
+    const script = [
+      'import json, sys',
+      'import text_to_code',
+      `print(json.dumps(text_to_code.${name}(*json.loads(sys.stdin.read()))))`,
+    ].join('\n');
+    const res = spawnSync('python', ['-c', script], {
+      cwd: path.dirname(pyPath), input: JSON.stringify(args), encoding: 'utf-8',
+    });
+    expect(res.status).toBe(0);
+    return JSON.parse(res.stdout);
+  }
+
   it('should detect Python code', () => {
     const code = 'def foo():\n    print("hi")';
     const out = callCheckCode(code);
@@ -32,4 +46,168 @@ describe('text_to_code.py functions', () => {
     const out = callCheckCode(code);
     expect(out).toMatch(/Unknown/);
   });
-}); 
\ No newline at end of file
+
+  describe('format_code', () => {
+    it('re-indents by brace depth and spaces operators', () => {
+      const code = 'int main(){\nif(x>0){\ny=x*2;\n}\nreturn 0;\n}';
+      expect(callFunction('format_code', code, 'C')).toBe(
+        'int main() {\n    if (x > 0) {\n        y = x * 2;\n    }\n    return 0;\n}');
+    });
+
+    it('replaces broken indentation instead of adding to it', () => {
+      expect(callFunction('format_code', '  int main() {\n        int a=1;\n  }', 'C'))
+        .toBe('int main() {\n    int a = 1;\n}');
+    });
+
+    it('keeps template brackets and stream operators apart', () => {
+      expect(callFunction('format_code', 'vector<int> v;\ncout<<v.size()<<endl;', 'C++'))
+        .toBe('vector<int> v;\ncout << v.size() << endl;');
+    });
+
+    it('leaves braces and // inside string literals alone', () => {
+      const code = 'int main() {\nprintf("{ not a block // nor a comment }");\nreturn 0;\n}';
+      expect(callFunction('format_code', code, 'C')).toBe(
+        'int main() {\n    printf("{ not a block // nor a comment }");\n    return 0;\n}');
+      expect(callFunction('format_code', "char c = '{';\nint x=1;", 'C')).toBe("char c = '{';\nint x = 1;");
+      expect(callFunction('format_code', 'class A {\nvoid f() {\nString s = "}";\n}\n}', 'Java')).toBe(
+        'class A {\n    void f() {\n        String s = "}";\n    }\n}');
+    });
+
+    it('keeps comments verbatim and out of the brace count', () => {
+      expect(callFunction('format_code', 'int x=1; // keep  a=b  {\n/* y=2 { */\nint z=3;', 'C'))
+        .toBe('int x = 1;  // keep  a=b  {\n/* y=2 { */\nint z = 3;');
+      const block = 'int main() {\n/* open {\n   still { comment */\nint x=1;\n}\nint y;';
+      expect(callFunction('format_code', block, 'C'))
+        .toBe('int main() {\n    /* open {\n   still { comment */\n    int x = 1;\n}\nint y;');
+    });
+
+    it('keeps Python indentation, strings and comments', () => {
+      const code = 'def f(a,b):\n    s = "a{b}//c"\n    return a+b  # sum  x=1';
+      expect(callFunction('format_code', code, 'Python'))
+        .toBe('def f(a, b):\n    s = "a{b}//c"\n    return a + b  # sum  x=1');
+    });
+
+    it('spaces annotated defaults but not plain keyword arguments', () => {
+      const code = 'def f(x: int=3, y=4, z: List[int]=None):\n    return g(k=1)';
+      expect(callFunction('format_code', code, 'Python'))
+        .toBe('def f(x: int = 3, y=4, z: List[int] = None):\n    return g(k=1)');
+    });
+
+    it('treats the operator after a cast as unary', () => {
+      const code = 'int a = (int)*p;\ndouble d = (double)-x;\nint n = sizeof(int)*k;\nint m = (a)*b;';
+      expect(callFunction('format_code', code, 'C'))
+        .toBe('int a = (int) *p;\ndouble d = (double) -x;\nint n = sizeof(int) * k;\nint m = (a) * b;');
+    });
+
+    it('leaves preprocessor lines untouched', () => {
+      expect(callFunction('format_code', '#include <stdio.h>\nint main(){\nreturn 0;\n}', 'C'))
+        .toBe('#include <stdio.h>\nint main() {\n    return 0;\n}');
+    });
+  });
+
+  describe('code_tokens', () => {
+    function tokens(code: string, family: string) {
+      const script = [
+        'import json, sys',
+        'import text_to_code',
+        'code, family = json.loads(sys.stdin.read())',
+        'tokens = text_to_code.code_tokens(code, family)',
+        'print(json.dumps({key: sorted(getattr(tokens, key)) for key in ("bare", "scoped", "qualifiers")}))',
+      ].join('\n');
+      const res = spawnSync('python', ['-c', script], {
+        cwd: path.dirname(pyPath), input: JSON.stringify([code, family]), encoding: 'utf-8',
+      });
+      expect(res.status).toBe(0);
+      return JSON.parse(res.stdout);
+    }
+
+    it('splits C-family names by qualifier and skips strings and comments', () => {
+      const code = 'std::vector<int> v; p->next = obj.size(); // printf\nchar *s = "malloc";';
+      expect(tokens(code, 'c')).toEqual({
+        bare: ['char', 'int', 'obj', 'p', 's', 'std', 'v'],
+        scoped: ['vector'],
+        qualifiers: ['obj'],
+      });
+    });
+
+    it('uses Python comment and string syntax', () => {
+      const code = 'x = math.sqrt(2)  # json.dumps\ns = "os.path"\nprint(x)';
+      expect(tokens(code, 'python')).toEqual({
+        bare: ['math', 'print', 's', 'x'],
+        scoped: [],
+        qualifiers: ['math'],
+      });
+    });
+  });
+
+  // 推断出的头文件和导入与按子串查找的旧修复函数一致，只是注释、字符串和导入语句中的名字不再算作用到
+  describe('fixers', () => {
+    it('adds the C headers for the functions used', () => {
+      const code = 'int main() {\n    char *s = malloc(10);\n    printf("%d", strlen(s));\n    return 0;\n}';
+      expect(callFunction('fix_c_code', code)).toBe(
+        '#include <stdio.h>\n#include <stdlib.h>\n#include <string.h>\n\n' +
+        'int main() {\n    char *s = malloc(10);\n    printf("%d", strlen(s));\n    return 0;\n}');
+    });
+
+    it('ignores C function names inside strings and comments', () => {
+      const code = 'int main() {\n    // malloc();\n    puts("strlen");\n    return 0;\n}';
+      const fixed = callFunction('fix_c_code', code);
+      expect(fixed).toMatch(/^#include <stdio.h>\n\nint main/);
+      expect(fixed).not.toContain('stdlib.h');
+      expect(fixed).not.toContain('string.h');
+    });
+
+    it('adds C++ headers and using namespace std for bare names', () => {
+      const code = 'int main() {\n    vector<int> v;\n    cout << v.size() << endl;\n    return 0;\n}';
+      expect(callFunction('fix_cpp_code', code)).toBe(
+        '#include <iostream>\n#include <vector>\n\nusing namespace std;\n\n' +
+        'int main() {\n    vector<int> v;\n    cout << v.size() << endl;\n    return 0;\n}');
+    });
+
+    it('adds C++ headers for std:: names without using namespace std', () => {
+      const code = 'int main() {\n    std::vector<int> v;\n    std::cout << v[0];\n}';
+      expect(callFunction('fix_cpp_code', code)).toBe(
+        '#include <iostream>\n#include <vector>\n\nint main() {\n    std::vector<int> v;\n    std::cout << v[0];\n}');
+    });
+
+    it('adds Java imports unless the package is imported with a wildcard', () => {
+      const code = 'public class Main {\n    public static void main(String[] args) {\n' +
+        '        Scanner sc = new Scanner(System.in);\n        List<Integer> xs = new ArrayList<>();\n    }\n}';
+      expect(callFunction('fix_java_code', code)).toBe(
+        'import java.util.ArrayList;\nimport java.util.List;\nimport java.util.Scanner;\n\n' + code);
+      const wildcard = 'import java.util.*;\npublic class A {\n    public static void main(String[] args) {\n' +
+        '        Map<String, Integer> m = new HashMap<>();\n    }\n}';
+      expect(callFunction('fix_java_code', wildcard)).toBe(wildcard);
+    });
+
+    it('adds Python imports for module functions and module attributes', () => {
+      expect(callFunction('fix_python_code', 'x = math.sqrt(2)\nprint(randint(1, 6))'))
+        .toBe('import math\nimport random\n\nx = math.sqrt(2)\nprint(randint(1, 6))');
+    });
+
+    it('does not import a module whose names are already imported with from', () => {
+      const code = 'from random import randint\nprint(randint(1, 2))';
+      expect(callFunction('fix_python_code', code)).toBe(code);
+    });
+  });
+
+  describe('is_valid_code', () => {
+    const hasPygments = spawnSync('python', ['-c', 'import pygments']).status === 0;
+    const prose = 'Bring a pen to the lab.\nThe room opens at nine.\nSee the course page for details.';
+
+    (hasPygments ? it : it.skip)('rejects multi-line text without code, as the guess_lexer version did', () => {
+      // 旧实现只在guess_lexer抛出ClassNotFound时按行数接受，而guess_lexer总能给出某个词法分析器
+      // （最差退回到TextLexer），这里给出的不是C/C++/Java/Python，旧实现同样判为不是代码
+      const res = spawnSync('python', ['-c',
+        'import sys; from pygments.lexers import guess_lexer; print(guess_lexer(sys.stdin.read()).name)'],
+      { input: prose, encoding: 'utf-8' });
+      expect(res.status).toBe(0);
+      expect(['C', 'C++', 'Java', 'Python']).not.toContain(res.stdout.trim());
+      expect(callFunction('is_valid_code', prose)).toBe(false);
+    });
+
+    it('accepts blocks with common code markers', () => {
+      expect(callFunction('is_valid_code', 'x = compute()\nreturn x')).toBe(true);
+    });
+  });
+});